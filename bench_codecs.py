@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Codec Benchmark
+Compares the WebSocket wire codecs (JSON, fast JSON, MessagePack) on the
+frame shapes the pub/sub server actually sends and receives
+"""
+
+import json
+import os
+import sys
+import time
+import uuid
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pubsub_project.settings')
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pubsub import rawjson
+from pubsub.codecs import CODECS
+
+TIMESTAMP = "2024-01-15T10:30:00.123456+00:00"
+
+
+def order_payload(items):
+    """Order-like payload with a number of line items"""
+    return {
+        "order_id": "ORD-123",
+        "customer": {"id": 4711, "name": "Jane Doe", "tier": "gold"},
+        "amount": "99.50",
+        "currency": "USD",
+        "items": [
+            {"sku": f"SKU-{i}", "qty": i % 5 + 1, "price": 9.95, "tags": ["sale", "eu"]}
+            for i in range(items)
+        ],
+    }
+
+
+def message_frame(payload):
+    """Outbound 'message' frame as broadcast to subscribers"""
+    return {
+        "type": "message",
+        "topic": "orders",
+        "message": {"id": str(uuid.uuid4()), "payload": payload, "timestamp": TIMESTAMP},
+        "publisher_client_id": "publisher1",
+    }
+
+
+FRAMES = {
+    "publish (inbound)": {
+        "type": "publish",
+        "topic": "orders",
+        "client_id": "publisher1",
+        "message": {"id": str(uuid.uuid4()), "payload": order_payload(3)},
+        "request_id": str(uuid.uuid4()),
+    },
+    "published ack": {
+        "type": "published",
+        "topic": "orders",
+        "message_id": str(uuid.uuid4()),
+        "client_id": "publisher1",
+        "request_id": str(uuid.uuid4()),
+        "status": "success",
+        "timestamp": TIMESTAMP,
+    },
+    "message (small)": message_frame({"order_id": "ORD-123", "amount": "99.50"}),
+    "message (3 items)": message_frame(order_payload(3)),
+    "message (50 items)": message_frame(order_payload(50)),
+    "message_batch (100)": {
+        "type": "message_batch",
+        "topic": "orders",
+        "messages": [
+            {"id": str(uuid.uuid4()), "payload": order_payload(3), "timestamp": TIMESTAMP}
+            for _ in range(100)
+        ],
+        "publisher_client_id": "publisher1",
+    },
+}
+
+
+def measure(fn, arg, min_time=0.2):
+    """Average seconds per call, repeating until at least min_time has passed"""
+    runs = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < min_time:
+        for _ in range(100):
+            fn(arg)
+        runs += 100
+        elapsed = time.perf_counter() - start
+    return elapsed / runs
+
+
+def publish_path_copy(frame_text):
+    """Decode a publish, re-encode the message for storage and the frame for subscribers"""
+    data = json.loads(frame_text)
+    message = data['message']
+    stored = json.dumps(message)
+    return stored, json.dumps(message_frame(message.get('payload', {})))
+
+
+def publish_path_raw(frame_text):
+    """Decode a publish keeping source text; store and forward the payload verbatim"""
+    data = rawjson.loads(frame_text)
+    message = data['message']
+    stored = message.text()
+    return stored, rawjson.dumps(message_frame(message.raw('payload')))
+
+
+def main():
+    print(f"🔬 Codecs available: {', '.join(CODECS)}")
+    print()
+    header = f"{'frame':<22}{'codec':<12}{'bytes':>8}{'encode µs':>12}{'decode µs':>12}"
+    print(header)
+    print("-" * len(header))
+
+    for frame_name, frame in FRAMES.items():
+        for codec_name, codec in CODECS.items():
+            encoded = codec.encode(frame)
+            size = len(encoded.encode('utf-8') if isinstance(encoded, str) else encoded)
+            encode_us = measure(codec.encode, frame) * 1e6
+            decode_us = measure(codec.decode, encoded) * 1e6
+            print(f"{frame_name:<22}{codec_name:<12}{size:>8}{encode_us:>12.2f}{decode_us:>12.2f}")
+        print()
+
+    # Whole JSON publish path: decode + store + one subscriber frame
+    header = f"{'publish path':<22}{'bytes':>8}{'re-encode µs':>14}{'raw µs':>10}"
+    print(header)
+    print("-" * len(header))
+    for items in (0, 3, 8, 16, 50):
+        frame = dict(FRAMES["publish (inbound)"])
+        frame["message"] = {"id": str(uuid.uuid4()), "payload": order_payload(items)}
+        frame_text = json.dumps(frame)
+        copy_us = measure(publish_path_copy, frame_text) * 1e6
+        raw_us = measure(publish_path_raw, frame_text) * 1e6
+        print(f"{f'{items} items':<22}{len(frame_text):>8}{copy_us:>14.2f}{raw_us:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import threading
+from datetime import datetime, timezone as dt_timezone
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Case, DateTimeField, F, Value, When
+from django.utils import timezone
+from .models import Connection
+from .periodic import PeriodicFlusher
+
+
+class ConnectionActivity(PeriodicFlusher):
+    """
+    Coalesces Connection.last_activity writes.
+    Frames only record the connection's activity time in memory, rounded down
+    to the configured granularity. Every interval all touched connections are
+    written with one UPDATE.
+    """
+
+    def __init__(self, interval=None, granularity=None):
+        super().__init__(interval or getattr(settings, 'PUBSUB_ACTIVITY_FLUSH_INTERVAL', 5.0))
+        self.granularity = granularity or getattr(settings, 'PUBSUB_ACTIVITY_GRANULARITY', 1)
+        self._lock = threading.Lock()
+        self._pending = {}  # {connection_id: last_activity}
+
+    def _bucket(self, now):
+        """Round a timestamp down to the configured granularity (seconds)"""
+        seconds = int(now.timestamp()) // self.granularity * self.granularity
+        return datetime.fromtimestamp(seconds, tz=dt_timezone.utc)
+
+    def touch(self, connection_id):
+        """Record activity on a connection"""
+        with self._lock:
+            self._pending[connection_id] = self._bucket(timezone.now())
+        self.ensure_started()
+
+    def discard(self, connection_id):
+        """Forget pending activity for a closed connection"""
+        with self._lock:
+            self._pending.pop(connection_id, None)
+
+    async def flush(self):
+        """Write all pending activity in one UPDATE"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+        try:
+            await self._write(batch)
+        except Exception:
+            # Keep the activity for the next interval, unless newer was recorded meanwhile
+            with self._lock:
+                for connection_id, last_activity in batch.items():
+                    newer = self._pending.get(connection_id)
+                    if newer is None or last_activity > newer:
+                        self._pending[connection_id] = last_activity
+            raise
+        return True
+
+    @database_sync_to_async
+    def _write(self, batch):
+        """UPDATE ... SET last_activity = CASE ... for every touched connection"""
+        Connection.objects.filter(pk__in=list(batch)).update(last_activity=Case(
+            *[When(pk=pk, then=Value(last_activity)) for pk, last_activity in batch.items()],
+            default=F('last_activity'), output_field=DateTimeField()
+        ))
+
+    def get_stats(self):
+        """Get activity tracker statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_connections": pending,
+            "flushes": self.flushes,
+            "interval": self.interval,
+            "granularity": self.granularity,
+        }
+
+
+connection_activity = ConnectionActivity()
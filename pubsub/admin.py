@@ -2,7 +2,7 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils.safestring import mark_safe
-from .models import Topic, Connection, TopicSubscription, Message
+from .models import Topic, Connection, TopicSubscription, DurableSubscription, Message
 
 
 @admin.register(Topic)
@@ -97,20 +97,34 @@ class TopicSubscriptionAdmin(admin.ModelAdmin):
         return super().get_queryset(request).select_related('topic', 'connection')
 
 
+@admin.register(DurableSubscription)
+class DurableSubscriptionAdmin(admin.ModelAdmin):
+    list_display = [
+        'client_id', 'topic', 'last_offset', 'created_at', 'updated_at'
+    ]
+    list_filter = ['created_at', 'updated_at']
+    search_fields = ['client_id', 'topic__name']
+    readonly_fields = ['created_at', 'updated_at']
+    ordering = ['client_id']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('topic')
+
+
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = [
-        'id', 'topic', 'publisher_connection', 'data_short', 
+        'id', 'topic', 'sequence', 'publisher_connection', 'data_short', 
         'published_at', 'delivery_attempts'
     ]
     list_filter = ['published_at', 'delivery_attempts', 'topic__is_active']
     search_fields = ['topic__name', 'data', 'publisher_connection__id']
-    readonly_fields = ['id', 'published_at']
+    readonly_fields = ['id', 'sequence', 'published_at']
     ordering = ['-published_at']
     
     fieldsets = (
         ('Message Information', {
-            'fields': ('id', 'topic', 'publisher_connection', 'data')
+            'fields': ('id', 'topic', 'sequence', 'publisher_connection', 'data')
         }),
         ('Delivery Status', {
             'fields': ('delivery_attempts', 'max_delivery_attempts'),
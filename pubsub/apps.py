@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class PubsubConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'pubsub'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (connects the model signal handlers)
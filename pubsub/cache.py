@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .control import control_channel
+
+# Control event that tells every worker to drop a topic from its cache
+INVALIDATE_TOPIC_EVENT = 'pubsub.invalidate_topic'
+
+
+class TopicCache:
+    """
+    In-process LRU cache of Topic instances keyed by name.
+    A hit lets publish/subscribe skip the database round-trip entirely.
+    Entries are invalidated explicitly when topics are created or deleted.
+    """
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size or getattr(settings, 'PUBSUB_TOPIC_CACHE_SIZE', 10000)
+        self._lock = threading.Lock()  # views invalidate from sync threads
+        self._topics = OrderedDict()  # {topic_name: Topic}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, topic_name):
+        """Get a cached topic (or None), marking it most recently used"""
+        with self._lock:
+            topic = self._topics.get(topic_name)
+            if topic is None:
+                self.misses += 1
+                return None
+            self._topics.move_to_end(topic_name)
+            self.hits += 1
+            return topic
+
+    def put(self, topic):
+        """Cache a topic, evicting the least recently used entry if full"""
+        with self._lock:
+            self._topics[topic.name] = topic
+            self._topics.move_to_end(topic.name)
+            while len(self._topics) > self.max_size:
+                self._topics.popitem(last=False)
+
+    def invalidate(self, topic_name):
+        """Drop a topic from this worker's cache"""
+        with self._lock:
+            self._topics.pop(topic_name, None)
+
+    def clear(self):
+        """Drop every cached topic"""
+        with self._lock:
+            self._topics.clear()
+
+    def get_stats(self):
+        """Get cache statistics"""
+        with self._lock:
+            size = len(self._topics)
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+topic_cache = TopicCache()
+
+control_channel.register(
+    INVALIDATE_TOPIC_EVENT, lambda event: topic_cache.invalidate(event['topic'])
+)
+
+
+def invalidate_topic(topic_name):
+    """Invalidate a topic in this worker's cache and broadcast to the other workers"""
+    topic_cache.invalidate(topic_name)
+    control_channel.broadcast_sync({"type": INVALIDATE_TOPIC_EVENT, "topic": topic_name})
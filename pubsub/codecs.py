@@ -0,0 +1,200 @@
+import json
+from django.conf import settings
+from . import rawjson
+
+try:
+    import orjson
+except ImportError:  # optional: the fast JSON codec is simply not offered
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # installed with channels-redis, but not strictly required
+    msgpack = None
+
+# Wire formats; codecs sharing a wire format produce interchangeable frames
+WIRE_JSON = 'json'
+WIRE_MSGPACK = 'msgpack'
+
+
+class DecodeError(ValueError):
+    """Raised when an incoming frame can't be decoded by the connection's codec"""
+
+
+class Codec:
+    """Encodes/decodes WebSocket frames for one negotiated subprotocol"""
+
+    name = None
+    subprotocol = None
+    wire = WIRE_JSON
+    label = 'JSON'  # used in error messages
+    binary = False  # True: frames go out as bytes_data, otherwise text_data
+
+    def decode(self, data):
+        raise NotImplementedError
+
+    def encode(self, obj):
+        raise NotImplementedError
+
+
+class JSONCodec(Codec):
+    """
+    Standard library JSON (the default).
+    Frames of at least PUBSUB_RAW_PAYLOAD_MIN_BYTES are decoded with rawjson,
+    which keeps the source text of publish messages so payloads are stored
+    and forwarded without being encoded again. Below that size the extra
+    scanning costs more than the re-encoding it saves.
+    """
+
+    name = 'json'
+    subprotocol = 'pubsub.json'
+
+    def __init__(self):
+        self.raw_min_bytes = getattr(settings, 'PUBSUB_RAW_PAYLOAD_MIN_BYTES', 512)
+
+    def decode(self, data):
+        try:
+            if self.raw_min_bytes is not None and len(data) >= self.raw_min_bytes:
+                return rawjson.loads(data)
+            return json.loads(data)
+        except (ValueError, TypeError) as e:
+            raise DecodeError(str(e))
+
+    def encode(self, obj):
+        return json.dumps(obj)
+
+
+class FastJSONCodec(Codec):
+    """JSON through orjson; same wire format, less CPU per frame"""
+
+    name = 'json.fast'
+    subprotocol = 'pubsub.json.fast'
+
+    def decode(self, data):
+        try:
+            return orjson.loads(data)
+        except (ValueError, TypeError) as e:
+            raise DecodeError(str(e))
+
+    def encode(self, obj):
+        # orjson returns bytes; text frames need str
+        return orjson.dumps(obj).decode('utf-8')
+
+
+class MessagePackCodec(Codec):
+    """MessagePack over binary frames: smaller frames, faster to parse"""
+
+    name = 'msgpack'
+    subprotocol = 'pubsub.msgpack'
+    wire = WIRE_MSGPACK
+    label = 'MessagePack'
+    binary = True
+
+    def decode(self, data):
+        if isinstance(data, str):
+            raise DecodeError("MessagePack frames must be binary")
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as e:
+            raise DecodeError(str(e))
+
+    def encode(self, obj):
+        return msgpack.packb(obj, use_bin_type=True)
+
+
+def is_json_compatible(value):
+    """
+    True if a decoded value can be stored as JSON without loss. MessagePack
+    can carry what JSON can't (bin and ext values, non-string map keys).
+    """
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            if not all(isinstance(key, str) for key in value):
+                return False
+            stack.extend(value.values())
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif value is not None and not isinstance(value, (str, int, float)):
+            return False
+    return True
+
+
+def available_codecs():
+    """Get the codecs usable in this process, by name"""
+    codecs = {JSONCodec.name: JSONCodec()}
+    if orjson is not None:
+        codecs[FastJSONCodec.name] = FastJSONCodec()
+    if msgpack is not None:
+        codecs[MessagePackCodec.name] = MessagePackCodec()
+    return codecs
+
+
+CODECS = available_codecs()
+
+
+def get_default_codec():
+    """Codec used when the client doesn't offer a supported subprotocol"""
+    return CODECS.get(getattr(settings, 'PUBSUB_DEFAULT_CODEC', JSONCodec.name), CODECS[JSONCodec.name])
+
+
+def negotiate(offered):
+    """
+    Pick a codec for the subprotocols a client offered, in the client's
+    order of preference. Returns (codec, subprotocol to accept or None).
+    """
+    enabled = getattr(settings, 'PUBSUB_CODECS', list(CODECS))
+    by_subprotocol = {
+        codec.subprotocol: codec for name, codec in CODECS.items() if name in enabled
+    }
+    for subprotocol in offered or ():
+        codec = by_subprotocol.get(subprotocol)
+        if codec is not None:
+            return codec, subprotocol
+    return get_default_codec(), None
+
+
+class Frame:
+    """
+    An outbound frame shared by many recipients.
+    The frame is encoded at most once per wire format, however many
+    subscribers (and codecs) it goes to. json_data is an optional copy of
+    data holding rawjson.RawJSON values; JSON recipients get it with the raw
+    text spliced in instead of re-encoding the decoded values.
+    A frame can also start out as ready-made JSON text (json_text); it is
+    only decoded if a recipient uses another wire format.
+    A published message's frame carries its latency.PublishTrace as trace,
+    and published set, so its encodes are also counted as publish encodes.
+    """
+
+    __slots__ = ('data', 'json_data', '_encoded', 'trace', 'published')
+
+    # Encodes performed across all frames in this process, and of those the
+    # encodes of published messages' frames
+    encodes = 0
+    publish_encodes = 0
+
+    def __init__(self, data=None, json_data=None, json_text=None):
+        self.data = data
+        self.json_data = json_data
+        self._encoded = {}  # {wire: str or bytes}
+        self.trace = None
+        self.published = False
+        if json_text is not None:
+            self._encoded[WIRE_JSON] = json_text
+
+    def encode(self, codec):
+        encoded = self._encoded.get(codec.wire)
+        if encoded is None:
+            if codec.wire == WIRE_JSON and self.json_data is not None:
+                encoded = rawjson.dumps(self.json_data)
+            else:
+                if self.data is None:
+                    self.data = json.loads(self._encoded[WIRE_JSON])
+                encoded = codec.encode(self.data)
+            self._encoded[codec.wire] = encoded
+            Frame.encodes += 1
+            if self.published:
+                Frame.publish_encodes += 1
+        return encoded
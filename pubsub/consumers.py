@@ -1,9 +1,135 @@
+import asyncio
+import hashlib
 import json
+import logging
+import time
 import uuid
+from collections import OrderedDict, deque
+from contextlib import ExitStack
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 from .models import Topic, Connection, TopicSubscription, Message
+from .dispatcher import TopicDispatcher
+from .outbound import OutboundQueue
+from .activity import connection_activity
+from .cache import topic_cache
+from .codecs import CODECS, DecodeError, Frame, JSONCodec, is_json_compatible, negotiate
+from .rawjson import raw_member, raw_text
+from .control import control_channel
+from .counters import topic_counters
+from .durable import OffsetTracker, durable_subscriptions
+from .history import topic_history
+from .latency import publish_latency
+from .liveness import loop_lag_monitor
+from . import metrics
+from .sequences import sequence_allocator
+from .persistence import MessageWriter, ACK_ON_FLUSH, get_ack_mode
+from .trie import SubscriptionTrie, is_pattern, validate_pattern
+
+logger = logging.getLogger(__name__)
+
+# Fan-out modes: 'local' delivers to sockets held by this process only;
+# 'channel_layer' routes through channel-layer groups so subscribers on
+# any worker receive every message.
+FANOUT_LOCAL = 'local'
+FANOUT_CHANNEL_LAYER = 'channel_layer'
+
+
+def get_fanout_mode():
+    """Get the configured fan-out mode"""
+    return getattr(settings, 'PUBSUB_FANOUT_MODE', FANOUT_LOCAL)
+
+
+def topic_group_name(topic_name):
+    """Channel-layer group name for a topic (group names only allow a restricted charset)"""
+    return 'pubsub.topic.' + hashlib.sha1(topic_name.encode('utf-8')).hexdigest()
+
+
+# In channel_layer mode, every publish is also sent to this group; only the
+# control channels of workers holding wildcard subscriptions are in it
+PATTERN_GROUP = 'pubsub.patterns'
+PATTERN_FRAMES_EVENT = 'pubsub.pattern_frames'
+
+# Relayed frames kept for sharing between a worker's recipients; a group
+# message reaches all of them within a few loop iterations
+RELAYED_FRAME_CACHE_SIZE = 256
+
+# Messages are stored as JSON; MessagePack clients can send values it can't hold
+UNSTORABLE_MESSAGE_ERROR = (
+    "Message contains binary data or non-string keys, which can't be stored as JSON; "
+    "send binary data as a string (e.g. base64)"
+)
+
+# Inbound message types timed individually; anything else is timed as 'other'
+HANDLED_TYPES = frozenset(('subscribe', 'unsubscribe', 'publish', 'publish_batch', 'resume', 'ping'))
+
+
+def replay_frame_builder(topic_name):
+    """
+    Get a function building replayed message frames as JSON text.
+    The topic is encoded once; each message is plain string concatenation
+    with the stored message JSON spliced in as the payload.
+    """
+    prefix = '{"type": "message", "topic": ' + json.dumps(topic_name) + ', "message": {"id": "'
+    
+    def build(message_id, data, published_at, sequence):
+        return ''.join((
+            prefix, message_id, '", "offset": ', 'null' if sequence is None else str(sequence),
+            ', "payload": ', data, ', "timestamp": "', published_at.isoformat(), '"}}'
+        ))
+    return build
+
+
+async def iter_chunks(entries, chunk_size):
+    """Yield a list in chunks of at most chunk_size, like the paged replay sources"""
+    for start in range(0, len(entries), chunk_size):
+        yield entries[start:start + chunk_size]
+
+
+def frame_message_ids(frame_data):
+    """Ids of the messages a live frame carries (used to de-duplicate against replay)"""
+    frame_type = frame_data.get('type')
+    if frame_type == 'message':
+        return (frame_data['message']['id'],)
+    if frame_type == 'message_batch':
+        return tuple(message['id'] for message in frame_data['messages'])
+    return ()
+
+
+def frame_offsets(frame_data):
+    """Offsets of the messages a live frame carries"""
+    frame_type = frame_data.get('type')
+    if frame_type == 'message':
+        return (frame_data['message'].get('offset'),)
+    if frame_type == 'message_batch':
+        return tuple(message.get('offset') for message in frame_data['messages'])
+    return ()
+
+
+def drop_frame(frame):
+    """Tell a live frame's publish trace, if any, that this copy won't be sent"""
+    if isinstance(frame, Frame) and frame.trace is not None:
+        frame.trace.sent(delivered=False)
+
+
+def is_valid_offset(value):
+    """True for a usable from_offset (a non-negative integer)"""
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+def wildcards_enabled():
+    """True when '*' and '#' levels in subscribe frames are treated as patterns"""
+    return getattr(settings, 'PUBSUB_WILDCARD_SUBSCRIPTIONS', True)
+
+
+def is_pattern_name(name):
+    """True when a subscribe/unsubscribe name is a wildcard pattern"""
+    return wildcards_enabled() and is_pattern(name)
 
 
 class PubSubConsumer(AsyncWebsocketConsumer):
@@ -15,50 +141,127 @@ class PubSubConsumer(AsyncWebsocketConsumer):
     # Class variable to store all active connections by topic
     _topic_connections = {}  # {topic_name: set(connection_instances)}
     
+    # Wildcard subscriptions held by this process: pattern -> connection instances
+    _pattern_connections = SubscriptionTrie()
+    
+    # All open connections in this process
+    _active_connections = set()
+    
+    # Fan-out counters: frames are encoded once per publish, not once per subscriber
+    _fanout_stats = {
+        'publishes': 0,
+        'deliveries': 0,
+    }
+    
+    # Replay counters across connections
+    _replay_stats = {
+        'replays': 0,
+        'frames_replayed': 0,
+        'live_frames_held': 0,
+        'live_frames_dropped': 0,
+        'duplicates_skipped': 0,
+    }
+    
+    # Per-topic dispatcher that runs fan-out off the publisher's receive loop
+    _dispatcher = None
+    
+    # Frames relayed through the channel layer, shared by this worker's binary
+    # recipients so each is decoded once: {(topic_name, message ids): Frame}
+    _relayed_frames = OrderedDict()
+    
+    # Write-behind buffer that persists published messages in batches
+    _message_writer = None
+    
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.connection_id = None
         self.client_id = None
         self.subscribed_topics = set()
+        self.subscribed_patterns = set()
         self.connection = None
+        self.outbound = None
+        self.codec = CODECS[JSONCodec.name]
+        self._pending_publishes = set()
+        self._received_at = None  # perf_counter() when the message being handled arrived
+        # Live frames held back while a topic's history is replayed:
+        # {topic_name: deque([(frame, message_ids, receipt)])}
+        self._replay_buffers = {}
+        self._replay_overflowed = set()  # topics whose held frames overflowed; their replay stops early
+        self._replay_tasks = {}  # {topic_name: asyncio.Task}
+        # Durable subscriptions on this connection: {topic_name: OffsetTracker}
+        self.durable_topics = {}
 
     async def connect(self):
         """Handle WebSocket connection"""
-        await self.accept()
+        # Pick the wire codec from the subprotocols the client offered
+        self.codec, subprotocol = negotiate(self.scope.get('subprotocols', []))
+        await self.accept(subprotocol=subprotocol)
         
         # Generate unique connection ID
         self.connection_id = str(uuid.uuid4())
         
+        # Listen for cross-worker control events (cache invalidation)
+        control_channel.ensure_started()
+        
+        # Make sure the periodic counter/activity flushers run on this loop
+        topic_counters.ensure_started()
+        connection_activity.ensure_started()
+        loop_lag_monitor.ensure_started()
+        metrics.metrics_exporter.ensure_started()
+        
+        # Start the bounded outbound queue that fan-out writes into
+        self.outbound = OutboundQueue(self)
+        self.outbound.on_sent = self.record_delivered
+        self.outbound.start()
+        self._active_connections.add(self)
+        metrics.connections_opened.inc()
+        
         # Create connection record in database
         await self.create_connection_record()
         
         # Send connection confirmation
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             "type": "connected",
             "connection_id": self.connection_id,
             "status": "success",
             "timestamp": timezone.now().isoformat()
-        }))
+        })
         
-        print(f"WebSocket connected: {self.connection_id}")
+        logger.info("WebSocket connected: %s", self.connection_id, extra={'event': 'connection.open'})
 
     async def disconnect(self, close_code):
         """Handle WebSocket disconnection"""
+        if self.outbound:
+            self.outbound.close()
+        self._active_connections.discard(self)
+        for task in list(self._replay_tasks.values()):
+            task.cancel()
+        
         if self.connection_id:
             # Remove this connection from all topic connections
             for topic_name in list(self.subscribed_topics):
-                if topic_name in self._topic_connections:
-                    self._topic_connections[topic_name].discard(self)
-                    if not self._topic_connections[topic_name]:
-                        del self._topic_connections[topic_name]
+                await self.remove_topic_connection(topic_name)
+            for pattern in list(self.subscribed_patterns):
+                await self.remove_pattern_connection(pattern)
+            
+            # Buffered messages keep going out with the next batch, without this connection's row
+            self.get_message_writer().detach_publisher(self.connection_id)
+            connection_activity.discard(self.connection_id)
+            
+            # Persist delivered offsets now, so a quick reconnect resumes from them.
+            # Durable subscriptions belong to the client_id and outlive the connection.
+            if self.durable_topics:
+                await durable_subscriptions.flush()
             
             await self.cleanup_connection()
-            print(f"WebSocket disconnected: {self.connection_id}")
+            logger.info("WebSocket disconnected: %s", self.connection_id, extra={'event': 'connection.close'})
 
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Handle incoming WebSocket messages"""
+        started = self._received_at = time.perf_counter()
+        message_type = None
         try:
-            data = json.loads(text_data)
+            data = self.codec.decode(text_data if text_data is not None else bytes_data)
             message_type = data.get('type')
             request_id = data.get('request_id')
             
@@ -73,15 +276,24 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 await self.handle_unsubscribe(data, request_id)
             elif message_type == 'publish':
                 await self.handle_publish(data, request_id)
+            elif message_type == 'publish_batch':
+                await self.handle_publish_batch(data, request_id)
+            elif message_type == 'resume':
+                await self.handle_resume(data, request_id)
             elif message_type == 'ping':
                 await self.handle_ping(data, request_id)
             else:
                 await self.send_error(f"Unknown message type: {message_type}", request_id)
                 
-        except json.JSONDecodeError:
-            await self.send_error("Invalid JSON format", None)
+        except DecodeError:
+            await self.send_error(f"Invalid {self.codec.label} format", None)
         except Exception as e:
             await self.send_error(f"Internal error: {str(e)}", None)
+        finally:
+            metrics.handler_seconds.observe(
+                message_type if message_type in HANDLED_TYPES else 'other',
+                value=time.perf_counter() - started
+            )
 
     def is_valid_uuid(self, uuid_string):
         """Validate UUID format"""
@@ -93,10 +305,16 @@ class PubSubConsumer(AsyncWebsocketConsumer):
 
     async def handle_subscribe(self, data, request_id):
         """Handle subscribe message"""
+        if 'topics' in data:
+            await self.handle_subscribe_many(data, request_id)
+            return
+        
         try:
             topic_name = data.get('topic')
             client_id = data.get('client_id')
             last_n = data.get('last_n', 0)
+            from_offset = data.get('from_offset')
+            durable = data.get('durable', False)
             
             # Validate required fields
             if not topic_name:
@@ -107,9 +325,21 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 await self.send_error("Missing client_id", request_id)
                 return
             
+            if from_offset is not None and not is_valid_offset(from_offset):
+                await self.send_error(f"Invalid from_offset for topic: {topic_name}", request_id)
+                return
+            
             # Store client_id for this connection
             self.client_id = client_id
             
+            # Wildcard patterns only live in memory; there is no topic row to create
+            if is_pattern_name(topic_name):
+                if durable:
+                    await self.send_error(f"durable is not supported for wildcard subscriptions: {topic_name}", request_id)
+                    return
+                await self.handle_subscribe_pattern(topic_name, client_id, last_n, request_id, from_offset)
+                return
+            
             # Get or create topic
             topic = await self.get_or_create_topic(topic_name)
             if not topic:
@@ -122,33 +352,48 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 await self.send_error(f"Failed to subscribe to topic: {topic_name}", request_id)
                 return
             
+            self.update_connection_activity()
+            
             # Add to local subscribed topics set
             self.subscribed_topics.add(topic_name)
             
+            # Track delivered offsets from here on if the client wants to resume later
+            if durable:
+                self.attach_durable(await durable_subscriptions.register(client_id, [topic]))
+            
+            # Hold live messages from the moment we're registered until replay is done
+            wants_replay = last_n > 0 or from_offset is not None
+            replay = wants_replay and self.begin_replay(topic_name)
+            
             # Add this connection to the topic's active connections for real-time messaging
-            if topic_name not in self._topic_connections:
-                self._topic_connections[topic_name] = set()
-            self._topic_connections[topic_name].add(self)
+            await self.add_topic_connection(topic_name)
             
             # Send subscription confirmation
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 "type": "subscribed",
                 "topic": topic_name,
                 "client_id": client_id,
                 "request_id": request_id,
                 "status": "success",
                 "timestamp": timezone.now().isoformat()
-            }))
+            })
             
-            # Send last N messages if requested
-            if last_n > 0:
-                await self.send_last_n_messages_async(topic, last_n, request_id)
+            # Stream last N messages (or everything from an offset) if requested
+            if replay:
+                self.start_replay(topic, last_n, request_id, from_offset)
+            elif wants_replay:
+                await self.send_error(f"Replay already in progress for topic: {topic_name}", request_id)
                 
         except Exception as e:
+            self.abort_replays()
             await self.send_error(f"Subscribe error: {str(e)}", request_id)
 
     async def handle_unsubscribe(self, data, request_id):
         """Handle unsubscribe message"""
+        if 'topics' in data:
+            await self.handle_unsubscribe_many(data, request_id)
+            return
+        
         try:
             topic_name = data.get('topic')
             client_id = data.get('client_id')
@@ -162,35 +407,332 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 await self.send_error("Missing client_id", request_id)
                 return
             
+            if is_pattern_name(topic_name):
+                await self.handle_unsubscribe_pattern(topic_name, client_id, request_id)
+                return
+            
             # Unsubscribe from topic
             success = await self.unsubscribe_from_topic(topic_name, client_id)
             if not success:
                 await self.send_error(f"Failed to unsubscribe from topic: {topic_name}", request_id)
                 return
             
+            self.update_connection_activity()
+            
             # Remove from local subscribed topics set
             self.subscribed_topics.discard(topic_name)
             
             # Remove this connection from the topic's active connections
-            if topic_name in self._topic_connections:
-                self._topic_connections[topic_name].discard(self)
-                # Clean up empty topic sets
-                if not self._topic_connections[topic_name]:
-                    del self._topic_connections[topic_name]
+            await self.remove_topic_connection(topic_name)
+            
+            # An explicit unsubscribe ends a durable subscription
+            if self.durable_topics.pop(topic_name, None) is not None:
+                await durable_subscriptions.drop(client_id, [topic_name])
             
             # Send unsubscription confirmation
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 "type": "unsubscribed",
                 "topic": topic_name,
                 "client_id": client_id,
                 "request_id": request_id,
                 "status": "success",
                 "timestamp": timezone.now().isoformat()
-            }))
+            })
             
         except Exception as e:
             await self.send_error(f"Unsubscribe error: {str(e)}", request_id)
 
+    async def handle_subscribe_pattern(self, pattern, client_id, last_n, request_id, from_offset=None):
+        """Subscribe this connection to a wildcard pattern"""
+        error = self.check_pattern(pattern, last_n, from_offset)
+        if error:
+            await self.send_error(error, request_id)
+            return
+        
+        self.update_connection_activity()
+        await self.add_pattern_connection(pattern)
+        
+        # Send subscription confirmation
+        await self.send_frame({
+            "type": "subscribed",
+            "topic": pattern,
+            "pattern": True,
+            "client_id": client_id,
+            "request_id": request_id,
+            "status": "success",
+            "timestamp": timezone.now().isoformat()
+        })
+
+    async def handle_unsubscribe_pattern(self, pattern, client_id, request_id):
+        """Unsubscribe this connection from a wildcard pattern"""
+        if pattern not in self.subscribed_patterns:
+            await self.send_error(f"Failed to unsubscribe from topic: {pattern}", request_id)
+            return
+        
+        self.update_connection_activity()
+        await self.remove_pattern_connection(pattern)
+        
+        # Send unsubscription confirmation
+        await self.send_frame({
+            "type": "unsubscribed",
+            "topic": pattern,
+            "pattern": True,
+            "client_id": client_id,
+            "request_id": request_id,
+            "status": "success",
+            "timestamp": timezone.now().isoformat()
+        })
+
+    def check_pattern(self, pattern, last_n, from_offset=None):
+        """Get an error message if a wildcard subscription can't be accepted, else None"""
+        error = validate_pattern(pattern)
+        if error:
+            return error
+        # Replay reads one topic's history; a pattern has no single history
+        # (and offsets are per topic)
+        if last_n:
+            return f"last_n is not supported for wildcard subscriptions: {pattern}"
+        if from_offset is not None:
+            return f"from_offset is not supported for wildcard subscriptions: {pattern}"
+        return None
+
+    def parse_topic_list(self, data):
+        """
+        Parse the 'topics' list of a multi-topic frame.
+        Entries are topic names or {"topic": ..., "last_n": ..., "from_offset": ...}
+        objects. Returns ({topic_name: (last_n, from_offset)}, error_message).
+        """
+        topics = data.get('topics')
+        if not isinstance(topics, list) or not topics:
+            return None, "Missing topics list"
+        
+        max_topics = getattr(settings, 'PUBSUB_MAX_TOPICS_PER_FRAME', 1000)
+        if len(topics) > max_topics:
+            return None, f"Too many topics in one frame (max {max_topics})"
+        
+        default_last_n = data.get('last_n', 0)
+        parsed = {}
+        for entry in topics:
+            from_offset = None
+            if isinstance(entry, dict):
+                topic_name = entry.get('topic')
+                last_n = entry.get('last_n', default_last_n)
+                from_offset = entry.get('from_offset')
+            else:
+                topic_name, last_n = entry, default_last_n
+            if not topic_name or not isinstance(topic_name, str):
+                return None, "Invalid topic name in topics list"
+            if not isinstance(last_n, int) or last_n < 0:
+                return None, f"Invalid last_n for topic: {topic_name}"
+            if from_offset is not None and not is_valid_offset(from_offset):
+                return None, f"Invalid from_offset for topic: {topic_name}"
+            parsed[topic_name] = (last_n, from_offset)
+        return parsed, None
+
+    async def handle_subscribe_many(self, data, request_id):
+        """Handle subscribe message carrying a list of topics"""
+        try:
+            client_id = data.get('client_id')
+            topic_replays, error = self.parse_topic_list(data)
+            durable = data.get('durable', False)
+            
+            # Validate required fields
+            if error:
+                await self.send_error(error, request_id)
+                return
+            
+            if not client_id:
+                await self.send_error("Missing client_id", request_id)
+                return
+            
+            # Store client_id for this connection
+            self.client_id = client_id
+            
+            patterns = [name for name in topic_replays if is_pattern_name(name)]
+            for pattern in patterns:
+                if durable:
+                    await self.send_error(f"durable is not supported for wildcard subscriptions: {pattern}", request_id)
+                    return
+                error = self.check_pattern(pattern, *topic_replays.pop(pattern))
+                if error:
+                    await self.send_error(error, request_id)
+                    return
+            
+            # Get/create every topic and subscribe in one transaction
+            topics = {}
+            if topic_replays:
+                topics = await self.subscribe_to_topics(list(topic_replays))
+                if topics is None:
+                    await self.send_error("Failed to subscribe to topics", request_id)
+                    return
+            
+            self.update_connection_activity()
+            
+            if durable and topics:
+                self.attach_durable(await durable_subscriptions.register(client_id, list(topics.values())))
+            
+            replays = [
+                topic_name for topic_name in topics
+                if (topic_replays[topic_name][0] > 0 or topic_replays[topic_name][1] is not None)
+                and self.begin_replay(topic_name)
+            ]
+            for topic_name in topics:
+                self.subscribed_topics.add(topic_name)
+                await self.add_topic_connection(topic_name)
+            for pattern in patterns:
+                await self.add_pattern_connection(pattern)
+            
+            # Send one aggregated subscription confirmation
+            await self.send_frame({
+                "type": "subscribed",
+                "topics": list(topics) + patterns,
+                "client_id": client_id,
+                "request_id": request_id,
+                "status": "success",
+                "timestamp": timezone.now().isoformat()
+            })
+            
+            # Stream last N messages (or everything from an offset) per topic if requested
+            for topic_name in replays:
+                last_n, from_offset = topic_replays[topic_name]
+                self.start_replay(topics[topic_name], last_n, request_id, from_offset)
+                
+        except Exception as e:
+            self.abort_replays()
+            await self.send_error(f"Subscribe error: {str(e)}", request_id)
+
+    async def handle_unsubscribe_many(self, data, request_id):
+        """Handle unsubscribe message carrying a list of topics"""
+        try:
+            client_id = data.get('client_id')
+            topic_replays, error = self.parse_topic_list(data)
+            
+            # Validate required fields
+            if error:
+                await self.send_error(error, request_id)
+                return
+            
+            if not client_id:
+                await self.send_error("Missing client_id", request_id)
+                return
+            
+            names = list(topic_replays)
+            topic_names = [name for name in names if not is_pattern_name(name)]
+            unsubscribed = []
+            if topic_names:
+                unsubscribed = await self.unsubscribe_from_topics(topic_names)
+                if unsubscribed is None:
+                    await self.send_error("Failed to unsubscribe from topics", request_id)
+                    return
+            
+            self.update_connection_activity()
+            
+            for topic_name in unsubscribed:
+                self.subscribed_topics.discard(topic_name)
+                await self.remove_topic_connection(topic_name)
+            dropped = [name for name in unsubscribed if self.durable_topics.pop(name, None) is not None]
+            if dropped:
+                await durable_subscriptions.drop(client_id, dropped)
+            for pattern in names:
+                if pattern in self.subscribed_patterns:
+                    await self.remove_pattern_connection(pattern)
+                    unsubscribed.append(pattern)
+            
+            # Send one aggregated unsubscription confirmation
+            await self.send_frame({
+                "type": "unsubscribed",
+                "topics": unsubscribed,
+                "not_subscribed": [name for name in names if name not in unsubscribed],
+                "client_id": client_id,
+                "request_id": request_id,
+                "status": "success",
+                "timestamp": timezone.now().isoformat()
+            })
+            
+        except Exception as e:
+            await self.send_error(f"Unsubscribe error: {str(e)}", request_id)
+
+    async def handle_resume(self, data, request_id):
+        """
+        Handle resume message: re-attach every durable subscription of the
+        client in one operation and replay only what it missed since the last
+        delivered offset of each topic
+        """
+        try:
+            client_id = data.get('client_id')
+            
+            # Validate required fields
+            if not client_id:
+                await self.send_error("Missing client_id", request_id)
+                return
+            
+            # Store client_id for this connection
+            self.client_id = client_id
+            
+            # Offsets delivered by the client's previous connection may still be in memory
+            await durable_subscriptions.flush()
+            durables = await durable_subscriptions.load(client_id)
+            
+            # Subscribe to every topic in one transaction
+            topics = {}
+            if durables:
+                topics = await self.subscribe_to_topics(list(durables))
+                if topics is None:
+                    await self.send_error("Failed to resume subscriptions", request_id)
+                    return
+            
+            self.update_connection_activity()
+            
+            offsets = {topic_name: durables[topic_name][1] for topic_name in topics}
+            replays = [topic_name for topic_name in topics if self.begin_replay(topic_name)]
+            self.attach_durable({topic_name: durables[topic_name] for topic_name in topics})
+            for topic_name in topics:
+                self.subscribed_topics.add(topic_name)
+                await self.add_topic_connection(topic_name)
+            
+            # Send one confirmation listing where each topic resumes
+            await self.send_frame({
+                "type": "resumed",
+                "topics": [
+                    {"topic": topic_name, "from_offset": offsets[topic_name] + 1}
+                    for topic_name in topics
+                ],
+                "client_id": client_id,
+                "request_id": request_id,
+                "status": "success",
+                "timestamp": timezone.now().isoformat()
+            })
+            
+            # A topic whose replay is already running on this connection can't
+            # replay its gap now; tell the client to resubscribe from its offset
+            for topic_name in topics:
+                if topic_name not in replays:
+                    await self.send_frame({
+                        "type": "replay_end",
+                        "topic": topic_name,
+                        "count": 0,
+                        "last_offset": offsets[topic_name],
+                        "truncated": True,
+                        "request_id": request_id,
+                        "timestamp": timezone.now().isoformat()
+                    })
+            
+            if replays:
+                # Every topic's gap comes from one query, once buffered publishes are written
+                await self.get_message_writer().flush()
+                gaps = await durable_subscriptions.fetch_gaps(
+                    {topic_name: topics[topic_name] for topic_name in replays}, offsets,
+                    getattr(settings, 'PUBSUB_RESUME_MAX_MESSAGES', 10000)
+                )
+                for topic_name in replays:
+                    self.start_replay(
+                        topics[topic_name], 0, request_id, offsets[topic_name] + 1, gaps[topic_name]
+                    )
+                
+        except Exception as e:
+            self.abort_replays()
+            await self.send_error(f"Resume error: {str(e)}", request_id)
+
     async def handle_publish(self, data, request_id):
         """Handle publish message"""
         try:
@@ -211,51 +753,286 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 await self.send_error("Missing client_id", request_id)
                 return
             
+            if self.codec.binary and not is_json_compatible(message_data):
+                await self.send_error(UNSTORABLE_MESSAGE_ERROR, request_id)
+                return
+            
+            trace = publish_latency.start(topic_name, self._received_at)
+            if trace is not None:
+                trace.mark('parse')
+            
             # Get topic
             topic = await self.get_topic(topic_name)
             if not topic:
                 await self.send_error(f"Topic not found: {topic_name}", request_id)
                 return
+            if trace is not None:
+                trace.mark('lookup')
             
-            # Publish message
-            message_id = await self.publish_message(topic, message_data, client_id)
-            if not message_id:
-                await self.send_error(f"Failed to publish message to topic: {topic_name}", request_id)
-                return
+            # Publish message (buffered for the next bulk write)
+            sequence, = await sequence_allocator.allocate(topic)
+            message, flushed = self.publish_message(topic, message_data, client_id, sequence)
+            self.update_connection_activity()
+            
+            if flushed is None:
+                # Ack on enqueue: confirm and fan out right away
+                await self.complete_publish(topic_name, message, message_data, client_id, request_id,
+                                            trace=trace)
+            else:
+                # Ack after durable flush: wait off the receive loop so later
+                # publishes from this connection can join the same batch
+                task = asyncio.create_task(self.complete_publish(
+                    topic_name, message, message_data, client_id, request_id, flushed, trace
+                ))
+                self._pending_publishes.add(task)
+                task.add_done_callback(self._pending_publishes.discard)
             
+        except Exception as e:
+            await self.send_error(f"Publish error: {str(e)}", request_id)
+
+    async def complete_publish(self, topic_name, message, message_data, client_id, request_id,
+                               flushed=None, trace=None):
+        """Send publish confirmation and broadcast, optionally after the message is persisted"""
+        message_id = str(message.id)
+        try:
+            if flushed is not None and not await flushed:
+                await self.send_error(f"Topic was deleted before the message was stored: {topic_name}",
+                                      request_id)
+                return
+        except Exception:
+            await self.send_error(f"Failed to publish message to topic: {topic_name}", request_id)
+            return
+        if trace is not None:
+            trace.mark('persist')
+        
+        try:
             # Send publish confirmation
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 "type": "published",
                 "topic": topic_name,
                 "message_id": message_id,
+                "offset": message.sequence,
                 "client_id": client_id,
                 "request_id": request_id,
                 "status": "success",
                 "timestamp": timezone.now().isoformat()
-            }))
+            })
+            if trace is not None:
+                trace.mark('ack')
+            
+            # Keep the message in the topic's replay buffer
+            if get_fanout_mode() == FANOUT_LOCAL:
+                topic_history.append(topic_name, message_id, message.data, message.published_at, message.sequence)
             
             # Broadcast message to all subscribers
-            await self.broadcast_message(topic_name, message_data, message_id, client_id)
+            await self.broadcast_message(topic_name, message_data, message_id, client_id, message.sequence,
+                                         trace)
             
         except Exception as e:
             await self.send_error(f"Publish error: {str(e)}", request_id)
 
+    async def handle_publish_batch(self, data, request_id):
+        """Handle publish_batch message: several messages, possibly for several topics"""
+        try:
+            entries = data.get('messages')
+            client_id = data.get('client_id')
+            coalesce = data.get('coalesce', getattr(settings, 'PUBSUB_COALESCE_BATCH_FRAMES', False))
+            
+            # Validate required fields
+            if not isinstance(entries, list) or not entries:
+                await self.send_error("Missing messages list", request_id)
+                return
+            
+            max_messages = getattr(settings, 'PUBSUB_MAX_MESSAGES_PER_BATCH', 1000)
+            if len(entries) > max_messages:
+                await self.send_error(f"Too many messages in one batch (max {max_messages})", request_id)
+                return
+            
+            if not client_id:
+                await self.send_error("Missing client_id", request_id)
+                return
+            
+            # Resolve every topic before buffering anything, so a bad entry
+            # rejects the whole batch. Each topic's messages share one trace.
+            topics = {}
+            traces = {}
+            for entry in entries:
+                if not isinstance(entry, dict) or not entry.get('topic'):
+                    await self.send_error("Missing topic name in batch entry", request_id)
+                    return
+                if not entry.get('message'):
+                    await self.send_error("Missing message data in batch entry", request_id)
+                    return
+                if self.codec.binary and not is_json_compatible(entry['message']):
+                    await self.send_error(UNSTORABLE_MESSAGE_ERROR, request_id)
+                    return
+                topic_name = entry['topic']
+                if topic_name not in topics:
+                    trace = publish_latency.start(topic_name, self._received_at)
+                    if trace is not None:
+                        trace.mark('parse')
+                    topics[topic_name] = await self.get_topic(topic_name)
+                    if not topics[topic_name]:
+                        await self.send_error(f"Topic not found: {topic_name}", request_id)
+                        return
+                    if trace is not None:
+                        trace.mark('lookup')
+                        traces[topic_name] = trace
+            
+            # Allocate each topic's offsets in one go, in batch order
+            counts = {}
+            for entry in entries:
+                counts[entry['topic']] = counts.get(entry['topic'], 0) + 1
+            sequences = {}
+            for topic_name, count in counts.items():
+                sequences[topic_name] = iter(await sequence_allocator.allocate(topics[topic_name], count))
+            
+            # Buffer the whole batch so it is written by one bulk_create
+            messages = [
+                self.build_message(
+                    topics[entry['topic']], entry['message'], client_id, next(sequences[entry['topic']])
+                )
+                for entry in entries
+            ]
+            flushed = self.get_message_writer().append_many(
+                messages, wait=get_ack_mode() == ACK_ON_FLUSH
+            )
+            self.update_connection_activity()
+            
+            batch = [(message, entry['message']) for message, entry in zip(messages, entries)]
+            if flushed is None:
+                await self.complete_publish_batch(batch, client_id, request_id, coalesce, traces=traces)
+            else:
+                task = asyncio.create_task(self.complete_publish_batch(
+                    batch, client_id, request_id, coalesce, flushed, traces
+                ))
+                self._pending_publishes.add(task)
+                task.add_done_callback(self._pending_publishes.discard)
+            
+        except Exception as e:
+            await self.send_error(f"Publish batch error: {str(e)}", request_id)
+
+    async def complete_publish_batch(self, batch, client_id, request_id, coalesce, flushed=None, traces=None):
+        """Send one confirmation for a publish_batch and fan out its messages in order"""
+        traces = traces or {}
+        try:
+            if flushed is not None and not await flushed:
+                await self.send_error("A topic was deleted before the message batch was stored", request_id)
+                return
+        except Exception:
+            await self.send_error("Failed to publish message batch", request_id)
+            return
+        for trace in traces.values():
+            trace.mark('persist')
+        
+        try:
+            # Send one confirmation listing every message id, in batch order
+            await self.send_frame({
+                "type": "published_batch",
+                "message_ids": [str(message.id) for message, _ in batch],
+                "offsets": [message.sequence for message, _ in batch],
+                "count": len(batch),
+                "client_id": client_id,
+                "request_id": request_id,
+                "status": "success",
+                "timestamp": timezone.now().isoformat()
+            })
+            for trace in traces.values():
+                trace.mark('ack')
+            
+            # Group by topic, keeping publish order within each topic
+            by_topic = {}
+            for message, message_data in batch:
+                by_topic.setdefault(message.topic.name, []).append((message, message_data))
+            
+            for topic_name, topic_batch in by_topic.items():
+                if get_fanout_mode() == FANOUT_LOCAL:
+                    for message, _ in topic_batch:
+                        topic_history.append(
+                            topic_name, str(message.id), message.data, message.published_at, message.sequence
+                        )
+                
+                trace = traces.get(topic_name)
+                if coalesce:
+                    await self.broadcast_message_batch(topic_name, topic_batch, client_id, trace)
+                    continue
+                # Keep the shared trace open until every message is handed off,
+                # so a quick fan-out of the first ones can't end it early
+                if trace is not None:
+                    trace.hold()
+                try:
+                    for message, message_data in topic_batch:
+                        await self.broadcast_message(
+                            topic_name, message_data, str(message.id), client_id, message.sequence, trace
+                        )
+                finally:
+                    if trace is not None:
+                        trace.release()
+            
+        except Exception as e:
+            await self.send_error(f"Publish batch error: {str(e)}", request_id)
+
     async def handle_ping(self, data, request_id):
         """Handle ping message"""
         try:
             # Update connection activity
-            await self.update_connection_activity()
+            self.update_connection_activity()
             
             # Send pong response
-            await self.send(text_data=json.dumps({
+            await self.send_frame({
                 "type": "pong",
                 "request_id": request_id,
                 "timestamp": timezone.now().isoformat()
-            }))
+            })
             
         except Exception as e:
             await self.send_error(f"Ping error: {str(e)}", request_id)
 
+    async def add_topic_connection(self, topic_name):
+        """Register this connection for real-time messages on a topic"""
+        if topic_name not in self._topic_connections:
+            self._topic_connections[topic_name] = set()
+        self._topic_connections[topic_name].add(self)
+        
+        if get_fanout_mode() == FANOUT_CHANNEL_LAYER:
+            await self.channel_layer.group_add(topic_group_name(topic_name), self.channel_name)
+
+    async def remove_topic_connection(self, topic_name):
+        """Stop real-time messages on a topic for this connection"""
+        if topic_name in self._topic_connections:
+            self._topic_connections[topic_name].discard(self)
+            # Clean up empty topic sets
+            if not self._topic_connections[topic_name]:
+                del self._topic_connections[topic_name]
+        
+        if get_fanout_mode() == FANOUT_CHANNEL_LAYER:
+            await self.channel_layer.group_discard(topic_group_name(topic_name), self.channel_name)
+
+    async def add_pattern_connection(self, pattern):
+        """Register this connection for real-time messages on every topic matching a pattern"""
+        self.subscribed_patterns.add(pattern)
+        self._pattern_connections.add(pattern, self)
+        
+        # This worker now needs every publish in the cluster to match against
+        if get_fanout_mode() == FANOUT_CHANNEL_LAYER:
+            await control_channel.join(PATTERN_GROUP)
+
+    async def remove_pattern_connection(self, pattern):
+        """Stop real-time messages for a pattern on this connection"""
+        self.subscribed_patterns.discard(pattern)
+        self._pattern_connections.remove(pattern, self)
+        
+        if get_fanout_mode() == FANOUT_CHANNEL_LAYER and not self._pattern_connections:
+            await control_channel.leave(PATTERN_GROUP)
+
+    @classmethod
+    def get_local_subscribers(cls, topic_name):
+        """Get this process's connections subscribed to a topic, directly or by pattern"""
+        connections = set(cls._topic_connections.get(topic_name, ()))
+        if cls._pattern_connections:
+            connections |= cls._pattern_connections.match(topic_name)
+        return connections
+
     @classmethod
     async def notify_topic_deleted(cls, topic_name):
         """Notify all subscribers that a topic has been deleted"""
@@ -271,23 +1048,118 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 # Get all connections for this topic
                 connections = cls._topic_connections[topic_name].copy()
                 
-                # Send notification to all subscribers
-                for connection in connections:
-                    try:
-                        await connection.send(text_data=json.dumps(notification_data))
-                        print(f"Topic deletion notification sent to {connection.connection_id}")
-                    except Exception as e:
-                        print(f"Failed to send topic deletion notification to {connection.connection_id}: {e}")
-                        # Remove failed connection
+                # Encode the notification once for all subscribers
+                notification = cls.encode_frame(notification_data)
+                
+                # Queue notification on every subscriber's outbound queue
+                for connection in list(connections):
+                    if connection.enqueue_frame(notification):
+                        logger.debug("Topic deletion notification sent to %s", connection.connection_id,
+                                     extra={'event': 'topic.deletion_notice'})
+                    else:
+                        logger.warning("Failed to queue topic deletion notification for %s", connection.connection_id)
                         connections.discard(connection)
                 
                 # Remove the topic from connections (it's deleted)
                 del cls._topic_connections[topic_name]
                 
-                print(f"Topic deletion notifications sent to {len(connections)} subscribers")
+                logger.info("Topic deletion notifications sent to %d subscribers", len(connections))
                 
         except Exception as e:
-            print(f"Error notifying topic deletion: {e}")
+            logger.error("Error notifying topic deletion: %s", e)
+
+    def attach_durable(self, durables):
+        """Track delivered offsets of durable subscriptions, given {topic_name: (id, last_offset)}"""
+        for topic_name, (subscription_id, last_offset) in durables.items():
+            self.durable_topics[topic_name] = OffsetTracker(subscription_id, last_offset)
+
+    def deliver(self, topic_name, frame, message_ids=None, offsets=None):
+        """Queue a live frame for a topic, holding it back while that topic is being replayed"""
+        receipt = None
+        tracker = self.durable_topics.get(topic_name)
+        if tracker is not None:
+            if offsets is None and isinstance(frame, Frame):
+                offsets = frame_offsets(frame.data)
+            receipt = (tracker, offsets or ())
+        held = self._replay_buffers.get(topic_name)
+        if held is None:
+            return self.enqueue_frame(frame, receipt)
+        if message_ids is None:
+            message_ids = frame_message_ids(frame.data) if isinstance(frame, Frame) else ()
+        held.append((frame, message_ids, receipt))
+        self._replay_stats['live_frames_held'] += 1
+        if len(held) > getattr(settings, 'PUBSUB_REPLAY_HOLD_LIMIT', 1000):
+            # The replay can't keep up with live traffic: drop the oldest held
+            # frame and end the replay at its next chunk
+            drop_frame(held.popleft()[0])
+            self._replay_stats['live_frames_dropped'] += 1
+            metrics.send_failures.inc('replay_hold_overflow')
+            self._replay_overflowed.add(topic_name)
+        return True
+
+    def enqueue_frame(self, frame, receipt=None):
+        """
+        Queue a frame on this connection's outbound queue.
+        frame is a shared Frame (encoded once per wire format) or JSON text
+        relayed through the channel layer. receipt is an (OffsetTracker,
+        offsets) pair recorded once the frame has been sent.
+        """
+        if not self.outbound:
+            return False
+        trace = None
+        if isinstance(frame, Frame):
+            trace = frame.trace
+            frame = frame.encode(self.codec)
+        elif self.codec.binary:
+            # Channel-layer events carry JSON text; binary clients need it transcoded
+            frame = self.codec.encode(json.loads(frame))
+        return self.outbound.put(frame, receipt, trace)
+
+    def record_delivered(self, receipt):
+        """Outbound writer callback: a frame on a durable subscription reached the socket"""
+        tracker, offsets = receipt
+        if tracker.add(offsets):
+            durable_subscriptions.record(tracker.subscription_id, tracker.cursor)
+
+    def skip_own(self, topic_name, frame, offsets=None):
+        """A frame this connection published isn't sent back to it; count it as delivered for resume"""
+        tracker = self.durable_topics.get(topic_name)
+        if tracker is not None:
+            if offsets is None:
+                offsets = frame_offsets(frame.data)
+            self.record_delivered((tracker, offsets))
+
+    @classmethod
+    def get_outbound_stats(cls):
+        """Get outbound queue depth and drop counters across connections"""
+        # Copied first: views run on other threads while the loop (dis)connects
+        depths = [c.outbound.depth for c in tuple(cls._active_connections) if c.outbound]
+        stats = dict(OutboundQueue.totals)
+        stats['connections'] = len(depths)
+        stats['queued_now'] = sum(depths)
+        stats['max_depth_now'] = max(depths) if depths else 0
+        return stats
+
+    @classmethod
+    def get_registry_stats(cls):
+        """Get live connection and subscription counts held by this process (no database access)"""
+        return {
+            "connections": len(cls._active_connections),
+            "topics": len(cls._topic_connections),
+            "subscribers": sum(len(connections) for connections in list(cls._topic_connections.values())),
+            "pattern_subscriptions": cls._pattern_connections.patterns,
+        }
+
+    async def send_frame(self, frame_data):
+        """Encode a frame (a dict or a shared Frame) with this connection's codec and send it right away"""
+        if isinstance(frame_data, Frame):
+            encoded = frame_data.encode(self.codec)
+        else:
+            encoded = self.codec.encode(frame_data)
+        if self.codec.binary:
+            await self.send(bytes_data=encoded)
+        else:
+            await self.send(text_data=encoded)
 
     async def send_error(self, error_message, request_id):
         """Send error response to client"""
@@ -300,7 +1172,7 @@ class PubSubConsumer(AsyncWebsocketConsumer):
         if request_id:
             error_data["request_id"] = request_id
             
-        await self.send(text_data=json.dumps(error_data))
+        await self.send_frame(error_data)
 
     # Database operations (using database_sync_to_async)
     
@@ -322,7 +1194,7 @@ class PubSubConsumer(AsyncWebsocketConsumer):
             )
             return True
         except Exception as e:
-            print(f"Error creating connection record: {e}")
+            logger.error("Error creating connection record: %s", e)
             return False
 
     @database_sync_to_async
@@ -330,18 +1202,43 @@ class PubSubConsumer(AsyncWebsocketConsumer):
         """Clean up connection and subscriptions"""
         try:
             if self.connection:
+                subscriptions = TopicSubscription.objects.filter(connection=self.connection)
+                active_topic_ids = list(
+                    subscriptions.filter(is_active=True).values_list('topic_id', flat=True)
+                )
                 # Remove all subscriptions for this connection
-                TopicSubscription.objects.filter(connection=self.connection).delete()
+                with topic_counters.subscriber_changes(active_topic_ids):
+                    subscriptions.delete()
+                    for topic_id in active_topic_ids:
+                        topic_counters.record_subscribers(topic_id, -1)
                 # Delete the connection
                 self.connection.delete()
             return True
         except Exception as e:
-            print(f"Error cleaning up connection: {e}")
+            logger.error("Error cleaning up connection: %s", e)
             return False
 
+    async def get_or_create_topic(self, topic_name):
+        """Get existing topic or create new one (served from the topic cache when possible)"""
+        topic = topic_cache.get(topic_name)
+        if topic is None:
+            topic = await self.fetch_or_create_topic(topic_name)
+            if topic:
+                topic_cache.put(topic)
+        return topic
+
+    async def get_topic(self, topic_name):
+        """Get topic by name (served from the topic cache when possible)"""
+        topic = topic_cache.get(topic_name)
+        if topic is None:
+            topic = await self.fetch_topic(topic_name)
+            if topic:
+                topic_cache.put(topic)
+        return topic
+
     @database_sync_to_async
-    def get_or_create_topic(self, topic_name):
-        """Get existing topic or create new one"""
+    def fetch_or_create_topic(self, topic_name):
+        """Get existing topic or create new one from the database"""
         try:
             topic, created = Topic.objects.get_or_create(
                 name=topic_name,
@@ -349,46 +1246,43 @@ class PubSubConsumer(AsyncWebsocketConsumer):
             )
             return topic
         except Exception as e:
-            print(f"Error getting/creating topic: {e}")
+            logger.error("Error getting/creating topic: %s", e)
             return None
 
     @database_sync_to_async
-    def get_topic(self, topic_name):
-        """Get topic by name"""
+    def fetch_topic(self, topic_name):
+        """Get topic by name from the database"""
         try:
             return Topic.objects.get(name=topic_name)
         except Topic.DoesNotExist:
             return None
         except Exception as e:
-            print(f"Error getting topic: {e}")
+            logger.error("Error getting topic: %s", e)
             return None
 
     @database_sync_to_async
     def subscribe_to_topic(self, topic, client_id):
         """Subscribe connection to topic"""
         try:
-            # Check if subscription already exists
-            subscription, created = TopicSubscription.objects.get_or_create(
-                connection=self.connection,
-                topic=topic,
-                defaults={'is_active': True}
-            )
-            
-            if not created:
-                # Update existing subscription to active
-                subscription.is_active = True
-                subscription.save()
-            
-            # Update topic subscriber count CORRECTLY
-            active_count = topic.subscriptions.filter(is_active=True).count()
-            topic.update_subscriber_count(active_count)
-            
-            # Update connection activity
-            self.connection.update_activity()
+            with topic_counters.subscriber_changes([topic.pk]):
+                # Check if subscription already exists
+                subscription, created = TopicSubscription.objects.get_or_create(
+                    connection=self.connection,
+                    topic=topic,
+                    defaults={'is_active': True}
+                )
+                
+                if created:
+                    topic_counters.record_subscribers(topic.pk, 1)
+                elif not subscription.is_active:
+                    # Update existing subscription to active
+                    subscription.is_active = True
+                    subscription.save(update_fields=['is_active'])
+                    topic_counters.record_subscribers(topic.pk, 1)
             
             return True
         except Exception as e:
-            print(f"Error subscribing to topic: {e}")
+            logger.error("Error subscribing to topic: %s", e)
             return False
 
     @database_sync_to_async
@@ -396,53 +1290,130 @@ class PubSubConsumer(AsyncWebsocketConsumer):
         """Unsubscribe connection from topic"""
         try:
             topic = Topic.objects.get(name=topic_name)
-            subscription = TopicSubscription.objects.get(
-                connection=self.connection,
-                topic=topic
-            )
-            
-            # Mark subscription as inactive
-            subscription.is_active = False
-            subscription.save()
-            
-            # Update topic subscriber count CORRECTLY
-            active_count = topic.subscriptions.filter(is_active=True).count()
-            topic.update_subscriber_count(active_count)
-            
-            # Update connection activity
-            self.connection.update_activity()
+            with topic_counters.subscriber_changes([topic.pk]):
+                subscription = TopicSubscription.objects.get(
+                    connection=self.connection,
+                    topic=topic
+                )
+                
+                # Mark subscription as inactive
+                if subscription.is_active:
+                    subscription.is_active = False
+                    subscription.save(update_fields=['is_active'])
+                    topic_counters.record_subscribers(topic.pk, -1)
             
             return True
         except (Topic.DoesNotExist, TopicSubscription.DoesNotExist):
             return False
         except Exception as e:
-            print(f"Error unsubscribing from topic: {e}")
+            logger.error("Error unsubscribing from topic: %s", e)
             return False
 
     @database_sync_to_async
-    def publish_message(self, topic, message_data, client_id):
-        """Publish message to topic"""
+    def subscribe_to_topics(self, topic_names):
+        """
+        Get or create several topics and subscribe to all of them in one
+        transaction using bulk operations. Returns {topic_name: Topic}.
+        """
         try:
-            # Create message record
-            message = Message.objects.create(
-                topic=topic,
-                publisher_connection=self.connection,
-                data=json.dumps(message_data),
-                metadata={'client_id': client_id}
-            )
+            with ExitStack() as changes:
+                with transaction.atomic():
+                    topics = {t.name: t for t in Topic.objects.filter(name__in=topic_names)}
+                    missing = [name for name in topic_names if name not in topics]
+                    if missing:
+                        Topic.objects.bulk_create(
+                            [Topic(name=name, metadata={}) for name in missing],
+                            ignore_conflicts=True
+                        )
+                        topics.update({t.name: t for t in Topic.objects.filter(name__in=missing)})
+                
+                    # Held until the deltas below are recorded
+                    changes.enter_context(topic_counters.subscriber_changes(t.pk for t in topics.values()))
+                    existing = {
+                        s.topic_id: s for s in TopicSubscription.objects.filter(
+                            connection=self.connection, topic__in=list(topics.values())
+                        )
+                    }
+                    TopicSubscription.objects.bulk_create([
+                        TopicSubscription(connection=self.connection, topic=topic, is_active=True)
+                        for topic in topics.values() if topic.pk not in existing
+                    ])
+                    reactivated = [s.pk for s in existing.values() if not s.is_active]
+                    if reactivated:
+                        TopicSubscription.objects.filter(pk__in=reactivated).update(is_active=True)
             
-            # Update topic message count and timestamp
-            topic.increment_message_count()
-            topic.update_last_published()
+                for topic in topics.values():
+                    topic_cache.put(topic)
+                    subscription = existing.get(topic.pk)
+                    if subscription is None or not subscription.is_active:
+                        topic_counters.record_subscribers(topic.pk, 1)
             
-            # Update connection activity
-            self.connection.update_activity()
+            # Preserve the order the client asked for
+            return {name: topics[name] for name in topic_names if name in topics}
+        except Exception as e:
+            logger.error("Error subscribing to topics: %s", e)
+            return None
+
+    @database_sync_to_async
+    def unsubscribe_from_topics(self, topic_names):
+        """
+        Deactivate this connection's subscriptions to several topics in one
+        transaction. Returns the names of topics that were unsubscribed.
+        """
+        try:
+            with ExitStack() as changes:
+                with transaction.atomic():
+                    active = list(TopicSubscription.objects.filter(
+                        connection=self.connection,
+                        topic__name__in=topic_names,
+                        is_active=True
+                    ).values_list('pk', 'topic_id', 'topic__name'))
+                    changes.enter_context(topic_counters.subscriber_changes(topic_id for _, topic_id, _ in active))
+                    TopicSubscription.objects.filter(
+                        pk__in=[pk for pk, _, _ in active]
+                    ).update(is_active=False)
+                
+                for _, topic_id, _ in active:
+                    topic_counters.record_subscribers(topic_id, -1)
             
-            return str(message.id)
+            unsubscribed = {name for _, _, name in active}
+            return [name for name in topic_names if name in unsubscribed]
         except Exception as e:
-            print(f"Error publishing message: {e}")
+            logger.error("Error unsubscribing from topics: %s", e)
             return None
 
+    @classmethod
+    def get_message_writer(cls):
+        """Get the shared write-behind message writer, creating it on first use"""
+        if cls._message_writer is None:
+            cls._message_writer = MessageWriter()
+        return cls._message_writer
+
+    def publish_message(self, topic, message_data, client_id, sequence=None):
+        """
+        Buffer a message for the write-behind writer.
+        Returns (message, future); the future is None unless the ack mode
+        waits for the durable flush.
+        """
+        message = self.build_message(topic, message_data, client_id, sequence)
+        flushed = self.get_message_writer().append(
+            message, wait=get_ack_mode() == ACK_ON_FLUSH
+        )
+        return message, flushed
+
+    def build_message(self, topic, message_data, client_id, sequence=None):
+        """Build an unsaved Message for the write-behind writer"""
+        return Message(
+            id=uuid.uuid4(),
+            topic=topic,
+            sequence=sequence,
+            publisher_connection=self.connection,
+            # Large JSON frames keep the message's source text; store it verbatim
+            data=raw_text(message_data) or json.dumps(message_data),
+            published_at=timezone.now(),
+            metadata={'client_id': client_id}
+        )
+
     @database_sync_to_async
     def send_last_n_messages(self, topic, last_n, request_id):
         """Send last N messages to client"""
@@ -467,59 +1438,264 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 yield message_data
                 
         except Exception as e:
-            print(f"Error sending last N messages: {e}")
+            logger.error("Error sending last N messages: %s", e)
+
+    def begin_replay(self, topic_name):
+        """Start holding live frames for a topic; False if a replay of it is already running"""
+        if topic_name in self._replay_buffers:
+            return False
+        self._replay_buffers[topic_name] = deque()
+        return True
+
+    def start_replay(self, topic, last_n, request_id, from_offset=None, preloaded=None):
+        """
+        Stream a topic's last N messages, or its messages from an offset, in
+        the background (begin_replay must have been called). preloaded is an
+        already fetched (entries, truncated) pair for from_offset.
+        """
+        last_n = min(last_n, getattr(settings, 'PUBSUB_REPLAY_MAX_LAST_N', 1000))
+        self.track_replay(
+            topic.name, self.stream_last_n_messages(topic, last_n, request_id, from_offset, preloaded)
+        )
 
-    async def send_last_n_messages_async(self, topic, last_n, request_id):
-        """Async wrapper to send last N messages"""
+    def track_replay(self, topic_name, coroutine):
+        """Run a topic's replay (or held frame release) as a task that disconnect cancels"""
+        task = asyncio.create_task(coroutine)
+        self._replay_tasks[topic_name] = task
+        task.add_done_callback(lambda _: self._replay_tasks.pop(topic_name, None))
+
+    def abort_replays(self):
+        """Release held frames of replays that were begun but never started"""
+        for topic_name in list(self._replay_buffers):
+            if topic_name not in self._replay_tasks:
+                self.track_replay(topic_name, self.release_held_frames(topic_name, ()))
+
+    async def stream_last_n_messages(self, topic, last_n, request_id, from_offset=None, preloaded=None):
+        """
+        Stream the last N messages (or, given from_offset, every message at or
+        after that offset), oldest first, through the outbound queue.
+        Frames go out in chunks, and each chunk waits for credit (the queue
+        draining below PUBSUB_REPLAY_CREDIT frames), so a large replay never
+        floods the socket. Ends with a replay_end marker, then releases the
+        live frames held during replay, minus any the replay already sent.
+        If more than PUBSUB_REPLAY_HOLD_LIMIT live frames pile up meanwhile,
+        the replay stops early and replay_end reports it as truncated.
+        """
+        chunk_size = getattr(settings, 'PUBSUB_REPLAY_CHUNK_SIZE', 100)
+        credit = getattr(settings, 'PUBSUB_REPLAY_CREDIT', 500)
+        replayed_ids = set()
+        last_offset = None
+        truncated = False
         try:
-            # Get messages from database
-            messages_data = await self.get_last_n_messages(topic, last_n)
+            if preloaded is not None:
+                entries, truncated = preloaded
+                chunks = iter_chunks(entries, chunk_size)
+            elif from_offset is not None:
+                entries, truncated = await self.get_messages_from_offset(topic, from_offset)
+                chunks = iter_chunks(entries, chunk_size)
+            else:
+                chunks = self.iter_last_n_messages(topic, last_n, chunk_size)
+            build = replay_frame_builder(topic.name)
+            tracker = self.durable_topics.get(topic.name)
+            self._replay_stats['replays'] += 1
             
-            # Send each message
-            for message_data in messages_data:
-                await self.send(text_data=json.dumps(message_data))
+            async for chunk in chunks:
+                if topic.name in self._replay_overflowed:
+                    truncated = True
+                    break
+                await self.outbound.wait_below(max(credit - len(chunk), 0))
+                if self.outbound.closed:
+                    return
+                # Stored JSON goes into the frames as text; it is only decoded
+                # for connections using a non-JSON wire format
+                for message_id, data, published_at, sequence in chunk:
+                    self.enqueue_frame(
+                        Frame(json_text=build(message_id, data, published_at, sequence)),
+                        (tracker, (sequence,)) if tracker is not None else None
+                    )
+                    replayed_ids.add(message_id)
+                    last_offset = sequence
+                self._replay_stats['frames_replayed'] += len(chunk)
                 
         except Exception as e:
-            print(f"Error sending last N messages: {e}")
+            logger.error("Error sending last N messages: %s", e)
+        finally:
+            if not self.outbound.closed:
+                self.enqueue_frame(self.encode_frame({
+                    "type": "replay_end",
+                    "topic": topic.name,
+                    "count": len(replayed_ids),
+                    # Resume from last_offset + 1; truncated means the gap was
+                    # larger than PUBSUB_RESUME_MAX_MESSAGES
+                    "last_offset": last_offset,
+                    "truncated": truncated,
+                    "request_id": request_id,
+                    "timestamp": timezone.now().isoformat()
+                }))
+            await self.release_held_frames(topic.name, replayed_ids)
 
-    @database_sync_to_async
-    def get_last_n_messages(self, topic, last_n):
-        """Get last N messages for a topic"""
+    async def release_held_frames(self, topic_name, replayed_ids):
+        """
+        Queue the live frames held during a replay, skipping messages the
+        replay already sent. They go out in chunks with the same credit as
+        the replay; live frames arriving meanwhile are held behind them, so
+        the topic's order is kept.
+        """
+        chunk_size = getattr(settings, 'PUBSUB_REPLAY_CHUNK_SIZE', 100)
+        credit = getattr(settings, 'PUBSUB_REPLAY_CREDIT', 500)
+        held = self._replay_buffers.get(topic_name)
         try:
-            messages = Message.objects.filter(topic=topic).order_by('-published_at')[:last_n]
-            
-            messages_data = []
-            for message in messages:
-                message_data = {
-                    "type": "message",
-                    "topic": topic.name,
-                    "message": {
-                        "id": str(message.id),
-                        "payload": json.loads(message.data),
-                        "timestamp": message.published_at.isoformat()
-                    }
-                }
-                messages_data.append(message_data)
+            while held and topic_name in self.subscribed_topics and not self.outbound.closed:
+                count = min(len(held), chunk_size)
+                await self.outbound.wait_below(max(credit - count, 0))
+                for _ in range(min(count, len(held))):
+                    frame, message_ids, receipt = held.popleft()
+                    if message_ids and all(message_id in replayed_ids for message_id in message_ids):
+                        self._replay_stats['duplicates_skipped'] += 1
+                        drop_frame(frame)
+                        continue
+                    if not self.enqueue_frame(frame, receipt):
+                        drop_frame(frame)
+        finally:
+            for frame, _, _ in self._replay_buffers.pop(topic_name, None) or ():
+                drop_frame(frame)
+            self._replay_overflowed.discard(topic_name)
+
+    async def get_messages_from_offset(self, topic, from_offset):
+        """
+        Get a topic's messages at or after an offset, oldest first, as
+        (message_id, data, published_at, sequence). Returns (entries, truncated).
+        """
+        try:
+            if get_fanout_mode() == FANOUT_LOCAL:
+                entries = topic_history.get_since(topic.name, from_offset)
+                if entries is not None:
+                    return entries, False
+            # Write out buffered publishes so the range scan sees them
+            await self.get_message_writer().flush()
+            limit = getattr(settings, 'PUBSUB_RESUME_MAX_MESSAGES', 10000)
+            entries = await self.fetch_messages_from_offset(topic, from_offset, limit + 1)
+            return entries[:limit], len(entries) > limit
             
-            return messages_data
-                
         except Exception as e:
-            print(f"Error getting last N messages: {e}")
-            return []
+            logger.error("Error getting messages from offset: %s", e)
+            return [], False
+
+    @database_sync_to_async
+    def fetch_messages_from_offset(self, topic, from_offset, limit):
+        """Get up to limit messages at or after an offset with one range scan on (topic, sequence)"""
+        rows = (
+            Message.objects.filter(topic=topic, sequence__gte=from_offset)
+            .order_by('sequence')
+            .values_list('id', 'data', 'published_at', 'sequence')[:limit]
+        )
+        return [
+            (str(message_id), data, published_at, sequence)
+            for message_id, data, published_at, sequence in rows.iterator(chunk_size=2000)
+        ]
+
+    async def iter_last_n_messages(self, topic, last_n, chunk_size):
+        """
+        Yield a topic's last N messages as (message_id, data, published_at,
+        sequence), oldest first, in chunks of at most chunk_size.
+        """
+        if get_fanout_mode() == FANOUT_LOCAL:
+            entries = list(await topic_history.get_recent(topic, last_n))
+            entries.reverse()  # oldest first, so replay runs straight into live messages
+            async for chunk in iter_chunks(entries, chunk_size):
+                yield chunk
+            return
+        
+        # Other workers' publishes never reach this worker's buffer: page through
+        # the database from the oldest of the last N, one chunk per query
+        key = await self.fetch_last_n_start(topic, last_n)
+        remaining = last_n
+        inclusive = True
+        while remaining > 0:
+            chunk, key = await self.fetch_message_page(topic, key, inclusive, min(chunk_size, remaining))
+            if not chunk:
+                return
+            yield chunk
+            remaining -= len(chunk)
+            inclusive = False
 
     @database_sync_to_async
+    def fetch_last_n_start(self, topic, last_n):
+        """Get the (published_at, id) key of the oldest of a topic's last N messages; None if it has fewer"""
+        rows = list(
+            Message.objects.filter(topic=topic)
+            .order_by('-published_at', '-id')
+            .values_list('published_at', 'id')[last_n - 1:last_n]
+        )
+        return rows[0] if rows else None
+
+    @database_sync_to_async
+    def fetch_message_page(self, topic, key, inclusive, limit):
+        """
+        Get up to limit messages of a topic ordered by (published_at, id),
+        from key on (None for the oldest). Returns (entries, key of the last entry).
+        """
+        messages = Message.objects.filter(topic=topic)
+        if key is not None:
+            published_at, message_id = key
+            same_time = Q(id__gte=message_id) if inclusive else Q(id__gt=message_id)
+            messages = messages.filter(Q(published_at__gt=published_at) | Q(same_time, published_at=published_at))
+        rows = list(
+            messages.order_by('published_at', 'id')
+            .values_list('id', 'data', 'published_at', 'sequence')[:limit]
+        )
+        if not rows:
+            return [], key
+        entries = [
+            (str(message_id), data, published_at, sequence)
+            for message_id, data, published_at, sequence in rows
+        ]
+        return entries, (rows[-1][2], rows[-1][0])
+
     def update_connection_activity(self):
-        """Update connection last activity timestamp"""
-        try:
-            if self.connection:
-                self.connection.update_activity()
-            return True
-        except Exception as e:
-            print(f"Error updating connection activity: {e}")
-            return False
+        """Record connection activity; written to the database in coalesced batches"""
+        if self.connection_id:
+            connection_activity.touch(self.connection_id)
+        return True
+
+    @classmethod
+    def encode_frame(cls, frame_data, json_data=None):
+        """Wrap an outbound frame so it is encoded once per wire format and shared by every recipient"""
+        return Frame(frame_data, json_data)
 
-    async def broadcast_message(self, topic_name, message_data, message_id, publisher_client_id):
-        """Broadcast message to all subscribers of the topic"""
+    @classmethod
+    def get_fanout_stats(cls):
+        """Get fan-out counters, including encodes per publish"""
+        stats = dict(cls._fanout_stats)
+        # frames_encoded also counts replayed, relayed and control frames
+        stats['frames_encoded'] = Frame.encodes
+        stats['publish_encodes'] = Frame.publish_encodes
+        publishes = stats['publishes']
+        stats['encodes_per_publish'] = (
+            stats['publish_encodes'] / publishes if publishes else 0.0
+        )
+        codecs = {}
+        for connection in tuple(cls._active_connections):
+            codecs[connection.codec.name] = codecs.get(connection.codec.name, 0) + 1
+        stats['connections_by_codec'] = codecs
+        stats['pattern_subscriptions'] = cls._pattern_connections.patterns
+        stats['replay'] = dict(cls._replay_stats)
+        return stats
+
+    @classmethod
+    def get_dispatcher(cls):
+        """Get the shared topic dispatcher, creating it on first use"""
+        if cls._dispatcher is None:
+            if get_fanout_mode() == FANOUT_CHANNEL_LAYER:
+                fanout = cls.fanout_to_group
+            else:
+                fanout = cls.fanout_frames
+            cls._dispatcher = TopicDispatcher(fanout=fanout)
+        return cls._dispatcher
+
+    async def broadcast_message(self, topic_name, message_data, message_id, publisher_client_id, offset=None,
+                                trace=None):
+        """Queue a message for broadcast to all subscribers of the topic"""
         try:
             # Create broadcast message
             broadcast_data = {
@@ -527,34 +1703,233 @@ class PubSubConsumer(AsyncWebsocketConsumer):
                 "topic": topic_name,
                 "message": {
                     "id": message_id,
+                    "offset": offset,
                     "payload": message_data.get('payload', {}),
                     "timestamp": timezone.now().isoformat()
                 },
                 "publisher_client_id": publisher_client_id
             }
             
-            # Send to all active connections subscribed to this topic
-            if topic_name in self._topic_connections:
-                active_connections = self._topic_connections[topic_name].copy()
-                print(f"Broadcasting message {message_id} to topic {topic_name}")
-                print(f"Message data: {broadcast_data}")
-                print(f"Active connections: {len(active_connections)}")
-                
-                # Send message to all subscribers (except the publisher)
-                for connection in active_connections:
-                    if connection != self:  # Don't send back to publisher
-                        try:
-                            await connection.send(text_data=json.dumps(broadcast_data))
-                            print(f"Message sent to connection: {connection.connection_id}")
-                        except Exception as e:
-                            print(f"Failed to send message to connection {connection.connection_id}: {e}")
-                            # Remove failed connection
-                            self._topic_connections[topic_name].discard(connection)
-            else:
-                print(f"No active connections for topic: {topic_name}")
+            self._fanout_stats['publishes'] += 1
+            metrics.messages_published.inc(topic_name)
+            
+            # Subscribers on other workers are only visible through the channel layer
+            if get_fanout_mode() == FANOUT_LOCAL and not self.get_local_subscribers(topic_name):
+                logger.debug("No active connections for topic: %s", topic_name,
+                             extra={'event': 'publish.no_subscribers'})
+                return
+            
+            # Encode the frame once per wire format; every subscriber using it gets the same bytes.
+            # When the publish frame's payload text was kept, JSON frames splice it in as is.
+            json_data = None
+            raw_payload = raw_member(message_data, 'payload')
+            if raw_payload is not None:
+                json_data = dict(broadcast_data, message=dict(broadcast_data['message'], payload=raw_payload))
+            frame = self.encode_frame(broadcast_data, json_data)
+            frame.published = True
+            frame.trace = trace
+            
+            logger.debug("Broadcasting message %s to topic %s", message_id, topic_name,
+                         extra={'event': 'publish.broadcast'})
+            logger.debug("Message data: %s", broadcast_data, extra={'event': 'publish.payload'})
+            
+            # Hand off to the topic's dispatcher task; the publisher does not
+            # wait for subscriber sends. The trace stays open until the
+            # fan-out has queued the frame.
+            if trace is not None:
+                trace.hold()
+            await self.get_dispatcher().submit(topic_name, frame, sender=self)
             
         except Exception as e:
-            print(f"Error broadcasting message: {e}")
+            logger.error("Error broadcasting message: %s", e)
+
+    async def broadcast_message_batch(self, topic_name, topic_batch, publisher_client_id, trace=None):
+        """Queue several messages of one topic for broadcast as a single batch frame"""
+        try:
+            self._fanout_stats['publishes'] += len(topic_batch)
+            metrics.messages_published.inc(topic_name, amount=len(topic_batch))
+            
+            if get_fanout_mode() == FANOUT_LOCAL and not self.get_local_subscribers(topic_name):
+                return
+            
+            batch_data = {
+                "type": "message_batch",
+                "topic": topic_name,
+                "messages": [
+                    {
+                        "id": str(message.id),
+                        "offset": message.sequence,
+                        "payload": message_data.get('payload', {}),
+                        "timestamp": message.published_at.isoformat()
+                    }
+                    for message, message_data in topic_batch
+                ],
+                "publisher_client_id": publisher_client_id
+            }
+            
+            # One encode (per wire format) for the whole batch, splicing kept payload text
+            json_data = None
+            if any(raw_text(message_data) is not None for _, message_data in topic_batch):
+                json_data = dict(batch_data, messages=[
+                    dict(entry, payload=raw_member(message_data, 'payload', entry['payload']))
+                    for entry, (_, message_data) in zip(batch_data['messages'], topic_batch)
+                ])
+            frame = self.encode_frame(batch_data, json_data)
+            frame.published = True
+            frame.trace = trace
+            
+            if trace is not None:
+                trace.hold()
+            await self.get_dispatcher().submit(topic_name, frame, sender=self)
+            
+        except Exception as e:
+            logger.error("Error broadcasting message batch: %s", e)
+
+    @classmethod
+    async def fanout_frames(cls, topic_name, frames):
+        """Queue encoded frames for every local subscriber of the topic except each frame's sender"""
+        try:
+            await cls._fanout_frames(topic_name, frames)
+        finally:
+            # Each frame's trace was held for this fan-out by the publisher
+            for frame, _ in frames:
+                if frame.trace is not None:
+                    frame.trace.release()
+
+    @classmethod
+    async def _fanout_frames(cls, topic_name, frames):
+        """Queue frames on the local subscribers' outbound queues (fanout_frames without the trace release)"""
+        # Exact and pattern subscriptions are merged, so a connection with
+        # both gets each frame once
+        active_connections = cls.get_local_subscribers(topic_name)
+        if not active_connections:
+            return
+        
+        logger.debug("Active connections: %d (frames encoded: %d)", len(active_connections), len(frames),
+                     extra={'event': 'fanout.batch'})
+        
+        for frame, _ in frames:
+            if frame.trace is not None:
+                frame.trace.start_fanout(frame)
+        
+        # Checked once per batch; per-recipient records are only built at DEBUG
+        debug = logger.isEnabledFor(logging.DEBUG)
+        delivered = 0
+        for connection in active_connections:
+            for frame, sender in frames:
+                if connection is sender:  # Don't send back to publisher
+                    connection.skip_own(topic_name, frame)
+                    continue
+                # Queue on the subscriber's bounded outbound queue; its writer
+                # task does the socket send, so one slow client can't stall the topic.
+                # The copy holds the trace until it is sent or dropped.
+                if frame.trace is not None:
+                    frame.trace.hold()
+                if connection.deliver(topic_name, frame):
+                    delivered += 1
+                    if debug:
+                        logger.debug("Message sent to connection: %s", connection.connection_id,
+                                     extra={'event': 'fanout.delivery'})
+                else:
+                    if frame.trace is not None:
+                        frame.trace.release()
+                    if debug:
+                        logger.debug("Message dropped for connection: %s", connection.connection_id,
+                                     extra={'event': 'fanout.drop'})
+        cls._fanout_stats['deliveries'] += delivered
+        metrics.messages_delivered.inc(topic_name, amount=delivered)
+
+    @classmethod
+    async def fanout_to_group(cls, topic_name, frames):
+        """Send encoded frames to the topic's channel-layer group as one batched event"""
+        channel_layer = get_channel_layer()
+        # Frames cross workers as JSON text; receivers transcode only for binary clients
+        json_codec = CODECS[JSONCodec.name]
+        # Sends happen on other workers, so traces end at fan-out start here
+        for frame, _ in frames:
+            if frame.trace is not None:
+                frame.trace.start_fanout(frame)
+        encoded_frames = [
+            [
+                frame.encode(json_codec), sender.channel_name if sender else None,
+                frame_message_ids(frame.data), frame_offsets(frame.data)
+            ]
+            for frame, sender in frames
+        ]
+        await channel_layer.group_send(topic_group_name(topic_name), {
+            "type": "pubsub.frames",
+            "topic": topic_name,
+            "frames": encoded_frames,
+        })
+        
+        # Workers holding wildcard subscriptions match the topic themselves
+        if wildcards_enabled():
+            await channel_layer.group_send(PATTERN_GROUP, {
+                "type": PATTERN_FRAMES_EVENT,
+                "topic": topic_name,
+                "frames": encoded_frames,
+            })
+
+    @classmethod
+    def deliver_pattern_frames(cls, event):
+        """Queue frames from another worker's publish for this worker's matching pattern subscribers"""
+        topic_name = event['topic']
+        # One event per worker: wrap each frame once so binary recipients share its encoding
+        frames = [(Frame(json_text=frame_text), sender_channel) for frame_text, sender_channel, _, _ in event['frames']]
+        for connection in cls._pattern_connections.match(topic_name):
+            # Exact subscribers already got these frames through the topic group
+            if topic_name in connection.subscribed_topics:
+                continue
+            for frame, sender_channel in frames:
+                if sender_channel == connection.channel_name:  # Don't send back to publisher
+                    continue
+                if connection.enqueue_frame(frame):
+                    cls._fanout_stats['deliveries'] += 1
+                    metrics.messages_delivered.inc(topic_name)
+
+    @classmethod
+    def relayed_frame(cls, topic_name, frame_text, message_ids):
+        """Get the shared Frame for JSON text relayed through the channel layer"""
+        if not message_ids:
+            return Frame(json_text=frame_text)
+        key = (topic_name, tuple(message_ids))
+        frame = cls._relayed_frames.get(key)
+        if frame is None:
+            frame = cls._relayed_frames[key] = Frame(json_text=frame_text)
+            if len(cls._relayed_frames) > RELAYED_FRAME_CACHE_SIZE:
+                cls._relayed_frames.popitem(last=False)
+        return frame
+
+    async def pubsub_frames(self, event):
+        """Handle a batch of frames delivered through the channel layer"""
+        for frame_text, sender_channel, message_ids, offsets in event['frames']:
+            if sender_channel == self.channel_name:  # Don't send back to publisher
+                self.skip_own(event['topic'], frame_text, tuple(offsets))
+                continue
+            # Every subscriber gets its own copy of the event; binary ones share
+            # one Frame, so the text is decoded and re-encoded once per worker
+            frame = frame_text
+            if self.codec.binary:
+                frame = self.relayed_frame(event['topic'], frame_text, message_ids)
+            if self.deliver(event['topic'], frame, message_ids, tuple(offsets)):
+                self._fanout_stats['deliveries'] += 1
+                metrics.messages_delivered.inc(event['topic'])
+
+    async def pubsub_topic_deleted(self, event):
+        """Handle a topic deletion broadcast through the channel layer"""
+        topic_name = event['topic']
+        if topic_name not in self.subscribed_topics:
+            return
+        
+        self.enqueue_frame(self.encode_frame({
+            "type": "info",
+            "topic": topic_name,
+            "msg": "topic_deleted",
+            "ts": event['ts']
+        }))
+        self.subscribed_topics.discard(topic_name)
+        self.durable_topics.pop(topic_name, None)
+        await self.remove_topic_connection(topic_name)
 
     @database_sync_to_async
     def get_topic_subscriptions(self, topic_name):
@@ -568,5 +1943,18 @@ class PubSubConsumer(AsyncWebsocketConsumer):
         except Topic.DoesNotExist:
             return []
         except Exception as e:
-            print(f"Error getting topic subscriptions: {e}")
-            return []
\ No newline at end of file
+            logger.error("Error getting topic subscriptions: %s", e)
+            return []
+
+
+control_channel.register(PATTERN_FRAMES_EVENT, PubSubConsumer.deliver_pattern_frames)
+
+
+# Connection and subscription gauges are read from the registry at scrape time
+metrics.active_connections.set_function(
+    lambda: {(): len(PubSubConsumer._active_connections)}
+)
+metrics.subscriptions.set_function(lambda: {
+    ('topic',): PubSubConsumer.get_registry_stats()['subscribers'],
+    ('pattern',): PubSubConsumer._pattern_connections.patterns,
+})
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Channel-layer group every worker's control channel joins
+CONTROL_GROUP = 'pubsub.control'
+
+
+def is_multi_worker():
+    """True when fan-out goes through the channel layer (several workers may run)"""
+    return getattr(settings, 'PUBSUB_FANOUT_MODE', 'local') == 'channel_layer'
+
+
+class ControlChannel:
+    """
+    Worker-wide control channel for cross-worker events such as cache
+    invalidation. Each worker opens one channel on the channel layer, joins
+    CONTROL_GROUP (plus any groups added with join()) and dispatches incoming
+    events to registered handlers.
+    Only active in channel_layer fan-out mode; otherwise broadcasts are no-ops
+    because there is only one worker.
+    """
+
+    def __init__(self, refresh_interval=3600):
+        # Re-join the group periodically so channel-layer group expiry never drops us
+        self.refresh_interval = refresh_interval
+        self.handlers = {}  # {event_type: callable(event)}
+        self.groups = {CONTROL_GROUP}  # channel-layer groups this worker's channel is in
+        self.channel_name = None
+        self._task = None
+        self._loop = None
+
+    def register(self, event_type, handler):
+        """Register a handler for a control event type"""
+        self.handlers[event_type] = handler
+
+    def ensure_started(self):
+        """Start the listener on the running loop (multi-worker mode only)"""
+        if not is_multi_worker():
+            return
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._listen())
+
+    async def _listen(self):
+        """Receive control events for this worker and dispatch them"""
+        channel_layer = get_channel_layer()
+        self.channel_name = await channel_layer.new_channel()
+        for group in list(self.groups):
+            await channel_layer.group_add(group, self.channel_name)
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    channel_layer.receive(self.channel_name), self.refresh_interval
+                )
+            except asyncio.TimeoutError:
+                for group in list(self.groups):
+                    await channel_layer.group_add(group, self.channel_name)
+                continue
+
+            handler = self.handlers.get(event.get('type'))
+            if handler is None:
+                continue
+            try:
+                result = handler(event)
+                if asyncio.iscoroutine(result):
+                    await result
+            except Exception as e:
+                logger.error("Error handling control event %s: %s", event.get('type'), e)
+
+    async def join(self, group):
+        """Also receive events sent to another group on this worker's channel"""
+        if group in self.groups:
+            return
+        self.groups.add(group)
+        if is_multi_worker() and self.channel_name:
+            await get_channel_layer().group_add(group, self.channel_name)
+
+    async def leave(self, group):
+        """Stop receiving events sent to a group joined with join()"""
+        if group not in self.groups or group == CONTROL_GROUP:
+            return
+        self.groups.discard(group)
+        if is_multi_worker() and self.channel_name:
+            await get_channel_layer().group_discard(group, self.channel_name)
+
+    async def broadcast(self, event):
+        """Send a control event to every worker, including this one"""
+        if is_multi_worker():
+            await get_channel_layer().group_send(CONTROL_GROUP, event)
+
+    def broadcast_sync(self, event):
+        """Send a control event to every worker from synchronous code (views)"""
+        if is_multi_worker():
+            async_to_sync(get_channel_layer().group_send)(CONTROL_GROUP, event)
+
+
+# One control channel per worker process
+control_channel = ControlChannel()
@@ -0,0 +1,239 @@
+import threading
+from contextlib import contextmanager
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, Value, When
+from django.db.models.functions import Greatest
+from .models import Topic, TopicSubscription
+from .periodic import PeriodicFlusher
+
+
+class TopicCounters(PeriodicFlusher):
+    """
+    In-memory aggregator for per-topic message counts, last-published times
+    and subscriber counts.
+    Publishes and (un)subscribes only bump a dict entry. Every interval, all
+    pending deltas are written in one UPDATE using F() expressions, so workers
+    updating the same topic never overwrite each other's counts.
+    REST views add the not-yet-flushed deltas to the stored values.
+    A slower reconcile pass recomputes subscriber_count from the active
+    subscription rows to correct any drift. Subscription writes run inside
+    subscriber_changes(), so the reconcile can tell which rows already have
+    their delta recorded.
+    """
+
+    def __init__(self, interval=None, reconcile_interval=None):
+        super().__init__(interval or getattr(settings, 'PUBSUB_COUNTER_FLUSH_INTERVAL', 1.0))
+        self.reconcile_interval = (
+            reconcile_interval or getattr(settings, 'PUBSUB_SUBSCRIBER_RECONCILE_INTERVAL', 300)
+        )
+        self._lock = threading.Lock()  # views read from sync threads
+        self._pending = {}  # {topic_id: [message_delta, last_published, subscriber_delta]}
+        self._flushing = {}  # batch currently being written, still counted as live
+        self._changing = {}  # {topic_id: subscription writes in progress}
+        self._generations = {}  # {topic_id: subscription writes started}
+        self._since_reconcile = 0.0
+        self.reconciles = 0
+
+    def _entry(self, topic_id):
+        """Get or create a topic's pending entry (caller holds the lock)"""
+        entry = self._pending.get(topic_id)
+        if entry is None:
+            entry = self._pending[topic_id] = [0, None, 0]
+        return entry
+
+    def record_messages(self, topic_id, count, last_published):
+        """Add published messages to a topic's pending counters"""
+        with self._lock:
+            entry = self._entry(topic_id)
+            entry[0] += count
+            if entry[1] is None or last_published > entry[1]:
+                entry[1] = last_published
+        self.ensure_started()
+
+    def record_subscribers(self, topic_id, delta):
+        """Add a subscriber count change (+1 subscribe, -1 unsubscribe) for a topic"""
+        with self._lock:
+            self._entry(topic_id)[2] += delta
+        self.ensure_started()
+
+    @contextmanager
+    def subscriber_changes(self, topic_ids):
+        """Wrap writing subscription rows of topics and recording their deltas"""
+        topic_ids = list(topic_ids)
+        with self._lock:
+            for topic_id in topic_ids:
+                self._changing[topic_id] = self._changing.get(topic_id, 0) + 1
+                self._generations[topic_id] = self._generations.get(topic_id, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                for topic_id in topic_ids:
+                    if self._changing[topic_id] == 1:
+                        del self._changing[topic_id]
+                    else:
+                        self._changing[topic_id] -= 1
+
+    def get_delta(self, topic_id):
+        """Get (unflushed message count, latest last_published, unflushed subscriber delta)"""
+        count, last_published, subscribers = 0, None, 0
+        with self._lock:
+            for pending in (self._flushing, self._pending):
+                entry = pending.get(topic_id)
+                if entry is None:
+                    continue
+                count += entry[0]
+                subscribers += entry[2]
+                if entry[1] and (last_published is None or entry[1] > last_published):
+                    last_published = entry[1]
+        return count, last_published, subscribers
+
+    def apply(self, topic):
+        """Overlay live counters onto a Topic instance; returns the topic"""
+        count, last_published, subscribers = self.get_delta(topic.pk)
+        topic.message_count += count
+        topic.subscriber_count = max(topic.subscriber_count + subscribers, 0)
+        if last_published and (topic.last_published is None or last_published > topic.last_published):
+            topic.last_published = last_published
+        return topic
+
+    def apply_all(self, topics):
+        """Overlay live counters onto many Topic instances, taking the lock once"""
+        with self._lock:
+            deltas = {}
+            for pending in (self._flushing, self._pending):
+                for topic_id, (count, last_published, subscribers) in pending.items():
+                    delta = deltas.setdefault(topic_id, [0, None, 0])
+                    delta[0] += count
+                    delta[2] += subscribers
+                    if last_published and (delta[1] is None or last_published > delta[1]):
+                        delta[1] = last_published
+        for topic in topics:
+            delta = deltas.get(topic.pk)
+            if delta is None:
+                continue
+            topic.message_count += delta[0]
+            topic.subscriber_count = max(topic.subscriber_count + delta[2], 0)
+            if delta[1] and (topic.last_published is None or delta[1] > topic.last_published):
+                topic.last_published = delta[1]
+        return topics
+
+    def discard(self, topic_id):
+        """Drop pending counters for a deleted topic"""
+        with self._lock:
+            self._pending.pop(topic_id, None)
+            self._generations.pop(topic_id, None)
+
+    async def flush(self):
+        """Write all pending counters in one batched UPDATE, reconciling when due"""
+        with self._lock:
+            batch = self._pending
+            self._flushing, self._pending = batch, {}
+        try:
+            if batch:
+                await self._write(batch)
+        except Exception:
+            # Put the deltas back so they are retried on the next interval
+            with self._lock:
+                for topic_id, (count, last_published, subscribers) in batch.items():
+                    entry = self._entry(topic_id)
+                    entry[0] += count
+                    entry[2] += subscribers
+                    if last_published and (entry[1] is None or last_published > entry[1]):
+                        entry[1] = last_published
+            raise
+        finally:
+            with self._lock:
+                self._flushing = {}
+
+        self._since_reconcile += self.interval
+        if self._since_reconcile >= self.reconcile_interval:
+            self._since_reconcile = 0.0
+            await self.reconcile()
+            return True
+        return bool(batch)
+
+    @database_sync_to_async
+    def _write(self, batch):
+        """Single UPDATE ... SET message_count = message_count + CASE ... for all topics"""
+        updates = {}
+        message_cases = [When(pk=topic_id, then=Value(entry[0])) for topic_id, entry in batch.items() if entry[0]]
+        if message_cases:
+            updates['message_count'] = F('message_count') + Case(
+                *message_cases, default=Value(0), output_field=IntegerField()
+            )
+        published_cases = [When(pk=topic_id, then=Value(entry[1])) for topic_id, entry in batch.items() if entry[1]]
+        if published_cases:
+            updates['last_published'] = Case(*published_cases, default=F('last_published'))
+        subscriber_cases = [When(pk=topic_id, then=Value(entry[2])) for topic_id, entry in batch.items() if entry[2]]
+        if subscriber_cases:
+            updates['subscriber_count'] = Greatest(
+                F('subscriber_count') + Case(
+                    *subscriber_cases, default=Value(0), output_field=IntegerField()
+                ),
+                Value(0)
+            )
+        if updates:
+            Topic.objects.filter(pk__in=list(batch)).update(**updates)
+
+    async def reconcile(self):
+        """Recompute subscriber_count from active subscription rows"""
+        await self._reconcile()
+        self.reconciles += 1
+
+    @database_sync_to_async
+    def _reconcile(self):
+        """
+        One GROUP BY over active subscriptions, with the topic rows locked;
+        rewrite only topics that drifted.
+        Rows counted here may have deltas still waiting in memory, so the
+        stored count is set to the row count minus those deltas, and the next
+        flush lands on the true count. Topics whose subscriptions changed
+        while counting are left for the next pass.
+        """
+        with self._lock:
+            generations = dict(self._generations)
+            busy = set(self._changing)
+        with transaction.atomic():
+            topics = list(Topic.objects.select_for_update().only('id', 'subscriber_count').order_by('pk'))
+            actual = dict(
+                TopicSubscription.objects.filter(is_active=True)
+                .values_list('topic_id')
+                .annotate(count=Count('id'))
+                .order_by()
+            )
+            with self._lock:
+                busy.update(self._changing)
+                busy.update(topic_id for topic_id, generation in self._generations.items()
+                            if generations.get(topic_id) != generation)
+                deltas = {}
+                for pending in (self._flushing, self._pending):
+                    for topic_id, entry in pending.items():
+                        deltas[topic_id] = deltas.get(topic_id, 0) + entry[2]
+            drifted = []
+            for topic in topics:
+                if topic.pk in busy:
+                    continue
+                count = max(actual.get(topic.pk, 0) - deltas.get(topic.pk, 0), 0)
+                if topic.subscriber_count != count:
+                    topic.subscriber_count = count
+                    drifted.append(topic)
+            if drifted:
+                Topic.objects.bulk_update(drifted, ['subscriber_count'], batch_size=500)
+
+    def get_stats(self):
+        """Get aggregator statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_topics": pending,
+            "flushes": self.flushes,
+            "interval": self.interval,
+            "reconciles": self.reconciles,
+        }
+
+
+# Shared by consumers (writers) and views (readers) in this process
+topic_counters = TopicCounters()
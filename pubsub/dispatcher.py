@@ -0,0 +1,92 @@
+import asyncio
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TopicDispatcher:
+    """
+    Per-topic fan-out dispatcher.
+    Each active topic gets its own asyncio task draining an inbound queue,
+    so publishers only enqueue and never wait on subscriber sockets.
+    Frames of one topic are delivered strictly in order; a shared semaphore
+    limits how many topics fan out at the same time. Frames that pile up
+    while a fan-out is running are handed over together as one batch.
+    """
+
+    def __init__(self, fanout, concurrency=None, queue_size=None, idle_timeout=None,
+                 batch_size=None):
+        # fanout is an async callable: fanout(topic_name, [(frame, sender), ...])
+        self.fanout = fanout
+        self.concurrency = concurrency or getattr(settings, 'PUBSUB_DISPATCHER_CONCURRENCY', 64)
+        self.queue_size = queue_size or getattr(settings, 'PUBSUB_DISPATCHER_QUEUE_SIZE', 10000)
+        self.idle_timeout = idle_timeout or getattr(settings, 'PUBSUB_DISPATCHER_IDLE_TIMEOUT', 30)
+        self.batch_size = batch_size or getattr(settings, 'PUBSUB_DISPATCHER_BATCH_SIZE', 100)
+        self._queues = {}  # {topic_name: asyncio.Queue}
+        self._tasks = {}  # {topic_name: asyncio.Task}
+        self._semaphore = None
+        self._loop = None
+        self.frames_dispatched = 0
+        self.batches_dispatched = 0
+
+    def _bind_loop(self):
+        """Reset per-loop state when used from a new event loop"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._queues = {}
+            self._tasks = {}
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def submit(self, topic_name, frame, sender=None):
+        """
+        Queue a frame for fan-out on a topic.
+        Returns as soon as the frame is queued; only waits if the topic
+        already has queue_size frames pending.
+        """
+        self._bind_loop()
+        queue = self._queues.get(topic_name)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            self._queues[topic_name] = queue
+            self._tasks[topic_name] = asyncio.create_task(self._run(topic_name, queue))
+        await queue.put((frame, sender))
+
+    async def _run(self, topic_name, queue):
+        """Deliver queued frames for one topic, in order, until idle"""
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # No await between the check and the removal, so no
+                    # publisher can enqueue onto a queue nobody drains
+                    if self._queues.get(topic_name) is queue:
+                        del self._queues[topic_name]
+                        del self._tasks[topic_name]
+                    return
+                continue
+
+            # Take whatever else is already waiting, up to batch_size
+            batch = [item]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            try:
+                async with self._semaphore:
+                    await self.fanout(topic_name, batch)
+                self.frames_dispatched += len(batch)
+                self.batches_dispatched += 1
+            except Exception as e:
+                logger.error("Error dispatching frames to topic %s: %s", topic_name, e)
+
+    def get_stats(self):
+        """Get dispatcher statistics"""
+        return {
+            "active_topics": len(self._tasks),
+            "queued_frames": sum(queue.qsize() for queue in list(self._queues.values())),
+            "frames_dispatched": self.frames_dispatched,
+            "batches_dispatched": self.batches_dispatched,
+            "concurrency": self.concurrency,
+        }
@@ -0,0 +1,201 @@
+import threading
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import BigIntegerField, Case, F, Max, Q, Value, When, Window
+from django.db.models.functions import Greatest, RowNumber
+from django.utils import timezone
+from .models import DurableSubscription, Message
+from .periodic import PeriodicFlusher
+
+
+class OffsetTracker:
+    """
+    Delivered offsets of one durable subscription on one connection.
+    The cursor only moves over a contiguous run of delivered offsets, so a
+    message still in flight (published on another worker, or queued behind
+    a slower publish) is not skipped when a higher offset is sent first.
+    Offsets past a hole wait in ahead. A hole still open after hole_timeout
+    seconds is a number that was never published to this subscriber (the
+    unused rest of an offset block, or a failed publish) and is skipped.
+    """
+
+    __slots__ = ('subscription_id', 'cursor', 'ahead', 'hole_since', 'hole_timeout')
+
+    def __init__(self, subscription_id, cursor, hole_timeout=None):
+        self.subscription_id = subscription_id
+        self.cursor = cursor  # every offset up to here was delivered
+        self.ahead = set()  # delivered offsets past the first hole
+        self.hole_since = None
+        self.hole_timeout = hole_timeout or getattr(settings, 'PUBSUB_DURABLE_HOLE_TIMEOUT', 5.0)
+
+    def _advance(self):
+        while self.cursor + 1 in self.ahead:
+            self.cursor += 1
+            self.ahead.remove(self.cursor)
+
+    def add(self, offsets):
+        """Record delivered offsets; returns True if the cursor moved"""
+        start = self.cursor
+        for offset in offsets:
+            if offset is not None and offset > self.cursor:
+                self.ahead.add(offset)
+        self._advance()
+        if not self.ahead:
+            self.hole_since = None
+        else:
+            now = time.monotonic()
+            if self.hole_since is None or self.cursor != start:
+                self.hole_since = now
+            elif now - self.hole_since >= self.hole_timeout:
+                self.cursor = min(self.ahead) - 1
+                self._advance()
+                self.hole_since = now if self.ahead else None
+        return self.cursor != start
+
+
+class DurableSubscriptions(PeriodicFlusher):
+    """
+    Bulk operations on durable subscriptions, plus write-behind of their
+    delivered offsets.
+    Connections track the offsets their writer has sent (OffsetTracker) and
+    record each subscription's cursor here; every interval all advanced
+    cursors are written with one UPDATE.
+    Offsets only move forward, so an overlapping old and new connection of
+    the same client can't rewind each other.
+    """
+
+    def __init__(self, interval=None):
+        super().__init__(interval or getattr(settings, 'PUBSUB_DURABLE_OFFSET_FLUSH_INTERVAL', 1.0))
+        self._lock = threading.Lock()
+        self._pending = {}  # {durable_subscription_id: last delivered offset}
+        self.offsets_written = 0
+
+    def record(self, subscription_id, offset):
+        """Record that every message up to offset was delivered on a durable subscription"""
+        if offset is None:
+            return
+        with self._lock:
+            if offset > self._pending.get(subscription_id, 0):
+                self._pending[subscription_id] = offset
+        self.ensure_started()
+
+    async def flush(self):
+        """Write all advanced offsets in one UPDATE"""
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+        try:
+            await self._write(batch)
+        except Exception:
+            # Keep the offsets for the next interval
+            with self._lock:
+                for subscription_id, offset in batch.items():
+                    if offset > self._pending.get(subscription_id, 0):
+                        self._pending[subscription_id] = offset
+            raise
+        self.offsets_written += len(batch)
+        return True
+
+    @database_sync_to_async
+    def _write(self, batch):
+        """UPDATE ... SET last_offset = MAX(last_offset, CASE ...) for every subscription"""
+        DurableSubscription.objects.filter(pk__in=list(batch)).update(
+            last_offset=Greatest(F('last_offset'), Case(
+                *[When(pk=pk, then=Value(offset)) for pk, offset in batch.items()],
+                default=F('last_offset'), output_field=BigIntegerField()
+            )),
+            updated_at=timezone.now()
+        )
+
+    @database_sync_to_async
+    def register(self, client_id, topics):
+        """
+        Make a client's subscriptions to topics durable. New ones start at the
+        topic's latest stored offset; existing ones keep theirs.
+        Returns {topic_name: (durable_subscription_id, last_offset)}.
+        """
+        with transaction.atomic():
+            existing = dict(DurableSubscription.objects.filter(
+                client_id=client_id, topic__in=topics
+            ).values_list('topic_id', 'pk'))
+            new_topics = [topic for topic in topics if topic.pk not in existing]
+            if new_topics:
+                latest = dict(
+                    Message.objects.filter(topic__in=new_topics)
+                    .values_list('topic_id')
+                    .annotate(latest=Max('sequence'))
+                    .order_by()
+                )
+                DurableSubscription.objects.bulk_create([
+                    DurableSubscription(
+                        client_id=client_id, topic=topic, last_offset=latest.get(topic.pk) or 0
+                    )
+                    for topic in new_topics
+                ], ignore_conflicts=True)
+        rows = {
+            topic_id: (pk, last_offset)
+            for topic_id, pk, last_offset in DurableSubscription.objects.filter(
+                client_id=client_id, topic__in=topics
+            ).values_list('topic_id', 'pk', 'last_offset')
+        }
+        return {topic.name: rows[topic.pk] for topic in topics if topic.pk in rows}
+
+    @database_sync_to_async
+    def load(self, client_id):
+        """Get a client's durable subscriptions as {topic_name: (durable_subscription_id, last_offset)}"""
+        rows = DurableSubscription.objects.filter(client_id=client_id).values_list(
+            'topic__name', 'pk', 'last_offset'
+        )
+        return {topic_name: (pk, last_offset) for topic_name, pk, last_offset in rows}
+
+    @database_sync_to_async
+    def fetch_gaps(self, topics, offsets, limit):
+        """
+        Get every topic's messages after its offset with one query (a range
+        scan per topic on the (topic, sequence) index), at most limit per topic.
+        topics is {topic_name: Topic}, offsets {topic_name: last offset}.
+        Returns {topic_name: ([(message_id, data, published_at, sequence)], truncated)}.
+        """
+        ranges = Q()
+        for topic_name, topic in topics.items():
+            ranges |= Q(topic=topic, sequence__gt=offsets[topic_name])
+        names = {topic.pk: topic_name for topic_name, topic in topics.items()}
+        gaps = {topic_name: ([], False) for topic_name in topics}
+        if not topics:
+            return gaps
+        rows = (
+            Message.objects.filter(ranges)
+            .annotate(rank=Window(RowNumber(), partition_by=[F('topic_id')], order_by=F('sequence').asc()))
+            .filter(rank__lte=limit + 1)
+            .order_by('topic_id', 'sequence')
+            .values_list('topic_id', 'id', 'data', 'published_at', 'sequence', 'rank')
+        )
+        for topic_id, message_id, data, published_at, sequence, rank in rows.iterator(chunk_size=2000):
+            entries, _ = gaps[names[topic_id]]
+            if rank > limit:
+                gaps[names[topic_id]] = (entries, True)
+                continue
+            entries.append((str(message_id), data, published_at, sequence))
+        return gaps
+
+    @database_sync_to_async
+    def drop(self, client_id, topic_names):
+        """Delete a client's durable subscriptions to topics (explicit unsubscribe)"""
+        DurableSubscription.objects.filter(client_id=client_id, topic__name__in=topic_names).delete()
+
+    def get_stats(self):
+        """Get durable offset tracker statistics"""
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending_offsets": pending,
+            "offsets_written": self.offsets_written,
+            "flushes": self.flushes,
+            "interval": self.interval,
+        }
+
+
+durable_subscriptions = DurableSubscriptions()
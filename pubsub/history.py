@@ -0,0 +1,200 @@
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .models import Message
+
+# Rough per-entry overhead (tuple, strings, datetime) added to the payload size
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class TopicBuffer:
+    """Bounded ring buffer of a topic's most recent messages, oldest first"""
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = deque()  # (message_id, data, published_at, sequence)
+        self.bytes = 0
+        # True when the buffer holds the topic's entire history, so replay
+        # never needs the database
+        self.complete = False
+        self.load_lock = None
+
+    def newest(self, n):
+        """Get up to n entries, newest first"""
+        count = min(n, len(self.entries))
+        return [self.entries[-1 - i] for i in range(count)]
+
+    def since(self, from_offset):
+        """Get entries at or after an offset, oldest first; None if the buffer doesn't reach back that far"""
+        if not self.complete and (not self.entries or (self.entries[0][3] or 0) > from_offset):
+            return None
+        return [entry for entry in self.entries if entry[3] is not None and entry[3] >= from_offset]
+
+
+class TopicHistory:
+    """
+    In-memory per-topic ring buffers of recent messages for last_n replay.
+    Each topic keeps up to its configured number of messages, and all buffers
+    together stay under a global byte cap (the least recently published
+    topics give up entries first). Replay is served from the buffer; only
+    history older than the buffer holds is read from the database, and
+    concurrent replays of a cold topic share a single load.
+    """
+
+    def __init__(self, default_size=None, topic_sizes=None, max_bytes=None):
+        self.default_size = default_size or getattr(settings, 'PUBSUB_HISTORY_SIZE', 100)
+        self.topic_sizes = topic_sizes or getattr(settings, 'PUBSUB_HISTORY_TOPIC_SIZES', {})
+        self.max_bytes = max_bytes or getattr(settings, 'PUBSUB_HISTORY_MAX_BYTES', 64 * 1024 * 1024)
+        self._lock = threading.Lock()  # views discard buffers from sync threads
+        self._buffers = OrderedDict()  # {topic_name: TopicBuffer}, least recently published first
+        self.total_bytes = 0
+        self.buffer_hits = 0
+        self.db_loads = 0
+
+    def _get_buffer(self, topic_name):
+        """Get or create a topic's buffer (caller holds the lock)"""
+        buffer = self._buffers.get(topic_name)
+        if buffer is None:
+            buffer = TopicBuffer(self.topic_sizes.get(topic_name, self.default_size))
+            self._buffers[topic_name] = buffer
+        return buffer
+
+    def _entry_bytes(self, entry):
+        return len(entry[1]) + ENTRY_OVERHEAD_BYTES
+
+    def _enforce_cap(self):
+        """Evict oldest entries of the least recently published topics (caller holds the lock)"""
+        while self.total_bytes > self.max_bytes and self._buffers:
+            topic_name, buffer = next(iter(self._buffers.items()))
+            if buffer.entries:
+                entry = buffer.entries.popleft()
+                size = self._entry_bytes(entry)
+                buffer.bytes -= size
+                self.total_bytes -= size
+                buffer.complete = False
+            if not buffer.entries:
+                del self._buffers[topic_name]
+
+    def append(self, topic_name, message_id, data, published_at, sequence=None):
+        """Record a newly published message"""
+        entry = (message_id, data, published_at, sequence)
+        size = self._entry_bytes(entry)
+        with self._lock:
+            buffer = self._get_buffer(topic_name)
+            self._buffers.move_to_end(topic_name)
+            if len(buffer.entries) >= buffer.size:
+                evicted = buffer.entries.popleft()
+                evicted_size = self._entry_bytes(evicted)
+                buffer.bytes -= evicted_size
+                self.total_bytes -= evicted_size
+                buffer.complete = False
+            buffer.entries.append(entry)
+            buffer.bytes += size
+            self.total_bytes += size
+            self._enforce_cap()
+
+    def discard(self, topic_name):
+        """Drop a deleted topic's buffer"""
+        with self._lock:
+            buffer = self._buffers.pop(topic_name, None)
+            if buffer is not None:
+                self.total_bytes -= buffer.bytes
+
+    def get_since(self, topic_name, from_offset):
+        """
+        Get a topic's buffered messages at or after from_offset, oldest first.
+        Returns None when older messages are needed from the database.
+        """
+        with self._lock:
+            buffer = self._buffers.get(topic_name)
+            entries = buffer.since(from_offset) if buffer is not None else None
+            if entries is not None:
+                self.buffer_hits += 1
+            return entries
+
+    async def get_recent(self, topic, last_n):
+        """Get the last_n messages of a topic as (message_id, data, published_at, sequence), newest first"""
+        with self._lock:
+            buffer = self._get_buffer(topic.name)
+            if len(buffer.entries) >= last_n or buffer.complete:
+                self.buffer_hits += 1
+                return buffer.newest(last_n)
+            if buffer.load_lock is None:
+                buffer.load_lock = asyncio.Lock()
+
+        # Only one replay per topic reads the database; the rest wait and hit the buffer
+        async with buffer.load_lock:
+            with self._lock:
+                if len(buffer.entries) >= last_n or buffer.complete:
+                    self.buffer_hits += 1
+                    return buffer.newest(last_n)
+                entries = buffer.newest(len(buffer.entries))
+
+            # Read enough to satisfy this replay and to fill the buffer
+            limit = max(last_n - len(entries), buffer.size - len(entries))
+            older = await self._load_older(topic, entries, limit)
+            self.db_loads += 1
+
+            with self._lock:
+                self._prepend_older(
+                    topic.name, buffer, entries[-1] if entries else None, older,
+                    exhausted=len(older) < limit
+                )
+            return (entries + older)[:last_n]
+
+    def _prepend_older(self, topic_name, buffer, oldest, older, exhausted):
+        """Add entries older than the buffer's oldest to its front while there is room"""
+        if self._buffers.get(topic_name) is not buffer:
+            return  # discarded (topic deleted) while loading
+        if oldest is not None and (not buffer.entries or buffer.entries[0] is not oldest):
+            return  # entries were evicted while loading; prepending would leave a gap
+        # A cold buffer may have received (and flushed) new messages during the load
+        buffered_ids = {entry[0] for entry in buffer.entries} if oldest is None else ()
+        older = [entry for entry in older if entry[0] not in buffered_ids]
+        added = 0
+        for entry in older:
+            if len(buffer.entries) >= buffer.size:
+                break
+            buffer.entries.appendleft(entry)
+            size = self._entry_bytes(entry)
+            buffer.bytes += size
+            self.total_bytes += size
+            added += 1
+        if exhausted and added == len(older):
+            buffer.complete = True
+        self._enforce_cap()
+
+    @database_sync_to_async
+    def _load_older(self, topic, entries, limit):
+        """Read up to limit messages older than the buffered entries, newest first"""
+        messages = Message.objects.filter(topic=topic)
+        if entries:
+            # <= plus exclude, so messages sharing the boundary timestamp aren't skipped
+            boundary = entries[-1][2]
+            messages = messages.filter(published_at__lte=boundary).exclude(
+                id__in=[entry[0] for entry in entries if entry[2] == boundary]
+            )
+        rows = messages.order_by('-published_at').values_list('id', 'data', 'published_at', 'sequence')[:limit]
+        return [
+            (str(message_id), data, published_at, sequence)
+            for message_id, data, published_at, sequence in rows.iterator(chunk_size=2000)
+        ]
+
+    def get_stats(self):
+        """Get ring buffer statistics"""
+        with self._lock:
+            topics = len(self._buffers)
+            entries = sum(len(b.entries) for b in self._buffers.values())
+        return {
+            "topics": topics,
+            "messages": entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "buffer_hits": self.buffer_hits,
+            "db_loads": self.db_loads,
+        }
+
+
+topic_history = TopicHistory()
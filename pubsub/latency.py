@@ -0,0 +1,182 @@
+import time
+from django.conf import settings
+
+# Stages of a publish, in order. Each of parse..fanout_start is the time since
+# the previous one; send is per subscriber, from fan-out start to the socket
+# write; total runs from receiving the publish to the last subscriber's send.
+STAGES = ('parse', 'lookup', 'persist', 'ack', 'fanout_start', 'send', 'total')
+
+# Log-linear buckets: values below 2 * SUB_BUCKETS microseconds are exact, above
+# that each power of two is split into SUB_BUCKETS buckets, so recorded values
+# are reported within 1 / SUB_BUCKETS (~1.6%) of their true value
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_index(value):
+    """Bucket of a non-negative integer value"""
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1
+    return shift * SUB_BUCKETS + (value >> shift)
+
+
+def bucket_upper_bound(index):
+    """Highest value that falls into a bucket"""
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    mantissa = index - shift * SUB_BUCKETS
+    return ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of durations, kept in microseconds.
+    Recording is one dict increment; only the buckets actually hit are stored.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = {}  # {bucket index: count}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = max(int(seconds * 1000000), 0)
+        index = bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Get the value (microseconds) at or below which percent of recorded values fall"""
+        if not self.count:
+            return None
+        target = max(int(self.count * percent / 100.0 + 0.5), 1)
+        seen = 0
+        for index in sorted(dict(self.counts)):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(bucket_upper_bound(index), self.max)
+        return self.max
+
+    def summary(self):
+        """Get count, mean, p50/p99/p999 and max in milliseconds"""
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count / 1000, 3),
+            "p50_ms": self.percentile(50) / 1000,
+            "p99_ms": self.percentile(99) / 1000,
+            "p999_ms": self.percentile(99.9) / 1000,
+            "max_ms": self.max / 1000,
+        }
+
+
+class PublishTrace:
+    """
+    Timing of one publish (or of one topic's messages in a publish_batch)
+    through the publish path.
+    Travels with the shared Frames into every subscriber's outbound queue;
+    the writers report back when a frame reaches the socket or is dropped.
+    Each frame is held while it is being fanned out and each queued copy
+    until it is sent, so total is recorded once, after the last of them.
+    """
+
+    __slots__ = ('recorder', 'topic', 'started', 'last', 'stages', 'fanout_at', 'pending')
+
+    def __init__(self, recorder, topic, started):
+        self.recorder = recorder
+        self.topic = topic
+        self.started = started
+        self.last = started
+        self.stages = {}  # {stage: seconds}
+        self.fanout_at = None
+        self.pending = 0  # frames and subscriber copies not yet sent or dropped
+
+    def mark(self, stage):
+        """Record the time since the previous stage as stage"""
+        now = time.perf_counter()
+        seconds = self.stages[stage] = now - self.last
+        self.last = now
+        self.recorder.record(self.topic, stage, seconds)
+        return now
+
+    def start_fanout(self, frame=None):
+        """Mark fan-out start (once); in debug mode also write the breakdown into the (not yet encoded) frame"""
+        if self.fanout_at is None:
+            self.fanout_at = self.mark('fanout_start')
+        if frame is not None and self.recorder.debug:
+            timings = {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+            frame.data['server_timings_ms'] = timings
+            if frame.json_data is not None:
+                frame.json_data['server_timings_ms'] = timings
+
+    def hold(self):
+        """Keep the trace open for one more frame or subscriber copy"""
+        self.pending += 1
+
+    def release(self):
+        """A held frame or copy is done; records total after the last one of a started fan-out"""
+        self.pending -= 1
+        if self.pending == 0 and self.fanout_at is not None:
+            self.recorder.record(self.topic, 'total', time.perf_counter() - self.started)
+
+    def sent(self, delivered=True):
+        """A subscriber's copy was written to its socket (or dropped, when not delivered)"""
+        if delivered and self.fanout_at is not None:
+            self.recorder.record(self.topic, 'send', time.perf_counter() - self.fanout_at)
+        self.release()
+
+
+class LatencyRecorder:
+    """
+    Per-topic, per-stage publish latency histograms.
+    Recorded on the worker's event loop only, so without locks; views read
+    summaries from copies.
+    """
+
+    def __init__(self, enabled=None, debug=None):
+        self.enabled = getattr(settings, 'PUBSUB_LATENCY_TRACKING', True) if enabled is None else enabled
+        self.debug = getattr(settings, 'PUBSUB_LATENCY_DEBUG', False) if debug is None else debug
+        self._topics = {}  # {topic_name: {stage: LatencyHistogram}}
+
+    def start(self, topic_name, started=None):
+        """Start tracing a publish received at started (perf_counter); None when tracking is off"""
+        if not self.enabled:
+            return None
+        return PublishTrace(self, topic_name, started or time.perf_counter())
+
+    def record(self, topic_name, stage, seconds):
+        stages = self._topics.get(topic_name)
+        if stages is None:
+            stages = self._topics[topic_name] = {}
+        histogram = stages.get(stage)
+        if histogram is None:
+            histogram = stages[stage] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def discard(self, topic_name):
+        """Drop a deleted topic's histograms"""
+        self._topics.pop(topic_name, None)
+
+    def get_stats(self, topic_name=None):
+        """Get {topic: {stage: summary}}, for one topic or all"""
+        if topic_name is not None:
+            names = [topic_name] if topic_name in self._topics else []
+        else:
+            names = sorted(list(self._topics))
+        stats = {}
+        for name in names:
+            stages = dict(self._topics.get(name, {}))
+            stats[name] = {stage: stages[stage].summary() for stage in STAGES if stage in stages}
+        return stats
+
+
+publish_latency = LatencyRecorder()
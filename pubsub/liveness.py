@@ -0,0 +1,59 @@
+import asyncio
+import logging
+from collections import deque
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """
+    Measures event-loop lag: a task sleeps for a fixed interval and records
+    how much later than requested it woke up. Callbacks that block the loop
+    (sync DB calls, large encodes) show up as lag. Started lazily on the
+    running loop, like the periodic flushers.
+    """
+
+    def __init__(self, interval=None, window=None):
+        self.interval = interval or getattr(settings, 'PUBSUB_LOOP_LAG_INTERVAL', 0.5)
+        self._task = None
+        self._loop = None
+        # Recent samples in seconds; max_lag is taken over these
+        self._samples = deque(maxlen=window or 120)
+        self.samples = 0
+
+    def ensure_started(self):
+        """Start the sampling task on the running loop if it isn't already"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if loop is not self._loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._samples.clear()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        """Sample lag every interval until cancelled"""
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self._samples.append(lag)
+            self.samples += 1
+            if lag > self.interval:
+                logger.warning("Event loop lagged %.0f ms", lag * 1000)
+
+    def get_stats(self):
+        """Get the latest and recent maximum lag in milliseconds (None before the first sample)"""
+        samples = list(self._samples)
+        return {
+            "lag_ms": round(samples[-1] * 1000, 1) if samples else None,
+            "max_lag_ms": round(max(samples) * 1000, 1) if samples else None,
+            "interval": self.interval,
+            "samples": self.samples,
+        }
+
+
+loop_lag_monitor = LoopLagMonitor()
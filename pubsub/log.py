@@ -0,0 +1,66 @@
+import atexit
+import logging
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+# Event tag for records logged without extra={'event': ...}
+DEFAULT_EVENT = '-'
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records of each event type.
+    rates maps an event name to the fraction to keep (1.0 keeps all, 0 drops
+    all). Sampling is deterministic: a rate of 0.01 keeps every 100th record,
+    so bursts are thinned evenly. Events without a rate, and records at
+    WARNING or above, are always kept.
+    """
+
+    def __init__(self, rates=None, name=''):
+        super().__init__(name)
+        self.every = {}  # {event: keep one in N}; 0 drops the event entirely
+        for event_name, rate in (rates or {}).items():
+            self.every[event_name] = round(1 / rate) if rate > 0 else 0
+        self._seen = {}  # {event: records seen}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not hasattr(record, 'event'):
+            record.event = DEFAULT_EVENT
+        every = self.every.get(record.event, 1)
+        if every == 1 or record.levelno >= logging.WARNING:
+            return True
+        if every == 0:
+            return False
+        with self._lock:
+            seen = self._seen.get(record.event, 0)
+            self._seen[record.event] = seen + 1
+        if seen % every:
+            return False
+        record.sample_rate = every  # lets readers scale sampled counts back up
+        return True
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Formats records on the caller's thread and hands them to a bounded queue;
+    a listener thread does the blocking stream writes, so logging never stalls
+    the event loop on stdout/stderr. When the queue is full, records are
+    dropped and counted instead of blocking.
+    """
+
+    def __init__(self, queue_size=10000, stream=None):
+        super().__init__(queue.Queue(maxsize=queue_size))
+        self.dropped = 0
+        target = logging.StreamHandler(stream or sys.stderr)
+        self.listener = QueueListener(self.queue, target)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
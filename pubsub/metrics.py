@@ -0,0 +1,298 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from bisect import bisect_left
+from django.conf import settings
+from .periodic import PeriodicFlusher
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; handler latencies are mostly sub-millisecond to tens of milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class Metric:
+    """
+    Base class for metrics. Values are kept per tuple of label values in a
+    plain dict. Updates only happen on the worker's event loop thread, so
+    they need no lock; readers in other threads (views) take a copy.
+    """
+
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}  # {label values: value}
+
+    def collect(self):
+        """Get a copy of the current values as {label values: value}"""
+        return dict(self._values)
+
+    def describe(self):
+        """Get the metric's metadata for snapshots"""
+        return {"type": self.type, "help": self.documentation, "labelnames": list(self.labelnames)}
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        """Add amount to the count for the given label values"""
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """Value that goes up and down; optionally read from a function at collect time"""
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set_function(self, function):
+        """Read the gauge from function() -> {label values: value} instead of stored values"""
+        self._function = function
+
+    def set(self, *labels, value):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        values = self._values
+        values[labels] = values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def collect(self):
+        if self._function is not None:
+            return self._function()
+        return dict(self._values)
+
+
+class Histogram(Metric):
+    """
+    Distribution over fixed buckets. Each label set holds one count per
+    bucket (the last one is +Inf) followed by the sum of observed values.
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        """Record one observation for the given label values"""
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def collect(self):
+        return {labels: list(state) for labels, state in list(self._values.items())}
+
+    def describe(self):
+        description = super().describe()
+        description["buckets"] = list(self.buckets)
+        return description
+
+
+class MetricsRegistry:
+    """The metrics of one worker process"""
+
+    def __init__(self):
+        self._metrics = {}  # {name: Metric}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        """
+        Get every metric as JSON-serializable data:
+        {name: {type, help, labelnames, [buckets], samples: [[label values, value], ...]}}
+        """
+        snapshot = {}
+        for name, metric in list(self._metrics.items()):
+            entry = metric.describe()
+            entry["samples"] = [[list(labels), value] for labels, value in metric.collect().items()]
+            snapshot[name] = entry
+        return snapshot
+
+
+def merge(snapshots):
+    """Merge snapshots from several workers; samples with the same labels are summed"""
+    merged = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(entry, samples={})
+            elif target.get("buckets") != entry.get("buckets"):
+                logger.warning("Skipping %s from a worker with different buckets", name)
+                continue
+            samples = target["samples"]
+            for labels, value in entry["samples"]:
+                key = tuple(labels)
+                current = samples.get(key)
+                if current is None:
+                    samples[key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    samples[key] = [a + b for a, b in zip(current, value)]
+                else:
+                    samples[key] = current + value
+    for entry in merged.values():
+        entry["samples"] = [[list(labels), value] for labels, value in entry["samples"].items()]
+    return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels_text(labelnames, labels, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def render(snapshot):
+    """Render a snapshot in the Prometheus text exposition format"""
+    lines = []
+    for name in sorted(snapshot):
+        entry = snapshot[name]
+        labelnames = entry["labelnames"]
+        lines.append(f'# HELP {name} {_escape(entry["help"])}')
+        lines.append(f'# TYPE {name} {entry["type"]}')
+        for labels, value in sorted(entry["samples"], key=lambda sample: sample[0]):
+            if entry["type"] != 'histogram':
+                lines.append(f'{name}{_labels_text(labelnames, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            bounds = [_number(bound) for bound in entry["buckets"]] + ['+Inf']
+            for bound, count in zip(bounds, value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels_text(labelnames, labels, ("le", bound))} {cumulative}')
+            lines.append(f'{name}_sum{_labels_text(labelnames, labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels_text(labelnames, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter(PeriodicFlusher):
+    """
+    Shares this worker's metrics with the other workers on the host.
+    When PUBSUB_METRICS_DIR is set, every interval the worker writes its
+    snapshot to a file of its own there; a scrape of any worker merges its
+    live metrics with the other workers' files. Files not updated within
+    PUBSUB_METRICS_STALE_AFTER seconds (workers that exited) are ignored.
+    """
+
+    def __init__(self, registry, directory=None, interval=None, stale_after=None):
+        super().__init__(interval or getattr(settings, 'PUBSUB_METRICS_EXPORT_INTERVAL', 5.0))
+        self.registry = registry
+        self.directory = directory or getattr(settings, 'PUBSUB_METRICS_DIR', None)
+        self.stale_after = stale_after or getattr(settings, 'PUBSUB_METRICS_STALE_AFTER', 60.0)
+        self.filename = f"{socket.gethostname()}-{os.getpid()}.json"
+
+    def ensure_started(self):
+        if self.directory:
+            super().ensure_started()
+
+    async def flush(self):
+        """Write this worker's snapshot (taken on the loop, written off it)"""
+        snapshot = self.registry.snapshot()
+        await asyncio.get_running_loop().run_in_executor(None, self._write, snapshot)
+        return True
+
+    def _write(self, snapshot):
+        """Replace this worker's file atomically so readers never see a partial write"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.filename)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(path + '.tmp', path)
+
+    def _read_others(self):
+        """Read the snapshots other live workers wrote"""
+        snapshots = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return snapshots
+        now = time.time()
+        for name in names:
+            if not name.endswith('.json') or name == self.filename:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if now - os.path.getmtime(path) > self.stale_after:
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning("Skipping metrics file %s: %s", name, e)
+        return snapshots
+
+    def collect(self):
+        """Get this worker's live snapshot merged with the other workers' files"""
+        snapshot = self.registry.snapshot()
+        if not self.directory:
+            return snapshot
+        return merge([snapshot] + self._read_others())
+
+
+registry = MetricsRegistry()
+
+messages_published = registry.counter(
+    'pubsub_messages_published_total', 'Messages published', ('topic',))
+messages_delivered = registry.counter(
+    'pubsub_messages_delivered_total', 'Frames queued for local subscribers', ('topic',))
+connections_opened = registry.counter(
+    'pubsub_connections_opened_total', 'WebSocket connections accepted')
+active_connections = registry.gauge(
+    'pubsub_active_connections', 'Open WebSocket connections')
+subscriptions = registry.gauge(
+    'pubsub_subscriptions', 'Active subscriptions held by open connections', ('kind',))
+send_failures = registry.counter(
+    'pubsub_send_failures_total', 'Frames not delivered to a subscriber', ('reason',))
+db_flush_batch_size = registry.histogram(
+    'pubsub_db_flush_batch_size', 'Messages written per database flush', buckets=BATCH_SIZE_BUCKETS)
+db_flush_failures = registry.counter(
+    'pubsub_db_flush_failures_total', 'Message flushes that failed')
+handler_seconds = registry.histogram(
+    'pubsub_handler_seconds', 'Time to handle an inbound WebSocket message', ('type',))
+
+metrics_exporter = MetricsExporter(registry)
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.7 on 2026-10-15 10:53
+
+from django.db import migrations, models
+
+
+def number_existing_messages(apps, schema_editor):
+    """Give existing messages sequence numbers in publish order, per topic"""
+    Topic = apps.get_model('pubsub', 'Topic')
+    Message = apps.get_model('pubsub', 'Message')
+    for topic in Topic.objects.all().iterator():
+        sequence = 0
+        batch = []
+        rows = Message.objects.filter(topic=topic).order_by('published_at', 'id').only('id')
+        for message in rows.iterator(chunk_size=2000):
+            sequence += 1
+            message.sequence = sequence
+            batch.append(message)
+            if len(batch) >= 2000:
+                Message.objects.bulk_update(batch, ['sequence'])
+                batch = []
+        if batch:
+            Message.objects.bulk_update(batch, ['sequence'])
+        Topic.objects.filter(pk=topic.pk).update(last_sequence=sequence)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pubsub', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='sequence',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='last_sequence',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['topic', 'sequence'], name='pubsub_mess_topic_i_21a11c_idx'),
+        ),
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-15 10:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pubsub', '0002_message_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DurableSubscription',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('client_id', models.CharField(db_index=True, max_length=255)),
+                ('last_offset', models.BigIntegerField(default=0)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='durable_subscriptions', to='pubsub.topic')),
+            ],
+            options={
+                'db_table': 'pubsub_durable_subscriptions',
+                'ordering': ['client_id'],
+                'unique_together': {('client_id', 'topic')},
+            },
+        ),
+    ]
@@ -14,6 +14,8 @@ class Topic(models.Model):
     last_published = models.DateTimeField(null=True, blank=True)
     message_count = models.PositiveIntegerField(default=0)
     subscriber_count = models.PositiveIntegerField(default=0)
+    # Highest message sequence number leased so far (see pubsub.sequences)
+    last_sequence = models.BigIntegerField(default=0)
     is_active = models.BooleanField(default=True)
     metadata = models.JSONField(default=dict, blank=True)
     
@@ -23,21 +25,6 @@ class Topic(models.Model):
     
     def __str__(self):
         return f"Topic: {self.name}"
-    
-    def update_last_published(self):
-        """Update the last published timestamp"""
-        self.last_published = timezone.now()
-        self.save(update_fields=['last_published'])
-    
-    def increment_message_count(self):
-        """Increment the message count"""
-        self.message_count += 1
-        self.save(update_fields=['message_count'])
-    
-    def update_subscriber_count(self, count):
-        """Update the subscriber count"""
-        self.subscriber_count = count
-        self.save(update_fields=['subscriber_count'])
 
 
 class Connection(models.Model):
@@ -98,6 +85,32 @@ class TopicSubscription(models.Model):
         return f"{self.connection.id} -> {self.topic.name}"
 
 
+class DurableSubscription(models.Model):
+    """
+    A subscription that outlives its connection.
+    Keyed by the client's own client_id, it remembers the offset of the last
+    message delivered on the topic, so a reconnecting client can resume and
+    receive only what it missed.
+    """
+    client_id = models.CharField(max_length=255, db_index=True)
+    topic = models.ForeignKey(
+        Topic, 
+        on_delete=models.CASCADE, 
+        related_name='durable_subscriptions'
+    )
+    last_offset = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'pubsub_durable_subscriptions'
+        unique_together = ['client_id', 'topic']
+        ordering = ['client_id']
+    
+    def __str__(self):
+        return f"{self.client_id} -> {self.topic.name} @ {self.last_offset}"
+
+
 class Message(models.Model):
     """
     Model representing a message published to a topic.
@@ -116,6 +129,8 @@ class Message(models.Model):
         related_name='published_messages'
     )
     data = models.TextField()
+    # Per-topic monotonic offset; null only for rows written before offsets existed
+    sequence = models.BigIntegerField(null=True, blank=True)
     published_at = models.DateTimeField(default=timezone.now)
     delivery_attempts = models.PositiveIntegerField(default=0)
     max_delivery_attempts = models.PositiveIntegerField(default=3)
@@ -126,6 +141,7 @@ class Message(models.Model):
         ordering = ['-published_at']
         indexes = [
             models.Index(fields=['topic', 'published_at']),
+            models.Index(fields=['topic', 'sequence']),
             models.Index(fields=['publisher_connection', 'published_at']),
         ]
     
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+from collections import deque
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Overflow policies for a full outbound queue
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+DISCONNECT = 'disconnect'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, DISCONNECT)
+
+# WebSocket close code sent to a consumer disconnected for falling behind
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+class OutboundQueue:
+    """
+    Bounded outbound frame queue for a single WebSocket connection.
+    Fan-out only appends to the queue; a writer task owned by the connection
+    drains it into the socket. When the queue is full the overflow policy
+    decides whether to drop the oldest frame, drop the new frame, or
+    disconnect the slow consumer.
+    A frame can carry a receipt; once the frame has been written to the
+    socket, the receipt is passed to on_sent. A frame's publish trace, if
+    any, is told when it was sent or dropped.
+    """
+
+    # Totals across all connections in this process
+    totals = {
+        'frames_queued': 0,
+        'frames_sent': 0,
+        'frames_dropped': 0,
+        'slow_consumers_disconnected': 0,
+    }
+
+    def __init__(self, consumer, max_size=None, policy=None):
+        self.consumer = consumer
+        self.max_size = max_size or getattr(settings, 'PUBSUB_OUTBOUND_QUEUE_SIZE', 1000)
+        self.policy = policy or getattr(settings, 'PUBSUB_OUTBOUND_OVERFLOW_POLICY', DROP_OLDEST)
+        if self.policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown outbound overflow policy: {self.policy}")
+        self._frames = deque()  # (encoded frame, receipt or None, trace or None)
+        self.on_sent = None
+        self._ready = None
+        self._room = None  # set whenever a frame leaves the queue
+        self._task = None
+        self._loop = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        """Number of frames waiting to be written"""
+        return len(self._frames)
+
+    def start(self):
+        """Start the writer task on the running event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._room = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    def put(self, frame, receipt=None, trace=None):
+        """
+        Queue an encoded frame without waiting on the socket.
+        Safe to call from another thread. Returns False if the frame was dropped.
+        """
+        if self.closed or self._loop is None:
+            return False
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is not self._loop:
+            self._loop.call_soon_threadsafe(self._put_later, frame, receipt, trace)
+            return True
+
+        if len(self._frames) >= self.max_size:
+            self.dropped += 1
+            self.totals['frames_dropped'] += 1
+            metrics.send_failures.inc(self.policy)
+            if self.policy == DROP_NEWEST:
+                return False
+            if self.policy == DISCONNECT:
+                self.totals['slow_consumers_disconnected'] += 1
+                logger.warning("Disconnecting slow consumer: %s", self.consumer.connection_id,
+                               extra={'event': 'outbound.slow_consumer'})
+                self.close()
+                asyncio.create_task(self.consumer.close(code=SLOW_CONSUMER_CLOSE_CODE))
+                return False
+            # DROP_OLDEST
+            _, _, dropped_trace = self._frames.popleft()
+            if dropped_trace is not None:
+                dropped_trace.sent(delivered=False)
+
+        self._frames.append((frame, receipt, trace))
+        self.totals['frames_queued'] += 1
+        if len(self._frames) > self.max_depth:
+            self.max_depth = len(self._frames)
+        self._ready.set()
+        return True
+
+    def _put_later(self, frame, receipt, trace):
+        """put() handed over from another thread, whose caller already counted the frame as queued"""
+        if not self.put(frame, receipt, trace) and trace is not None:
+            trace.sent(delivered=False)
+
+    async def _writer(self):
+        """Drain queued frames into the socket, one at a time"""
+        while not self.closed:
+            if not self._frames:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame, receipt, trace = self._frames.popleft()
+            self._room.set()
+            try:
+                # Binary codecs (MessagePack) produce bytes, JSON codecs text
+                if isinstance(frame, bytes):
+                    await self.consumer.send(bytes_data=frame)
+                else:
+                    await self.consumer.send(text_data=frame)
+                self.sent += 1
+                self.totals['frames_sent'] += 1
+                if receipt is not None and self.on_sent is not None:
+                    self.on_sent(receipt)
+                if trace is not None:
+                    trace.sent()
+            except Exception as e:
+                logger.warning("Failed to write to connection %s: %s", self.consumer.connection_id, e)
+                metrics.send_failures.inc('socket_error', amount=1 + len(self._frames))
+                if trace is not None:
+                    trace.sent(delivered=False)
+                self.close()
+
+    async def wait_below(self, depth):
+        """Wait until at most depth frames are queued (or the queue is closed)"""
+        while not self.closed and len(self._frames) > depth:
+            self._room.clear()
+            await self._room.wait()
+
+    def close(self):
+        """Stop the writer and discard any queued frames"""
+        self.closed = True
+        frames, self._frames = self._frames, deque()
+        for _, _, trace in frames:
+            if trace is not None:
+                trace.sent(delivered=False)
+        if self._room is not None:
+            self._room.set()  # release replays waiting for room
+        if self._task and self._task is not asyncio.current_task():
+            self._task.cancel()
+
+    def get_stats(self):
+        """Get statistics for this connection's queue"""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "policy": self.policy,
+        }
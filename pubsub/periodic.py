@@ -0,0 +1,43 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicFlusher:
+    """
+    Base class for in-memory aggregators that are written to the database
+    on a fixed interval. Subclasses implement flush(); the flush task is
+    started lazily on the running event loop the first time it is needed.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._task = None
+        self._loop = None
+        self.flushes = 0
+
+    def ensure_started(self):
+        """Start the periodic flush task on the running loop if it isn't already"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Called from a sync thread (e.g. a view); the loop side starts it
+            return
+        if loop is not self._loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        """Flush every interval until cancelled"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if await self.flush():
+                    self.flushes += 1
+            except Exception as e:
+                logger.error("Error in periodic flush of %s: %s", type(self).__name__, e)
+
+    async def flush(self):
+        """Write aggregated state to the database; returns True if anything was written"""
+        raise NotImplementedError
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from . import metrics
+from .cache import topic_cache
+from .counters import topic_counters
+from .models import Topic, Connection, Message
+
+logger = logging.getLogger(__name__)
+
+# Publish acknowledgement modes
+ACK_ON_ENQUEUE = 'enqueue'
+ACK_ON_FLUSH = 'flush'
+
+
+def get_ack_mode():
+    """Get the configured publish acknowledgement mode"""
+    return getattr(settings, 'PUBSUB_PUBLISH_ACK_MODE', ACK_ON_FLUSH)
+
+
+class MessageWriter:
+    """
+    Write-behind buffer for published messages.
+    Publishes are appended in memory and written with one bulk_create every
+    batch_size messages or every flush_interval_ms, whichever comes first.
+    Flushes run one at a time, so messages reach the database in publish order.
+    Topic message counters are handed to the counter aggregator once written.
+    """
+
+    def __init__(self, batch_size=None, flush_interval_ms=None):
+        self.batch_size = batch_size or getattr(settings, 'PUBSUB_PERSIST_BATCH_SIZE', 500)
+        self.flush_interval_ms = (
+            flush_interval_ms or getattr(settings, 'PUBSUB_PERSIST_FLUSH_INTERVAL_MS', 50)
+        )
+        self._pending = []  # [(message, future or None)]
+        self._timer = None
+        self._lock = None
+        self._loop = None
+        self.messages_written = 0
+        self.flushes = 0
+        self.last_batch_size = 0
+
+    def _bind_loop(self):
+        """Reset per-loop state when used from a new event loop"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lock = asyncio.Lock()
+            self._timer = None
+
+    def append(self, message, wait=False):
+        """
+        Buffer an unsaved Message for the next flush.
+        With wait=True returns a future that resolves once the message is
+        durably written; otherwise returns None.
+        """
+        return self.append_many([message], wait=wait)
+
+    def append_many(self, messages, wait=False):
+        """
+        Buffer several unsaved Messages so they go out in the same bulk_create.
+        With wait=True returns one future for the whole group; it resolves to
+        True once written, or False if any message was dropped because its
+        topic was deleted meanwhile.
+        """
+        self._bind_loop()
+        future = self._loop.create_future() if wait else None
+        # Flushes take the whole buffer, so the group is always written together
+        self._pending.extend((message, future) for message in messages)
+
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(
+                self.flush_interval_ms / 1000, self._schedule_flush
+            )
+        return future
+
+    def _schedule_flush(self):
+        """Start a flush task without waiting for it"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Write every buffered message now"""
+        self._bind_loop()
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            try:
+                written = await self._write([message for message, _ in batch])
+            except Exception as e:
+                logger.error("Error flushing %d messages: %s", len(batch), e)
+                metrics.db_flush_failures.inc()
+                for _, future in batch:
+                    if future is not None and not future.done():
+                        future.set_exception(e)
+                return
+
+            self.record_counters(written)
+            self.flushes += 1
+            self.last_batch_size = len(batch)
+            metrics.db_flush_batch_size.observe(value=len(batch))
+            self.messages_written += len(written)
+            if len(written) < len(batch):
+                logger.warning("Dropped %d messages for deleted topics", len(batch) - len(written))
+            written_ids = {message.id for message in written}
+            results = {}  # {future: every message of its group was written}
+            for message, future in batch:
+                if future is not None:
+                    results[future] = results.get(future, True) and message.id in written_ids
+            for future, result in results.items():
+                if not future.done():
+                    future.set_result(result)
+
+    def detach_publisher(self, connection_id):
+        """Clear the publisher of buffered messages from a connection that is going away"""
+        connection_id = str(connection_id)
+        for message, _ in self._pending:
+            if str(message.publisher_connection_id) == connection_id:
+                message.publisher_connection = None
+
+    def record_counters(self, messages):
+        """Hand per-topic counts of written messages to the counter aggregator"""
+        topic_updates = {}  # {topic_id: [count, last_published]}
+        for message in messages:
+            entry = topic_updates.setdefault(message.topic_id, [0, message.published_at])
+            entry[0] += 1
+            entry[1] = max(entry[1], message.published_at)
+        for topic_id, (count, last_published) in topic_updates.items():
+            topic_counters.record_messages(topic_id, count, last_published)
+
+    @database_sync_to_async
+    def _write(self, messages):
+        """Bulk insert a batch of messages; returns the messages actually written"""
+        try:
+            self._insert(messages)
+        except IntegrityError:
+            # A topic or publisher connection was deleted while its messages
+            # were buffered; drop or detach those rows and retry once
+            messages = self._without_dangling_references(messages)
+            self._insert(messages)
+        return messages
+
+    def _insert(self, messages):
+        """Insert a batch of messages in one transaction"""
+        with transaction.atomic():
+            Message.objects.bulk_create(messages)
+
+    def _without_dangling_references(self, messages):
+        """
+        Filter out messages whose topic is gone and detach missing publishers.
+        A topic that is gone is also dropped from the topic cache, in case its
+        deletion didn't go through this worker.
+        """
+        topic_ids = set(Topic.objects.filter(
+            pk__in={m.topic_id for m in messages}
+        ).values_list('pk', flat=True))
+        connection_ids = set(Connection.objects.filter(
+            pk__in={m.publisher_connection_id for m in messages if m.publisher_connection_id}
+        ).values_list('pk', flat=True))
+
+        kept = []
+        for message in messages:
+            if message.topic_id not in topic_ids:
+                topic_cache.invalidate(message.topic.name)
+                continue
+            if message.publisher_connection_id not in connection_ids:
+                message.publisher_connection = None
+            kept.append(message)
+        return kept
+
+    def get_stats(self):
+        """Get write-behind statistics"""
+        return {
+            "pending": len(self._pending),
+            "messages_written": self.messages_written,
+            "flushes": self.flushes,
+            "last_batch_size": self.last_batch_size,
+            "ack_mode": get_ack_mode(),
+        }
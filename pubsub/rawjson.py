@@ -0,0 +1,162 @@
+import json
+from json.decoder import WHITESPACE, scanstring
+from json.encoder import encode_basestring_ascii
+
+_decoder = json.JSONDecoder()
+_scan_once = _decoder.scan_once
+_WHITESPACE_CHARS = frozenset(' \t\n\r')
+
+# Members of an incoming frame that are scanned as objects (so their members'
+# source text is kept); every other value is decoded normally.
+# A list means "each element of the array".
+FRAME_SPEC = {
+    'message': {},
+    'messages': [{'message': {}}],
+}
+
+
+class RawJSON(str):
+    """JSON text that encode() splices into its output verbatim"""
+
+
+class RawDict(dict):
+    """A decoded JSON object that remembers the source text of itself and its members"""
+
+    __slots__ = ('_source', '_span', '_spans')
+
+    def text(self):
+        """The object's own JSON text, exactly as received"""
+        return self._source[self._span[0]:self._span[1]]
+
+    def raw(self, key):
+        """A member's JSON text exactly as received, or None if the member is missing"""
+        span = self._spans.get(key)
+        if span is None:
+            return None
+        return RawJSON(self._source[span[0]:span[1]])
+
+
+def raw_text(obj):
+    """An object's source JSON text if it was decoded by loads(), else None"""
+    return obj.text() if isinstance(obj, RawDict) else None
+
+
+def raw_member(obj, key, default=None):
+    """A member's source JSON text if its object was decoded by loads(), else default"""
+    if isinstance(obj, RawDict):
+        raw = obj.raw(key)
+        if raw is not None:
+            return raw
+    return default
+
+
+def _skip(s, idx):
+    """Skip whitespace at idx (compact frames usually have none)"""
+    if s[idx:idx + 1] in _WHITESPACE_CHARS:
+        return WHITESPACE.match(s, idx).end()
+    return idx
+
+
+def _scan_value(s, idx, spec):
+    """Decode the value at idx, descending into objects/arrays the spec names"""
+    if spec is not None:
+        char = s[idx:idx + 1]
+        if char == '{' and isinstance(spec, dict):
+            return _scan_object(s, idx, spec)
+        if char == '[' and isinstance(spec, list):
+            return _scan_array(s, idx, spec[0])
+    try:
+        return _scan_once(s, idx)
+    except StopIteration as err:
+        raise json.JSONDecodeError("Expecting value", s, err.value) from None
+
+
+def _scan_array(s, idx, item_spec):
+    """Decode an array, scanning each element with item_spec"""
+    items = []
+    idx = _skip(s, idx + 1)
+    if s[idx:idx + 1] == ']':
+        return items, idx + 1
+    while True:
+        value, idx = _scan_value(s, idx, item_spec)
+        items.append(value)
+        idx = _skip(s, idx)
+        char = s[idx:idx + 1]
+        if char == ']':
+            return items, idx + 1
+        if char != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", s, idx)
+        idx = _skip(s, idx + 1)
+
+
+def _scan_object(s, start, spec):
+    """Decode an object into a RawDict, recording the source span of every member"""
+    obj = RawDict()
+    spans = {}
+    idx = _skip(s, start + 1)
+    if s[idx:idx + 1] == '}':
+        idx += 1
+    else:
+        while True:
+            if s[idx:idx + 1] != '"':
+                raise json.JSONDecodeError("Expecting property name enclosed in double quotes", s, idx)
+            key, idx = scanstring(s, idx + 1)
+            if s[idx:idx + 1] != ':':
+                idx = _skip(s, idx)
+                if s[idx:idx + 1] != ':':
+                    raise json.JSONDecodeError("Expecting ':' delimiter", s, idx)
+            value_start = idx = _skip(s, idx + 1)
+            obj[key], idx = _scan_value(s, idx, spec.get(key))
+            spans[key] = (value_start, idx)
+            char = s[idx:idx + 1]
+            if char not in '},':
+                idx = _skip(s, idx)
+                char = s[idx:idx + 1]
+            if char == '}':
+                idx += 1
+                break
+            if char != ',':
+                raise json.JSONDecodeError("Expecting ',' delimiter", s, idx)
+            idx = _skip(s, idx + 1)
+    obj._source = s
+    obj._span = (start, idx)
+    obj._spans = spans
+    return obj, idx
+
+
+def loads(s, spec=FRAME_SPEC):
+    """
+    json.loads that keeps source text around.
+    Objects are returned as RawDicts, and so are the members named by spec, so
+    payloads can be stored and forwarded without being encoded again.
+    Non-object documents are decoded normally.
+    """
+    if isinstance(s, (bytes, bytearray)):
+        s = s.decode('utf-8')
+    idx = _skip(s, 0)
+    if s.startswith('{', idx):
+        value, end = _scan_object(s, idx, spec)
+    else:
+        value, end = _decoder.raw_decode(s, idx)
+    if _skip(s, end) != len(s):
+        raise json.JSONDecodeError("Extra data", s, end)
+    return value
+
+
+def dumps(obj):
+    """
+    json.dumps that splices RawJSON values in verbatim.
+    Only the containers around the raw values are walked; output matches
+    json.dumps for everything else.
+    """
+    if isinstance(obj, RawJSON):
+        return str(obj)
+    if isinstance(obj, str):
+        return encode_basestring_ascii(obj)
+    if isinstance(obj, dict):
+        return '{' + ', '.join(
+            encode_basestring_ascii(str(key)) + ': ' + dumps(value) for key, value in obj.items()
+        ) + '}'
+    if isinstance(obj, (list, tuple)):
+        return '[' + ', '.join(dumps(value) for value in obj) + ']'
+    return json.dumps(obj)
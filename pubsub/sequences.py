@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from .control import is_multi_worker
+from .models import Topic
+
+
+class SequenceAllocator:
+    """
+    Hands out per-topic message sequence numbers (offsets).
+    Numbers come from Topic.last_sequence, advanced with one atomic UPDATE.
+    With a single worker they are leased in blocks of block_size and then
+    allocated from memory, so most publishes don't touch the database;
+    numbers left in a block when the worker stops are skipped, so offsets
+    can have gaps. With several workers (channel_layer fan-out) every
+    publish takes its numbers straight from the topic row, so offsets
+    increase in allocation order across all workers.
+    """
+
+    def __init__(self, block_size=None):
+        self.block_size = block_size or getattr(settings, 'PUBSUB_SEQUENCE_BLOCK_SIZE', 100)
+        self._lock = threading.Lock()  # views discard topics from sync threads
+        self._blocks = {}  # {topic_id: [next_sequence, last_leased_sequence]}
+        self._lease_locks = {}  # {topic_id: asyncio.Lock}
+        self._loop = None
+        self.leases = 0
+
+    def _take(self, topic_id, count):
+        """Allocate up to count numbers from the topic's current block"""
+        with self._lock:
+            block = self._blocks.get(topic_id)
+            if block is None:
+                return []
+            taken = list(range(block[0], min(block[0] + count, block[1] + 1)))
+            block[0] += len(taken)
+            return taken
+
+    async def allocate(self, topic, count=1):
+        """Get count sequence numbers for a topic, in increasing order"""
+        if is_multi_worker():
+            # A block held by one worker would let another publish higher
+            # offsets before this one uses it up
+            start, end = await self._lease(topic.pk, count)
+            self.leases += 1
+            return list(range(start, end + 1))
+
+        sequences = self._take(topic.pk, count)
+        if len(sequences) == count:
+            return sequences
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._lease_locks = {}
+        lease_lock = self._lease_locks.get(topic.pk)
+        if lease_lock is None:
+            lease_lock = self._lease_locks[topic.pk] = asyncio.Lock()
+        # One lease per topic at a time; callers queued behind it take from the new block
+        async with lease_lock:
+            while len(sequences) < count:
+                taken = self._take(topic.pk, count - len(sequences))
+                if not taken:
+                    start, end = await self._lease(topic.pk, max(self.block_size, count - len(sequences)))
+                    with self._lock:
+                        self._blocks[topic.pk] = [start, end]
+                    self.leases += 1
+                sequences.extend(taken)
+        return sequences
+
+    @database_sync_to_async
+    def _lease(self, topic_id, size):
+        """Reserve the next size numbers of a topic; returns (first, last)"""
+        with transaction.atomic():
+            Topic.objects.filter(pk=topic_id).update(last_sequence=F('last_sequence') + size)
+            end = Topic.objects.filter(pk=topic_id).values_list('last_sequence', flat=True).get()
+        return end - size + 1, end
+
+    def discard(self, topic_id):
+        """Drop the leased block of a deleted topic"""
+        with self._lock:
+            self._blocks.pop(topic_id, None)
+        self._lease_locks.pop(topic_id, None)
+
+    def get_stats(self):
+        """Get allocator statistics"""
+        with self._lock:
+            topics = len(self._blocks)
+        return {
+            "topics": topics,
+            "leases": self.leases,
+            "block_size": 1 if is_multi_worker() else self.block_size,
+        }
+
+
+sequence_allocator = SequenceAllocator()
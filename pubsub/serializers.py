@@ -78,10 +78,10 @@ class MessageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = [
-            'id', 'topic_name', 'publisher_id', 'data', 'published_at', 
+            'id', 'topic_name', 'sequence', 'publisher_id', 'data', 'published_at', 
             'delivery_attempts', 'max_delivery_attempts', 'metadata'
         ]
-        read_only_fields = ['id', 'published_at', 'delivery_attempts']
+        read_only_fields = ['id', 'sequence', 'published_at', 'delivery_attempts']
 
 
 class MessageCreateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,13 @@
+from functools import partial
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from .cache import invalidate_topic
+from .models import Topic
+
+
+@receiver(post_delete, sender=Topic)
+def topic_deleted(sender, instance, **kwargs):
+    """Drop a deleted topic from every worker's topic cache, however it was deleted (API, admin, ORM)"""
+    # Once committed, so no worker re-caches the row before it is gone
+    transaction.on_commit(partial(invalidate_topic, instance.name))
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import threading
+import time
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class Snapshot:
+    """A pre-encoded JSON response body with its validators"""
+
+    __slots__ = ('data', 'body', 'etag', 'last_modified', 'built_at')
+
+    def __init__(self, data, body, etag, last_modified, built_at):
+        self.data = data  # what build() returned
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified  # epoch seconds the content last changed
+        self.built_at = built_at  # time.monotonic() of the build
+
+
+class SnapshotCache:
+    """
+    Serves polled JSON endpoints from memory.
+    Each named snapshot is rebuilt at most once per interval, by one request
+    at a time; requests arriving during a rebuild get the previous snapshot.
+    The ETag is a hash of the body, so a rebuild that produces the same
+    content keeps its ETag and Last-Modified, and pollers keep getting 304s.
+    """
+
+    def __init__(self, interval=None, setting='PUBSUB_STATS_SNAPSHOT_INTERVAL'):
+        if interval is None:
+            interval = getattr(settings, setting, 2.0)
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._snapshots = {}  # {name: Snapshot}
+        self._build_locks = {}  # {name: threading.Lock}
+        self.builds = 0
+        self.hits = 0
+
+    def _fresh(self, snapshot):
+        return snapshot is not None and time.monotonic() - snapshot.built_at < self.interval
+
+    def get(self, name, build):
+        """Get the named snapshot, calling build() for its data if it is stale"""
+        snapshot = self._snapshots.get(name)
+        if self._fresh(snapshot):
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        # Only wait for a concurrent rebuild when there is nothing to serve yet
+        if not build_lock.acquire(blocking=snapshot is None):
+            self.hits += 1
+            return snapshot
+        try:
+            snapshot = self._snapshots.get(name)
+            if self._fresh(snapshot):
+                self.hits += 1
+                return snapshot
+
+            data = build()
+            body = json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            if snapshot is not None and snapshot.etag == etag:
+                last_modified = snapshot.last_modified
+            else:
+                last_modified = int(time.time())
+            snapshot = Snapshot(data, body, etag, last_modified, time.monotonic())
+            self._snapshots[name] = snapshot
+            self.builds += 1
+            return snapshot
+        finally:
+            build_lock.release()
+
+    def clear(self):
+        """Drop every snapshot so the next request rebuilds"""
+        self._snapshots = {}
+
+    def get_stats(self):
+        """Get snapshot cache statistics"""
+        return {
+            "interval": self.interval,
+            "builds": self.builds,
+            "hits": self.hits,
+        }
+
+
+# Shared by the polled REST views in this process
+stats_snapshots = SnapshotCache()
+
+# Readiness probes hit the database at most once per interval
+readiness_checks = SnapshotCache(setting='PUBSUB_READINESS_CHECK_INTERVAL')
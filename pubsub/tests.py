@@ -0,0 +1,1168 @@
+import asyncio
+import atexit
+import io
+import json
+import logging
+import threading
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db.models.query import QuerySet
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics, rawjson
+from .activity import ConnectionActivity
+from .cache import topic_cache
+from .codecs import CODECS, Frame, JSONCodec, negotiate
+from .consumers import PubSubConsumer, replay_frame_builder
+from .counters import TopicCounters, topic_counters
+from .dispatcher import TopicDispatcher
+from .durable import OffsetTracker, durable_subscriptions
+from .history import ENTRY_OVERHEAD_BYTES, TopicHistory
+from .latency import LatencyHistogram, LatencyRecorder, publish_latency
+from .liveness import loop_lag_monitor
+from .log import BackgroundHandler, SamplingFilter
+from .models import Topic, Connection, DurableSubscription, Message, TopicSubscription
+from .outbound import DISCONNECT, DROP_NEWEST, DROP_OLDEST, SLOW_CONSUMER_CLOSE_CODE, OutboundQueue
+from .persistence import MessageWriter
+from .sequences import SequenceAllocator
+from .snapshot import readiness_checks, stats_snapshots
+from .trie import SubscriptionTrie, is_pattern, validate_pattern
+
+
+async def connect(subprotocols=None):
+    """Open a WebSocket to the consumer and read its connected frame"""
+    communicator = WebsocketCommunicator(PubSubConsumer.as_asgi(), '/ws/', subprotocols=subprotocols)
+    connected, _ = await communicator.connect()
+    assert connected
+    await communicator.receive_output()  # the connected frame, in the negotiated format
+    return communicator
+
+
+async def publish(communicator, topic, payload, client_id='publisher'):
+    """Publish a message and return its offset"""
+    await communicator.send_json_to({
+        'type': 'publish', 'topic': topic, 'client_id': client_id,
+        'message': {'id': str(uuid.uuid4()), 'payload': payload}, 'request_id': str(uuid.uuid4()),
+    })
+    return (await communicator.receive_json_from(3))['offset']
+
+
+class TopicListingQueryCountTests(TestCase):
+    """get_stats and list_topics must not run queries per topic"""
+
+    def setUp(self):
+        stats_snapshots.clear()
+
+    def create_topics(self, count):
+        """Create topics, each with one active subscription"""
+        topics = Topic.objects.bulk_create([Topic(name=f"topic-{i}") for i in range(count)])
+        connection = Connection.objects.create()
+        TopicSubscription.objects.bulk_create([
+            TopicSubscription(connection=connection, topic=topic) for topic in topics
+        ])
+        Topic.objects.update(subscriber_count=1, message_count=5)
+
+    def assert_constant_queries(self, url_name):
+        """The endpoint runs the same number of queries for 2 topics as for 50"""
+        self.create_topics(2)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+
+        Topic.objects.bulk_create([Topic(name=f"more-{i}") for i in range(48)])
+        stats_snapshots.clear()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_list_topics_is_one_query(self):
+        data = self.assert_constant_queries('pubsub:list_topics')
+        self.assertEqual(len(data['topics']), 50)
+        subscribers = {topic['name']: topic['subscribers'] for topic in data['topics']}
+        self.assertEqual(subscribers['topic-0'], 1)
+        self.assertEqual(subscribers['more-0'], 0)
+
+    def test_get_stats_is_one_query(self):
+        data = self.assert_constant_queries('pubsub:get_stats')
+        self.assertEqual(len(data['topics']), 50)
+        self.assertEqual(data['topics']['topic-1'], {"messages": 5, "subscribers": 1})
+
+    def test_unflushed_counters_are_included(self):
+        self.create_topics(1)
+        topic = Topic.objects.get(name='topic-0')
+        topic_counters.record_subscribers(topic.pk, 1)
+        topic_counters.record_messages(topic.pk, 3, topic.created_at)
+        try:
+            data = self.client.get(reverse('pubsub:get_stats')).json()
+        finally:
+            topic_counters.discard(topic.pk)
+        self.assertEqual(data['topics']['topic-0'], {"messages": 8, "subscribers": 2})
+
+
+class SnapshotTests(TestCase):
+    """Polled endpoints are served from memory and support conditional GET"""
+
+    def setUp(self):
+        stats_snapshots.clear()
+        Topic.objects.create(name='orders')
+
+    def test_polls_within_interval_run_no_queries(self):
+        self.client.get(reverse('pubsub:list_topics'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('pubsub:list_topics'))
+        self.assertEqual(response.json(), {"topics": [{"name": "orders", "subscribers": 0}]})
+
+    def test_matching_etag_returns_304(self):
+        response = self.client.get(reverse('pubsub:list_topics'))
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.client.get(reverse('pubsub:list_topics'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(reverse('pubsub:list_topics'), HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_unchanged_rebuild_keeps_etag(self):
+        first = self.client.get(reverse('pubsub:list_topics'))
+        stats_snapshots.interval, interval = 0, stats_snapshots.interval
+        try:
+            second = self.client.get(reverse('pubsub:list_topics'))
+            Topic.objects.create(name='payments')
+            third = self.client.get(reverse('pubsub:list_topics'))
+        finally:
+            stats_snapshots.interval = interval
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(first['Last-Modified'], second['Last-Modified'])
+        self.assertNotEqual(second['ETag'], third['ETag'])
+
+    def test_idle_stats_rebuild_returns_304(self):
+        first = self.client.get(reverse('pubsub:get_stats'))
+        stats_snapshots.interval, interval = 0, stats_snapshots.interval
+        try:
+            second = self.client.get(reverse('pubsub:get_stats'), HTTP_IF_NONE_MATCH=first['ETag'])
+            third = self.client.get(reverse('pubsub:get_stats'))
+        finally:
+            stats_snapshots.interval = interval
+        self.assertEqual(second.status_code, 304)
+        # Snapshot counters are live members, outside the ETag
+        self.assertEqual(third['ETag'], first['ETag'])
+        self.assertGreater(third.json()['snapshots']['builds'], first.json()['snapshots']['builds'])
+        self.assertIn('fanout', third.json())
+
+
+class HealthTests(TestCase):
+    """Liveness never touches the database; readiness does, rate-limited"""
+
+    def setUp(self):
+        readiness_checks.clear()
+        Topic.objects.create(name='orders')
+
+    def test_liveness_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('pubsub:health_check'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['status'], 'ok')
+        self.assertEqual(data['connections'], 0)
+        self.assertIn('lag_ms', data['event_loop'])
+        self.assertNotIn('snapshots', data)
+
+    def test_readiness_is_rate_limited(self):
+        response = self.client.get(reverse('pubsub:readiness_check'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['ready'])
+        self.assertEqual(response.json()['topics'], 1)
+        with self.assertNumQueries(0):
+            self.client.get(reverse('pubsub:readiness_check'))
+
+    def test_loop_lag_samples_keep_the_stats_etag(self):
+        stats_snapshots.clear()
+        first = self.client.get(reverse('pubsub:get_stats'))
+        stats_snapshots.clear()
+        with mock.patch.object(loop_lag_monitor, 'samples', loop_lag_monitor.samples + 1):
+            second = self.client.get(reverse('pubsub:get_stats'), HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 304)
+
+
+class MetricsTests(TestCase):
+    """Prometheus rendering and multi-worker merge"""
+
+    def test_merge_and_render(self):
+        worker = metrics.MetricsRegistry()
+        published = worker.counter('published_total', 'Published', ('topic',))
+        sizes = worker.histogram('batch_size', 'Batch sizes', buckets=(1, 10))
+        published.inc('orders', amount=2)
+        sizes.observe(value=5)
+        sizes.observe(value=50)
+
+        text = metrics.render(metrics.merge([worker.snapshot(), worker.snapshot()]))
+        self.assertIn('published_total{topic="orders"} 4\n', text)
+        self.assertIn('batch_size_bucket{le="1"} 0\n', text)
+        self.assertIn('batch_size_bucket{le="10"} 2\n', text)
+        self.assertIn('batch_size_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('batch_size_count 4\n', text)
+        self.assertIn('batch_size_sum 110.0\n', text)
+
+    def test_endpoint_runs_no_queries(self):
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('pubsub:metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('# TYPE pubsub_messages_published_total counter', response.content.decode())
+
+
+class LoggingTests(TestCase):
+    """Sampling thins hot-path records; the background handler never blocks"""
+
+    def record(self, event, level=logging.DEBUG):
+        record = logging.LogRecord('pubsub.consumers', level, __file__, 0, "message", None, None)
+        record.event = event
+        return record
+
+    def test_sampling_keeps_every_nth_record(self):
+        sampling = SamplingFilter({'fanout.delivery': 0.25, 'publish.payload': 0})
+        kept = [sampling.filter(self.record('fanout.delivery')) for _ in range(8)]
+        self.assertEqual(kept, [True, False, False, False] * 2)
+        self.assertFalse(sampling.filter(self.record('publish.payload')))
+        self.assertTrue(sampling.filter(self.record('connection.open')))
+
+    def test_warnings_are_never_sampled(self):
+        sampling = SamplingFilter({'outbound.slow_consumer': 0})
+        self.assertTrue(sampling.filter(self.record('outbound.slow_consumer', logging.WARNING)))
+
+    def test_full_queue_drops_records(self):
+        writing, release = threading.Event(), threading.Event()
+
+        class BlockedStream(io.StringIO):
+            def write(self, text):
+                writing.set()
+                release.wait(5)
+                return super().write(text)
+
+        handler = BackgroundHandler(queue_size=1, stream=BlockedStream())
+        try:
+            handler.handle(self.record('connection.open', logging.INFO))
+            self.assertTrue(writing.wait(5))  # the listener holds the first record
+            for _ in range(3):
+                handler.handle(self.record('connection.open', logging.INFO))
+            self.assertEqual(handler.dropped, 2)
+        finally:
+            release.set()
+            handler.queue.join()
+            handler.listener.stop()
+            atexit.unregister(handler.listener.stop)
+
+
+class LatencyHistogramTests(TestCase):
+    """Percentiles stay within the bucket precision"""
+
+    def test_percentiles(self):
+        histogram = LatencyHistogram()
+        for ms in range(1, 1001):
+            histogram.record(ms / 1000)
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 1000)
+        self.assertEqual(summary['max_ms'], 1000)
+        for key, expected in (('p50_ms', 500), ('p99_ms', 990), ('p999_ms', 999)):
+            self.assertGreaterEqual(summary[key], expected)
+            self.assertLessEqual(summary[key], expected * 1.02)
+
+
+class TopicDispatcherTests(TestCase):
+    """Each topic's frames are fanned out in submit order, in bounded batches"""
+
+    def test_frames_keep_their_order_per_topic(self):
+        batches = []
+
+        async def fanout(topic_name, frames):
+            batches.append((topic_name, [frame for frame, _ in frames]))
+            await asyncio.sleep(0.001)  # let frames pile up behind a running fan-out
+
+        async def scenario():
+            dispatcher = TopicDispatcher(fanout=fanout, concurrency=2, batch_size=3)
+            for i in range(10):
+                for topic_name in ('orders', 'audit', 'billing'):
+                    await dispatcher.submit(topic_name, i)
+                if i % 4 == 0:
+                    await asyncio.sleep(0)
+            for _ in range(1000):
+                if dispatcher.frames_dispatched == 30:
+                    break
+                await asyncio.sleep(0.001)
+
+        async_to_sync(scenario)()
+        for topic_name in ('orders', 'audit', 'billing'):
+            delivered = [frame for name, frames in batches if name == topic_name for frame in frames]
+            self.assertEqual(delivered, list(range(10)))
+        self.assertLessEqual(max(len(frames) for _, frames in batches), 3)
+        self.assertLess(len(batches), 30)
+
+
+@override_settings(PUBSUB_FANOUT_MODE='channel_layer', PUBSUB_PUBLISH_ACK_MODE='enqueue')
+class ChannelLayerFanoutTests(TransactionTestCase):
+    """Publishes reach subscribers through channel-layer groups, in order"""
+
+    def setUp(self):
+        topic_cache.clear()
+        PubSubConsumer._dispatcher = None  # picks its fan-out by mode on first use
+
+    def tearDown(self):
+        PubSubConsumer._dispatcher = None
+
+    def test_frames_arrive_in_order_on_every_subscriber(self):
+        Topic.objects.create(name='orders')
+        group_send = mock.patch.object(
+            InMemoryChannelLayer, 'group_send', autospec=True, side_effect=InMemoryChannelLayer.group_send
+        )
+
+        async def scenario():
+            publisher = await connect()
+            subscribers = [await connect(), await connect()]
+            for index, subscriber in enumerate(subscribers):
+                await subscriber.send_json_to({
+                    'type': 'subscribe', 'topic': 'orders', 'client_id': f'subscriber-{index}',
+                    'request_id': str(uuid.uuid4()),
+                })
+                await subscriber.receive_json_from(3)
+            for i in range(3):
+                await publish(publisher, 'orders', {'i': i})
+            # Queued together, so the dispatcher hands them to one group_send
+            await publisher.send_json_to({
+                'type': 'publish_batch', 'client_id': 'publisher', 'request_id': str(uuid.uuid4()),
+                'messages': [{'topic': 'orders', 'message': {'payload': {'i': i}}} for i in range(3, 10)],
+            })
+            await publisher.receive_json_from(3)
+            received = [
+                [(await subscriber.receive_json_from(3))['message'] for _ in range(10)]
+                for subscriber in subscribers
+            ]
+            self.assertTrue(await publisher.receive_nothing(0.1))  # not echoed to the publisher
+            for communicator in [publisher] + subscribers:
+                await communicator.disconnect()
+            return received
+
+        with group_send as sent:
+            received = async_to_sync(scenario)()
+        for messages in received:
+            self.assertEqual([message['payload']['i'] for message in messages], list(range(10)))
+            self.assertEqual([message['offset'] for message in messages], list(range(1, 11)))
+        frames_sent = [len(call.args[2]['frames']) for call in sent.call_args_list
+                       if call.args[2]['type'] == 'pubsub.frames']
+        self.assertEqual(sum(frames_sent), 10)
+        self.assertLess(len(frames_sent), 10)
+
+
+class MultiTopicSubscribeTests(TransactionTestCase):
+    """subscribe/unsubscribe with a topics list"""
+
+    def setUp(self):
+        topic_cache.clear()
+
+    def test_one_ack_and_per_entry_last_n(self):
+        for name in ('orders', 'payments'):
+            Topic.objects.create(name=name)
+
+        async def scenario():
+            publisher, subscriber = await connect(), await connect()
+            for name in ('orders', 'payments'):
+                for i in range(3):
+                    await publish(publisher, name, {'i': i})
+            await subscriber.send_json_to({
+                'type': 'subscribe', 'topics': ['orders', {'topic': 'payments', 'last_n': 2}, 'refunds'],
+                'last_n': 1, 'client_id': 'dashboard', 'request_id': str(uuid.uuid4()),
+            })
+            ack = await subscriber.receive_json_from(3)
+            replayed, ended = {}, set()
+            while len(ended) < 3:
+                frame = await subscriber.receive_json_from(3)
+                if frame['type'] == 'replay_end':
+                    ended.add(frame['topic'])
+                else:
+                    replayed.setdefault(frame['topic'], []).append(frame['message']['offset'])
+            await subscriber.send_json_to({
+                'type': 'unsubscribe', 'topics': ['orders', 'billing', 'refunds'],
+                'client_id': 'dashboard', 'request_id': str(uuid.uuid4()),
+            })
+            unsubscribed = await subscriber.receive_json_from(3)
+            active = await sync_to_async(lambda: set(
+                TopicSubscription.objects.filter(is_active=True).values_list('topic__name', flat=True)
+            ))()
+            await publisher.disconnect()
+            await subscriber.disconnect()
+            return ack, replayed, unsubscribed, active
+
+        ack, replayed, unsubscribed, active = async_to_sync(scenario)()
+        self.assertEqual((ack['type'], ack['topics']), ('subscribed', ['orders', 'payments', 'refunds']))
+        self.assertEqual(replayed, {'orders': [3], 'payments': [2, 3]})
+        self.assertTrue(Topic.objects.filter(name='refunds').exists())
+        self.assertEqual(unsubscribed['type'], 'unsubscribed')
+        self.assertEqual(unsubscribed['topics'], ['orders', 'refunds'])
+        self.assertEqual(unsubscribed['not_subscribed'], ['billing'])
+        self.assertEqual(active, {'payments'})
+
+
+class PublishBatchTests(TransactionTestCase):
+    """publish_batch: one ack, per-topic order, coalescing and all-or-nothing validation"""
+
+    def setUp(self):
+        topic_cache.clear()
+        for name in ('orders', 'payments'):
+            Topic.objects.create(name=name)
+
+    def publish_batch(self, entries, **options):
+        """Publish a batch to a subscriber of both topics; returns (ack, frames the subscriber got)"""
+
+        async def scenario():
+            publisher, subscriber = await connect(), await connect()
+            await subscriber.send_json_to({
+                'type': 'subscribe', 'topics': ['orders', 'payments'], 'client_id': 'subscriber',
+                'request_id': str(uuid.uuid4()),
+            })
+            await subscriber.receive_json_from(3)
+            await publisher.send_json_to(dict(options, **{
+                'type': 'publish_batch', 'client_id': 'publisher', 'request_id': str(uuid.uuid4()),
+                'messages': [{'topic': topic, 'message': {'payload': {'i': i}}} for topic, i in entries],
+            }))
+            ack = await publisher.receive_json_from(3)
+            frames = []
+            while not await subscriber.receive_nothing(0.1):
+                frames.append(await subscriber.receive_json_from(3))
+            await publisher.disconnect()
+            await subscriber.disconnect()
+            return ack, frames
+
+        return async_to_sync(scenario)()
+
+    def test_ack_lists_ids_and_topics_keep_their_order(self):
+        entries = [('orders', 0), ('payments', 0), ('orders', 1), ('payments', 1), ('orders', 2)]
+        ack, frames = self.publish_batch(entries, coalesce=False)
+        self.assertEqual((ack['type'], ack['count']), ('published_batch', 5))
+        stored = dict(Message.objects.values_list('id', 'sequence'))
+        self.assertEqual([stored[uuid.UUID(message_id)] for message_id in ack['message_ids']], ack['offsets'])
+        self.assertEqual(ack['offsets'], [1, 1, 2, 2, 3])
+        for topic in ('orders', 'payments'):
+            received = [frame['message'] for frame in frames if frame['topic'] == topic]
+            self.assertEqual([message['payload']['i'] for message in received],
+                             [i for name, i in entries if name == topic])
+        self.assertEqual({frame['type'] for frame in frames}, {'message'})
+
+    def test_coalesce_sends_one_message_batch_per_topic(self):
+        ack, frames = self.publish_batch([('orders', 0), ('payments', 0), ('orders', 1)], coalesce=True)
+        self.assertEqual(ack['count'], 3)
+        self.assertEqual([(frame['type'], frame['topic']) for frame in frames],
+                         [('message_batch', 'orders'), ('message_batch', 'payments')])
+        self.assertEqual([message['payload']['i'] for message in frames[0]['messages']], [0, 1])
+        self.assertEqual(frames[0]['messages'][0]['id'], ack['message_ids'][0])
+
+    def test_missing_topic_rejects_the_whole_batch(self):
+        ack, frames = self.publish_batch([('orders', 0), ('missing', 0), ('payments', 0)])
+        self.assertEqual(ack['type'], 'error')
+        self.assertIn('missing', ack['error'])
+        self.assertEqual(frames, [])
+        self.assertEqual(Message.objects.count(), 0)
+
+
+class PublishTraceTests(TransactionTestCase):
+    """A publish trace ends once, after every copy was sent or dropped"""
+
+    def setUp(self):
+        topic_cache.clear()
+        publish_latency.discard('orders')
+
+    @override_settings(PUBSUB_REPLAY_HOLD_LIMIT=3)
+    def test_dropped_copies_release_the_trace(self):
+        recorder = LatencyRecorder(enabled=True, debug=False)
+        trace = recorder.start('orders')
+
+        async def send(text_data=None, bytes_data=None):
+            raise ConnectionError("socket closed")
+
+        async def scenario():
+            consumer = PubSubConsumer()
+            consumer.send = send
+            consumer.outbound = OutboundQueue(consumer, max_size=100)
+            consumer.outbound.start()
+            consumer.subscribed_topics.add('orders')
+            consumer.begin_replay('orders')
+            trace.start_fanout()
+            for message_id in ('a', 'b', 'c', 'd'):
+                frame = Frame({'type': 'message', 'topic': 'orders', 'message': {'id': message_id}})
+                frame.trace = trace
+                trace.hold()
+                consumer.deliver('orders', frame)
+            # 'a' overflows the hold limit, 'b' was replayed, 'c' fails on
+            # the socket and 'd' is discarded when the queue closes
+            await consumer.release_held_frames('orders', {'b'})
+            await consumer.outbound.wait_below(0)
+
+        async_to_sync(scenario)()
+        stats = recorder.get_stats('orders')['orders']
+        self.assertEqual(trace.pending, 0)
+        self.assertEqual(stats['total']['count'], 1)
+        self.assertNotIn('send', stats)
+
+    def test_publish_batch_is_traced_per_topic(self):
+        Topic.objects.create(name='orders')
+
+        async def scenario():
+            publisher, subscriber = await connect(), await connect()
+            await subscriber.send_json_to({
+                'type': 'subscribe', 'topic': 'orders', 'client_id': 'subscriber', 'request_id': str(uuid.uuid4()),
+            })
+            await subscriber.receive_json_from(3)
+            await publisher.send_json_to({
+                'type': 'publish_batch', 'client_id': 'publisher', 'request_id': str(uuid.uuid4()),
+                'messages': [{'topic': 'orders', 'message': {'payload': {'i': i}}} for i in range(3)],
+            })
+            await publisher.receive_json_from(3)
+            for _ in range(3):
+                await subscriber.receive_json_from(3)
+            await asyncio.sleep(0.05)
+            await publisher.disconnect()
+            await subscriber.disconnect()
+
+        async_to_sync(scenario)()
+        stats = publish_latency.get_stats('orders')['orders']
+        self.assertEqual(stats['lookup']['count'], 1)
+        self.assertEqual(stats['send']['count'], 3)
+        self.assertEqual(stats['total']['count'], 1)
+
+
+class ConnectionActivityTests(TransactionTestCase):
+    """Activity is written with one UPDATE and survives a failed write"""
+
+    def test_one_update_for_all_timestamps(self):
+        first, second = Connection.objects.create(), Connection.objects.create()
+        activity = ConnectionActivity(granularity=1)
+        now = timezone.now()
+        with mock.patch('pubsub.activity.timezone.now', return_value=now):
+            activity.touch(first.pk)
+        with mock.patch('pubsub.activity.timezone.now', return_value=now + timedelta(seconds=3)):
+            activity.touch(second.pk)
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=QuerySet.update) as update:
+            async_to_sync(activity.flush)()
+        self.assertEqual(update.call_count, 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(second.last_activity - first.last_activity, timedelta(seconds=3))
+
+    def test_failed_write_keeps_the_newest_activity(self):
+        activity = ConnectionActivity(granularity=1)
+        now = timezone.now()
+        with mock.patch('pubsub.activity.timezone.now', return_value=now):
+            activity.touch('a')
+            activity.touch('b')
+
+        async def failing_write(batch):
+            # 'b' is active again while the write is in flight
+            with mock.patch('pubsub.activity.timezone.now', return_value=now + timedelta(seconds=5)):
+                activity.touch('b')
+            raise RuntimeError("database is locked")
+
+        with mock.patch.object(activity, '_write', failing_write):
+            with self.assertRaises(RuntimeError):
+                async_to_sync(activity.flush)()
+        self.assertEqual(activity._pending['a'], activity._bucket(now))
+        self.assertEqual(activity._pending['b'], activity._bucket(now + timedelta(seconds=5)))
+
+
+class SequenceAllocatorTests(TransactionTestCase):
+    """Offsets from several allocators (workers) of one topic"""
+
+    def allocate_interleaved(self):
+        topic = Topic.objects.create(name='orders')
+        first, second = SequenceAllocator(block_size=100), SequenceAllocator(block_size=100)
+        offsets = []
+        for allocator in (first, second, first, second, second, first):
+            offsets.extend(async_to_sync(allocator.allocate)(topic))
+        return offsets
+
+    @override_settings(PUBSUB_FANOUT_MODE='channel_layer')
+    def test_workers_allocate_in_order(self):
+        self.assertEqual(self.allocate_interleaved(), [1, 2, 3, 4, 5, 6])
+
+    @override_settings(PUBSUB_FANOUT_MODE='local')
+    def test_single_worker_leases_blocks(self):
+        # Blocks are only used when there is one worker; two allocators here
+        # stand for a restart, whose leftover numbers are skipped
+        self.assertEqual(self.allocate_interleaved(), [1, 101, 2, 102, 103, 3])
+
+
+class OffsetTrackerTests(TestCase):
+    """The durable cursor only moves over delivered offsets"""
+
+    def test_out_of_order_offsets_wait_for_the_hole(self):
+        tracker = OffsetTracker(1, 6, hole_timeout=60)
+        self.assertFalse(tracker.add([8]))
+        self.assertEqual(tracker.cursor, 6)
+        self.assertTrue(tracker.add([7]))
+        self.assertEqual(tracker.cursor, 8)
+
+    def test_hole_is_skipped_after_timeout(self):
+        tracker = OffsetTracker(1, 6, hole_timeout=5)
+        with mock.patch('pubsub.durable.time.monotonic', return_value=100.0):
+            tracker.add([8])
+        with mock.patch('pubsub.durable.time.monotonic', return_value=106.0):
+            tracker.add([9])
+        self.assertEqual(tracker.cursor, 9)
+
+
+class DurableResumeTests(TransactionTestCase):
+    """A resumed durable subscription replays exactly what the client missed"""
+
+    def setUp(self):
+        topic_cache.clear()
+
+    def test_resume_replays_the_gap(self):
+        async def scenario():
+            publisher = await connect()
+            await publisher.send_json_to({
+                'type': 'subscribe', 'topic': 'orders', 'client_id': 'publisher', 'request_id': str(uuid.uuid4()),
+            })
+            await publisher.receive_json_from(3)
+            mobile = await connect()
+            await mobile.send_json_to({
+                'type': 'subscribe', 'topic': 'orders', 'durable': True,
+                'client_id': 'mobile', 'request_id': str(uuid.uuid4()),
+            })
+            await mobile.receive_json_from(3)
+            delivered = [await publish(publisher, 'orders', {'i': i}) for i in range(2)]
+            for _ in delivered:
+                await mobile.receive_json_from(3)
+            await mobile.disconnect()
+            missed = [await publish(publisher, 'orders', {'i': i}) for i in range(2, 5)]
+
+            resumed = await connect()
+            await resumed.send_json_to({'type': 'resume', 'client_id': 'mobile', 'request_id': str(uuid.uuid4())})
+            ack = await resumed.receive_json_from(3)
+            frames = [await resumed.receive_json_from(3) for _ in range(len(missed) + 1)]
+            await resumed.disconnect()
+            await publisher.disconnect()
+            await durable_subscriptions.flush()
+            return delivered, missed, ack, frames
+
+        delivered, missed, ack, frames = async_to_sync(scenario)()
+        self.assertEqual(ack['topics'], [{'topic': 'orders', 'from_offset': delivered[-1] + 1}])
+        self.assertEqual([frame['message']['offset'] for frame in frames[:-1]], missed)
+        self.assertEqual(frames[-1]['type'], 'replay_end')
+        self.assertEqual(frames[-1]['last_offset'], missed[-1])
+
+
+    def test_busy_replay_ends_truncated(self):
+        topic = Topic.objects.create(name='orders')
+        DurableSubscription.objects.create(client_id='mobile', topic=topic, last_offset=4)
+
+        async def scenario():
+            resumed = await connect()
+            # As if a last_n replay of the topic were still running on this connection
+            with mock.patch.object(PubSubConsumer, 'begin_replay', return_value=False):
+                await resumed.send_json_to({'type': 'resume', 'client_id': 'mobile', 'request_id': str(uuid.uuid4())})
+                ack = await resumed.receive_json_from(3)
+                end = await resumed.receive_json_from(3)
+            await resumed.disconnect()
+            return ack, end
+
+        ack, end = async_to_sync(scenario)()
+        self.assertEqual(ack['topics'], [{'topic': 'orders', 'from_offset': 5}])
+        self.assertEqual((end['type'], end['topic'], end['count']), ('replay_end', 'orders', 0))
+        self.assertEqual((end['last_offset'], end['truncated']), (4, True))
+
+
+class TopicCacheTests(TransactionTestCase):
+    """Cached topics don't outlive their rows"""
+
+    def setUp(self):
+        topic_cache.clear()
+
+    def test_orm_delete_invalidates_the_cache(self):
+        topic_cache.put(Topic.objects.create(name='orders'))
+        Topic.objects.filter(name='orders').delete()
+        self.assertIsNone(topic_cache.get('orders'))
+
+    def test_writer_drop_invalidates_the_cache(self):
+        topic = Topic.objects.create(name='orders')
+        # Deleted where this worker's signal handlers don't run (another worker)
+        with mock.patch('pubsub.signals.invalidate_topic'):
+            Topic.objects.filter(name='orders').delete()
+        topic_cache.put(topic)
+        writer = MessageWriter(batch_size=1000, flush_interval_ms=60000)
+
+        async def scenario():
+            dropped = writer.append(Message(topic=topic, sequence=1, data='{}'), wait=True)
+            await writer.flush()
+            return await dropped
+
+        self.assertFalse(async_to_sync(scenario)())
+        self.assertIsNone(topic_cache.get('orders'))
+
+
+class TopicHistoryTests(TransactionTestCase):
+    """Replay buffers: byte cap, shared cold loads and database fallback"""
+
+    def store_messages(self, count):
+        """Store count messages on a new topic; returns the topic and its entries, oldest first"""
+        topic = Topic.objects.create(name='orders')
+        now = timezone.now()
+        messages = Message.objects.bulk_create([
+            Message(topic=topic, sequence=i, data=f'{{"i": {i}}}', published_at=now + timedelta(seconds=i))
+            for i in range(1, count + 1)
+        ])
+        return topic, [(str(m.id), m.data, m.published_at, m.sequence) for m in messages]
+
+    def test_byte_cap_evicts_the_least_recently_published_topic(self):
+        history = TopicHistory(default_size=10, max_bytes=3 * (ENTRY_OVERHEAD_BYTES + 2))
+        now = timezone.now()
+        history.append('orders', 'o1', '{}', now, 1)
+        history.append('orders', 'o2', '{}', now, 2)
+        history.append('billing', 'b1', '{}', now, 1)
+        history.append('orders', 'o3', '{}', now, 3)
+        self.assertEqual(history.get_stats()['messages'], 3)
+        self.assertIsNone(history.get_since('billing', 1))
+        self.assertEqual([entry[0] for entry in history.get_since('orders', 1)], ['o1', 'o2', 'o3'])
+
+    def test_concurrent_cold_replays_share_one_load(self):
+        topic, entries = self.store_messages(5)
+        history = TopicHistory(default_size=10)
+
+        async def replay():
+            return await asyncio.gather(*[history.get_recent(topic, 3) for _ in range(3)])
+
+        results = async_to_sync(replay)()
+        self.assertEqual(history.db_loads, 1)
+        for result in results:
+            self.assertEqual(result, entries[:-4:-1])
+        # The load read the whole (short) history, so older offsets are served too
+        self.assertEqual(history.get_since('orders', 1), entries)
+
+    def test_incomplete_buffer_falls_back_to_the_database(self):
+        topic, entries = self.store_messages(5)
+        history = TopicHistory(default_size=2)
+        for entry in entries:
+            history.append('orders', *entry)
+        self.assertIsNone(history.get_since('orders', 1))
+        self.assertEqual(history.get_since('orders', 4), entries[3:])
+        self.assertEqual(async_to_sync(history.get_recent)(topic, 4), entries[:-5:-1])
+        self.assertEqual(history.db_loads, 1)
+
+
+class MessageWriterTests(TransactionTestCase):
+    """Write-behind acknowledgements"""
+
+    def setUp(self):
+        topic_cache.clear()
+        # A writer that only flushes when told to
+        self.writer = PubSubConsumer._message_writer = MessageWriter(batch_size=1000, flush_interval_ms=60000)
+
+    def tearDown(self):
+        PubSubConsumer._message_writer = None
+
+    def test_messages_for_deleted_topics_resolve_false(self):
+        kept, deleted = Topic.objects.create(name='kept'), Topic.objects.create(name='deleted')
+
+        async def scenario():
+            written = self.writer.append(Message(topic=kept, sequence=1, data='{}'), wait=True)
+            dropped = self.writer.append_many([
+                Message(topic=kept, sequence=2, data='{}'),
+                Message(topic=deleted, sequence=1, data='{}'),
+            ], wait=True)
+            await sync_to_async(Topic.objects.filter(name="deleted").delete)()
+            await self.writer.flush()
+            return await written, await dropped
+
+        self.assertEqual(async_to_sync(scenario)(), (True, False))
+        self.assertEqual(sorted(Message.objects.values_list('sequence', flat=True)), [1, 2])
+
+    def publish_and_check_ack(self):
+        """Publish, report whether the ack arrived before the flush, then flush"""
+        Topic.objects.create(name='orders')
+
+        async def scenario():
+            communicator = await connect()
+            await communicator.send_json_to({
+                'type': 'publish', 'topic': 'orders', 'client_id': 'publisher',
+                'message': {'id': 'm1', 'payload': {}}, 'request_id': str(uuid.uuid4()),
+            })
+            acked_early = not await communicator.receive_nothing(0.2)
+            await self.writer.flush()
+            frames = [await communicator.receive_json_from(3)] if not acked_early else []
+            await communicator.disconnect()
+            return acked_early, frames
+
+        return async_to_sync(scenario)()
+
+    @override_settings(PUBSUB_PUBLISH_ACK_MODE='enqueue')
+    def test_enqueue_mode_acks_before_the_write(self):
+        acked_early, _ = self.publish_and_check_ack()
+        self.assertTrue(acked_early)
+
+    @override_settings(PUBSUB_PUBLISH_ACK_MODE='flush')
+    def test_flush_mode_acks_after_the_write(self):
+        acked_early, frames = self.publish_and_check_ack()
+        self.assertFalse(acked_early)
+        self.assertEqual(frames[0]['type'], 'published')
+        self.assertEqual(Message.objects.count(), 1)
+
+    @override_settings(PUBSUB_PUBLISH_ACK_MODE='flush')
+    def test_dropped_publish_is_reported(self):
+        Topic.objects.create(name='orders')
+
+        async def scenario():
+            communicator = await connect()
+            await communicator.send_json_to({
+                'type': 'publish', 'topic': 'orders', 'client_id': 'publisher',
+                'message': {'id': 'm1', 'payload': {}}, 'request_id': str(uuid.uuid4()),
+            })
+            await communicator.receive_nothing(0.2)
+            await sync_to_async(Topic.objects.filter(name="orders").delete)()
+            await self.writer.flush()
+            frame = await communicator.receive_json_from(3)
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(scenario)()
+        self.assertEqual(frame['type'], 'error')
+        self.assertEqual(Message.objects.count(), 0)
+
+
+class OutboundQueueTests(TestCase):
+    """A full outbound queue follows its overflow policy"""
+
+    class Connection:
+        """Stands in for a consumer, recording socket writes and closes"""
+
+        connection_id = 'connection'
+
+        def __init__(self):
+            self.sent = []
+            self.close_codes = []
+
+        async def send(self, text_data=None, bytes_data=None):
+            self.sent.append(text_data)
+
+        async def close(self, code=None):
+            self.close_codes.append(code)
+
+    def overflow(self, policy):
+        """Queue five frames on a queue of three before the writer runs"""
+        connection = self.Connection()
+
+        async def scenario():
+            queue = OutboundQueue(connection, max_size=3, policy=policy)
+            queue.start()
+            accepted = [queue.put(str(i)) for i in range(5)]
+            await queue.wait_below(0)
+            await asyncio.sleep(0.01)
+            queue.close()
+            return queue, accepted
+
+        queue, accepted = async_to_sync(scenario)()
+        return connection, queue, accepted
+
+    def test_drop_oldest(self):
+        connection, queue, accepted = self.overflow(DROP_OLDEST)
+        self.assertEqual(accepted, [True] * 5)
+        self.assertEqual(connection.sent, ['2', '3', '4'])
+        self.assertEqual((queue.dropped, queue.max_depth), (2, 3))
+
+    def test_drop_newest(self):
+        connection, queue, accepted = self.overflow(DROP_NEWEST)
+        self.assertEqual(accepted, [True, True, True, False, False])
+        self.assertEqual(connection.sent, ['0', '1', '2'])
+        self.assertEqual(queue.dropped, 2)
+
+    def test_disconnect(self):
+        connection, queue, accepted = self.overflow(DISCONNECT)
+        self.assertEqual(accepted, [True, True, True, False, False])
+        self.assertEqual(connection.sent, [])
+        self.assertEqual(connection.close_codes, [SLOW_CONSUMER_CLOSE_CODE])
+        self.assertEqual(queue.dropped, 1)
+
+    def test_unknown_policy_is_rejected(self):
+        with self.assertRaises(ValueError):
+            OutboundQueue(self.Connection(), policy='block')
+
+
+class ReplayFlowControlTests(TransactionTestCase):
+    """Replay and the live frames held behind it respect the outbound credit"""
+
+    def make_consumer(self):
+        """A consumer whose socket writes are collected in a list"""
+        consumer = PubSubConsumer()
+        sent = []
+
+        async def send(text_data=None, bytes_data=None):
+            sent.append(text_data)
+
+        consumer.send = send
+        consumer.outbound = OutboundQueue(consumer, max_size=100)
+        consumer.outbound.start()
+        return consumer, sent
+
+    @override_settings(PUBSUB_REPLAY_HOLD_LIMIT=6, PUBSUB_REPLAY_CHUNK_SIZE=2, PUBSUB_REPLAY_CREDIT=2)
+    def test_held_frames_are_bounded_and_released_with_credit(self):
+        dropped = PubSubConsumer._replay_stats['live_frames_dropped']
+
+        async def scenario():
+            consumer, sent = self.make_consumer()
+            consumer.subscribed_topics.add('orders')
+            consumer.begin_replay('orders')
+            for i in range(8):
+                consumer.deliver('orders', f'{{"i": {i}}}', message_ids=())
+            overflowed = 'orders' in consumer._replay_overflowed
+            await consumer.release_held_frames('orders', set())
+            await consumer.outbound.wait_below(0)
+            await asyncio.sleep(0)
+            consumer.outbound.close()
+            return consumer, sent, overflowed
+
+        consumer, sent, overflowed = async_to_sync(scenario)()
+        self.assertTrue(overflowed)
+        self.assertEqual(PubSubConsumer._replay_stats['live_frames_dropped'] - dropped, 2)
+        self.assertEqual(sent, [f'{{"i": {i}}}' for i in range(2, 8)])
+        self.assertLessEqual(consumer.outbound.max_depth, 2)
+        self.assertNotIn('orders', consumer._replay_buffers)
+
+    @override_settings(PUBSUB_FANOUT_MODE='channel_layer')
+    def test_last_n_is_paged_from_the_database(self):
+        topic = Topic.objects.create(name='orders')
+        now = timezone.now()
+        Message.objects.bulk_create([
+            Message(topic=topic, sequence=i, data='{}', published_at=now + timedelta(seconds=i)) for i in range(1, 8)
+        ])
+
+        async def collect():
+            return [chunk async for chunk in PubSubConsumer().iter_last_n_messages(topic, 5, 2)]
+
+        chunks = async_to_sync(collect)()
+        self.assertEqual([[entry[3] for entry in chunk] for chunk in chunks], [[3, 4], [5, 6], [7]])
+
+
+class SubscriberReconcileTests(TransactionTestCase):
+    """Reconcile doesn't count subscriptions whose delta is still in memory twice"""
+
+    def setUp(self):
+        self.counters = TopicCounters(interval=60, reconcile_interval=3600)
+        self.topic = Topic.objects.create(name='orders')
+        self.connection = Connection.objects.create()
+
+    def subscribe(self):
+        """Write a subscription row and record its delta, like the consumer does"""
+        with self.counters.subscriber_changes([self.topic.pk]):
+            TopicSubscription.objects.create(connection=self.connection, topic=self.topic)
+            self.counters.record_subscribers(self.topic.pk, 1)
+
+    def stored_count(self):
+        return Topic.objects.get(pk=self.topic.pk).subscriber_count
+
+    def test_pending_delta_is_not_double_counted(self):
+        self.subscribe()
+        async_to_sync(self.counters.reconcile)()
+        async_to_sync(self.counters.flush)()
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_drift_is_corrected(self):
+        Topic.objects.filter(pk=self.topic.pk).update(subscriber_count=7)
+        TopicSubscription.objects.create(connection=self.connection, topic=self.topic)
+        async_to_sync(self.counters.reconcile)()
+        self.assertEqual(self.stored_count(), 1)
+
+    def test_topics_changing_meanwhile_are_skipped(self):
+        Topic.objects.filter(pk=self.topic.pk).update(subscriber_count=7)
+        with self.counters.subscriber_changes([self.topic.pk]):
+            async_to_sync(self.counters.reconcile)()
+        self.assertEqual(self.stored_count(), 7)
+
+
+def pattern_matches(pattern, levels):
+    """Reference matcher for wildcard patterns, given a topic's levels"""
+    if not pattern:
+        return not levels
+    if pattern[0] == '#':
+        return True
+    if not levels:
+        return False
+    return pattern[0] in ('*', levels[0]) and pattern_matches(pattern[1:], levels[1:])
+
+
+class SubscriptionTrieTests(TestCase):
+    """Wildcard pattern matching"""
+
+    patterns = [
+        'orders', 'orders.*', 'orders.#', 'orders.*.created', 'orders.eu.#', '*', '#', '*.*', 'billing.#',
+        '*.eu.*', 'orders.eu.created',
+    ]
+    topics = ['orders', 'orders.eu', 'orders.eu.created', 'orders.us.created', 'orders.eu.created.late',
+              'billing', 'billing.eu', 'audit.eu.log']
+
+    def test_match_agrees_with_reference(self):
+        trie = SubscriptionTrie()
+        for pattern in self.patterns:
+            trie.add(pattern, pattern)
+        for topic in self.topics:
+            expected = {pattern for pattern in self.patterns
+                        if pattern_matches(pattern.split('.'), topic.split('.'))}
+            self.assertEqual(trie.match(topic), expected, topic)
+
+    def test_remove_prunes_and_keeps_other_subscribers(self):
+        trie = SubscriptionTrie()
+        self.assertTrue(trie.add('orders.#', 'a'))
+        self.assertFalse(trie.add('orders.#', 'a'))
+        trie.add('orders.#', 'b')
+        trie.add('orders.*.created', 'a')
+        self.assertTrue(trie.remove('orders.#', 'a'))
+        self.assertFalse(trie.remove('orders.#', 'a'))
+        self.assertFalse(trie.remove('orders.eu', 'a'))
+        self.assertEqual(trie.match('orders.eu.created'), {'a', 'b'})
+        trie.remove('orders.#', 'b')
+        trie.remove('orders.*.created', 'a')
+        self.assertFalse(trie)
+        self.assertEqual(trie._root.children, {})
+
+    def test_validate_pattern(self):
+        self.assertTrue(is_pattern('orders.*'))
+        self.assertFalse(is_pattern('orders.eu'))
+        for pattern in ('orders.*', 'orders.#', '#', '*.eu.#'):
+            self.assertIsNone(validate_pattern(pattern), pattern)
+        for pattern in ('orders.#.created', '#.orders', 'orders..*', 'orders.', '.#'):
+            self.assertIsNotNone(validate_pattern(pattern), pattern)
+
+
+class RawJSONTests(TestCase):
+    """Frames decode like json.loads and keep the source text of their members"""
+
+    def test_member_spans_keep_source_text(self):
+        for frame in (
+            '{"type": "publish", "message": {"id": "m1", "payload": {"b": 1.50, "a": "\\u00e9"}}}',
+            '{ "type" : "publish" ,\n "message" : { "id":"m1" , "payload" : {"b": 1.50, "a": "\\u00e9"} } }',
+        ):
+            decoded = rawjson.loads(frame)
+            self.assertEqual(decoded, json.loads(frame))
+            payload = rawjson.raw_member(decoded['message'], 'payload')
+            self.assertEqual(payload, '{"b": 1.50, "a": "\\u00e9"}')
+            self.assertIn(rawjson.raw_text(decoded['message']), frame)
+            self.assertEqual(json.loads(rawjson.raw_text(decoded['message'])), decoded['message'])
+
+    def test_batch_entries_keep_source_text(self):
+        decoded = rawjson.loads('{"messages": [{"topic": "a", "message": {"payload": [1, 2.0]}}, {}]}')
+        self.assertEqual(rawjson.raw_member(decoded['messages'][0]['message'], 'payload'), '[1, 2.0]')
+        self.assertIsNone(rawjson.raw_member(decoded['messages'][1], 'message'))
+
+    def test_dumps_splices_raw_text(self):
+        data = {'type': 'message', 'payload': rawjson.RawJSON('{"b": 1.50}'), 'ids': ['\u00e9', 1, None]}
+        self.assertEqual(
+            rawjson.dumps(data), '{"type": "message", "payload": {"b": 1.50}, "ids": ["\\u00e9", 1, null]}'
+        )
+        plain = {'a': [1, 2.5, True], 'b': {'c': 'd'}}
+        self.assertEqual(rawjson.dumps(plain), json.dumps(plain))
+
+    def test_invalid_frames_are_rejected(self):
+        for frame in ('{"a" 1}', '{"a": 1,}', '{"a": 1} x', '{a: 1}', '{"messages": [{} {}]}', '{"message": }'):
+            with self.assertRaises(json.JSONDecodeError, msg=frame):
+                rawjson.loads(frame)
+
+
+class ReplayFrameTests(TransactionTestCase):
+    """Replayed frames splice the stored JSON in as text"""
+
+    def test_spliced_frame_matches_json_dumps(self):
+        published_at = timezone.now()
+        for topic_name, payload in (
+            ('orders', {'i': 1}),
+            ('caf\u00e9 "eu"', {'id': 'm1', 'payload': {'text': 'na\u00efve \\ "quoted"', 'n': [1.5, None, True]}}),
+        ):
+            data = json.dumps(payload)
+            for sequence in (7, None):
+                frame = replay_frame_builder(topic_name)('m1', data, published_at, sequence)
+                self.assertEqual(frame, json.dumps({
+                    'type': 'message', 'topic': topic_name, 'message': {
+                        'id': 'm1', 'offset': sequence, 'payload': json.loads(data),
+                        'timestamp': published_at.isoformat(),
+                    },
+                }))
+
+    def test_binary_connections_get_decoded_frames(self):
+        Topic.objects.create(name='orders')
+        topic_cache.clear()
+        codec = CODECS['msgpack']
+
+        async def scenario():
+            publisher = await connect()
+            for i in range(3):
+                await publish(publisher, 'orders', {'i': i})
+            subscriber = await connect(['pubsub.msgpack'])
+            await subscriber.send_to(bytes_data=codec.encode({
+                'type': 'subscribe', 'topic': 'orders', 'client_id': 'subscriber', 'last_n': 2,
+                'request_id': str(uuid.uuid4()),
+            }))
+            frames = [codec.decode((await subscriber.receive_output(3))['bytes']) for _ in range(4)]
+            await publisher.disconnect()
+            await subscriber.disconnect()
+            return frames
+
+        frames = async_to_sync(scenario)()
+        self.assertEqual([frame['type'] for frame in frames], ['subscribed', 'message', 'message', 'replay_end'])
+        self.assertEqual([frame['message']['offset'] for frame in frames[1:3]], [2, 3])
+        self.assertEqual([frame['message']['payload']['payload'] for frame in frames[1:3]], [{'i': 1}, {'i': 2}])
+
+
+class CodecTests(TransactionTestCase):
+    """Wire format negotiation and MessagePack publishing"""
+
+    def test_client_preference_wins(self):
+        codec, subprotocol = negotiate(['unknown', 'pubsub.msgpack', 'pubsub.json'])
+        self.assertEqual((codec.name, subprotocol), ('msgpack', 'pubsub.msgpack'))
+        codec, subprotocol = negotiate(['unknown'])
+        self.assertEqual((codec.name, subprotocol), ('json', None))
+
+    @override_settings(PUBSUB_CODECS=['json'])
+    def test_disabled_codecs_are_not_offered(self):
+        codec, subprotocol = negotiate(['pubsub.msgpack'])
+        self.assertEqual((codec.name, subprotocol), ('json', None))
+
+    def test_binary_payload_is_rejected(self):
+        Topic.objects.create(name='orders')
+        topic_cache.clear()
+        codec = CODECS['msgpack']
+
+        async def scenario():
+            communicator = await connect(['pubsub.msgpack'])
+            await communicator.send_to(bytes_data=codec.encode({
+                'type': 'publish', 'topic': 'orders', 'client_id': 'publisher',
+                'message': {'payload': {'blob': b'\x00\x01'}}, 'request_id': str(uuid.uuid4()),
+            }))
+            response = codec.decode((await communicator.receive_output(3))['bytes'])
+            await communicator.disconnect()
+            return response
+
+        response = async_to_sync(scenario)()
+        self.assertEqual(response['type'], 'error')
+        self.assertIn('base64', response['error'])
+        self.assertEqual(Message.objects.count(), 0)
+
+    def test_relayed_frames_are_decoded_once_per_worker(self):
+        text = CODECS[JSONCodec.name].encode({'type': 'message', 'topic': 'orders', 'message': {'id': 'm1'}})
+        first = PubSubConsumer.relayed_frame('orders', text, ['m1'])
+        second = PubSubConsumer.relayed_frame('orders', text, ['m1'])
+        self.assertIs(first, second)
+        encodes = Frame.encodes
+        self.assertEqual(first.encode(CODECS['msgpack']), second.encode(CODECS['msgpack']))
+        self.assertEqual(Frame.encodes - encodes, 1)
+
+    def test_only_published_frames_count_as_publish_encodes(self):
+        encodes, publish_encodes = Frame.encodes, Frame.publish_encodes
+        published = Frame({'type': 'message'})
+        published.published = True
+        for codec in (CODECS['json'], CODECS['msgpack']):
+            published.encode(codec)
+            Frame({'type': 'replay_end'}).encode(codec)
+        self.assertEqual(Frame.publish_encodes - publish_encodes, 2)
+        self.assertEqual(Frame.encodes - encodes, 4)
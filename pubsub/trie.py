@@ -0,0 +1,109 @@
+SEPARATOR = '.'
+SINGLE_LEVEL = '*'  # exactly one level
+MULTI_LEVEL = '#'  # zero or more levels; only valid as the last level
+
+
+def is_pattern(name):
+    """True when a subscription name contains a wildcard level"""
+    return any(level in (SINGLE_LEVEL, MULTI_LEVEL) for level in name.split(SEPARATOR))
+
+
+def validate_pattern(pattern):
+    """Get an error message for a malformed pattern, or None if it is valid"""
+    levels = pattern.split(SEPARATOR)
+    if any(not level for level in levels):
+        return f"Invalid pattern (empty level): {pattern}"
+    if MULTI_LEVEL in levels[:-1]:
+        return f"Invalid pattern ('{MULTI_LEVEL}' must be the last level): {pattern}"
+    return None
+
+
+class TrieNode:
+    """One level of the subscription trie"""
+
+    __slots__ = ('children', 'subscribers')
+
+    def __init__(self):
+        self.children = {}  # {level: TrieNode}; wildcards are ordinary keys
+        self.subscribers = set()
+
+
+class SubscriptionTrie:
+    """
+    Pattern subscriptions over dot-separated topic names.
+    '*' matches exactly one level and '#' matches zero or more trailing
+    levels, so 'orders.*.created' matches 'orders.eu.created' and
+    'orders.#' matches 'orders', 'orders.eu' and 'orders.eu.created'.
+    match() walks at most the literal, '*' and '#' branches per level, so
+    its cost depends on the topic's depth, not on how many patterns exist.
+    """
+
+    def __init__(self):
+        self._root = TrieNode()
+        self.patterns = 0  # (pattern, subscriber) pairs currently registered
+
+    def add(self, pattern, subscriber):
+        """Register a subscriber for a pattern; returns False if it was already registered"""
+        node = self._root
+        for level in pattern.split(SEPARATOR):
+            child = node.children.get(level)
+            if child is None:
+                child = node.children[level] = TrieNode()
+            node = child
+        if subscriber in node.subscribers:
+            return False
+        node.subscribers.add(subscriber)
+        self.patterns += 1
+        return True
+
+    def remove(self, pattern, subscriber):
+        """Unregister a subscriber from a pattern, pruning empty branches"""
+        path = [self._root]
+        for level in pattern.split(SEPARATOR):
+            child = path[-1].children.get(level)
+            if child is None:
+                return False
+            path.append(child)
+        if subscriber not in path[-1].subscribers:
+            return False
+        path[-1].subscribers.discard(subscriber)
+        self.patterns -= 1
+
+        # Walk back up, dropping nodes that no longer lead to a subscriber
+        levels = pattern.split(SEPARATOR)
+        for depth in range(len(levels), 0, -1):
+            node = path[depth]
+            if node.subscribers or node.children:
+                break
+            del path[depth - 1].children[levels[depth - 1]]
+        return True
+
+    def match(self, topic_name):
+        """Get every subscriber whose pattern matches a concrete topic name"""
+        matched = set()
+        nodes = [self._root]
+        for level in topic_name.split(SEPARATOR):
+            next_nodes = []
+            for node in nodes:
+                # '#' swallows this level and everything after it
+                multi = node.children.get(MULTI_LEVEL)
+                if multi is not None:
+                    matched |= multi.subscribers
+                for key in (level, SINGLE_LEVEL):
+                    child = node.children.get(key)
+                    if child is not None:
+                        next_nodes.append(child)
+            nodes = next_nodes
+            if not nodes:
+                return matched
+
+        for node in nodes:
+            matched |= node.subscribers
+            # '#' also matches zero levels ('orders.#' matches 'orders')
+            multi = node.children.get(MULTI_LEVEL)
+            if multi is not None:
+                matched |= multi.subscribers
+        return matched
+
+    def __bool__(self):
+        return self.patterns > 0
@@ -11,7 +11,10 @@ urlpatterns = [
     
     # Health and monitoring endpoints
     path('health/', views.health_check, name='health_check'),
+    path('ready/', views.readiness_check, name='readiness_check'),
     path('stats/', views.get_stats, name='get_stats'),
+    path('metrics/', views.metrics_view, name='metrics'),
+    path('latency/', views.get_latency, name='get_latency'),
     
     # Topic management endpoints
     path('topics/', views.list_topics, name='list_topics'),
@@ -3,28 +3,65 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
+from django.conf import settings
 from django.utils import timezone
-from django.db import transaction
+from django.db import connection, transaction
 from django.db.models import Count, Q
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseNotAllowed, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
 import json
+import logging
 import time
 
 from .models import Topic, Connection, TopicSubscription, Message
+from .activity import connection_activity
+from .cache import topic_cache, invalidate_topic
+from .counters import topic_counters
+from .durable import durable_subscriptions
+from .history import topic_history
+from .latency import publish_latency
+from .liveness import loop_lag_monitor
+from . import metrics
+from .sequences import sequence_allocator
+from .snapshot import readiness_checks, stats_snapshots
+from .trie import is_pattern
 from .serializers import (
     TopicSerializer, TopicCreateSerializer, TopicDetailSerializer,
     TopicListResponseSerializer, TopicCreateResponseSerializer,
     TopicDeleteResponseSerializer
 )
 
+logger = logging.getLogger(__name__)
+
 # Global variable to track system start time
 SYSTEM_START_TIME = time.time()
 
 
+def snapshot_response(request, snapshot, status=200, live=None):
+    """
+    Serve a cached snapshot, or 304 if the client's copy is still current.
+    live is an optional dict of members spliced into the snapshot object as
+    they are now; they change on every request, so the ETag doesn't cover them.
+    """
+    body = snapshot.body
+    if live:
+        separator = b', ' if body != b'{}' else b''
+        body = b''.join((body[:-1], separator, json.dumps(live)[1:].encode('utf-8')))
+    response = HttpResponse(body, content_type='application/json', status=status)
+    response['ETag'] = snapshot.etag
+    response['Last-Modified'] = http_date(snapshot.last_modified)
+    # Let browsers keep the body but revalidate on every poll
+    response['Cache-Control'] = 'no-cache'
+    return get_conditional_response(
+        request, etag=snapshot.etag, last_modified=snapshot.last_modified, response=response
+    )
+
+
 class TopicPagination(PageNumberPagination):
     """Custom pagination for topics"""
     page_size = 20
@@ -32,56 +69,92 @@ class TopicPagination(PageNumberPagination):
     max_page_size = 100
 
 
+async def health_check(request):
+    """
+    Liveness endpoint, answered on the event loop from in-process state only.
+    It never touches the database, so a locked database can't fail the probe.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    from .consumers import PubSubConsumer
+    loop_lag_monitor.ensure_started()
+    registry = PubSubConsumer.get_registry_stats()
+    return JsonResponse({
+        "status": "ok",
+        "uptime_sec": int(time.time() - SYSTEM_START_TIME),
+        "connections": registry["connections"],
+        "topics": registry["topics"],
+        "subscribers": registry["subscribers"],
+        "event_loop": loop_lag_monitor.get_stats(),
+    })
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint: this worker's metrics merged with the other workers' exports"""
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    from . import consumers  # noqa: F401 -- registers the connection gauges
+    return HttpResponse(
+        metrics.render(metrics.metrics_exporter.collect()), content_type=metrics.CONTENT_TYPE
+    )
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
-def health_check(request):
-    """Health check endpoint"""
+def get_latency(request):
+    """Publish-to-delivery latency percentiles per topic and stage (?topic= for one topic)"""
+    return Response({
+        "enabled": publish_latency.enabled,
+        "topics": publish_latency.get_stats(request.query_params.get('topic')),
+    })
+
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def readiness_check(request):
+    """Readiness endpoint with database checks, run at most once per interval"""
+    snapshot = readiness_checks.get('ready', build_readiness)
+    return snapshot_response(
+        request, snapshot,
+        status=status.HTTP_200_OK if snapshot.data["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
+
+def build_readiness():
+    """Check the database and count topics and subscriptions"""
+    started = time.monotonic()
     try:
-        # Get basic counts
-        topics_count = Topic.objects.count()
-        subscribers_count = TopicSubscription.objects.count()
-        uptime_seconds = int(time.time() - SYSTEM_START_TIME)
-        
-        data = {
-            "uptime_sec": uptime_seconds,
-            "topics": topics_count,
-            "subscribers": subscribers_count
-        }
-        
-        return Response(data, status=status.HTTP_200_OK)
-        
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        topics = Topic.objects.count()
+        subscribers = TopicSubscription.objects.filter(is_active=True).count()
     except Exception as e:
-        return Response(
-            {'error': f'Health check failed: {str(e)}'}, 
-            status=status.HTTP_500_INTERNAL_SERVER_ERROR
-        )
+        # Cached like a success, so a struggling database isn't probed harder
+        logger.warning("Readiness check failed: %s", e)
+        return {
+            "ready": False,
+            "checked_at": timezone.now(),
+            "error": str(e),
+        }
+    return {
+        "ready": True,
+        "checked_at": timezone.now(),
+        "uptime_sec": int(time.time() - SYSTEM_START_TIME),
+        "database_ms": round((time.monotonic() - started) * 1000, 1),
+        "topics": topics,
+        "subscribers": subscribers,
+    }
 
 
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_stats(request):
-    """Get system statistics"""
+    """Get system statistics (served from a snapshot rebuilt at most once per interval)"""
     try:
-        # Get all topics with their stats
-        topics = Topic.objects.all()
-        
-        stats_data = {
-            "topics": {}
-        }
-        
-        for topic in topics:
-            # Get message count for this topic
-            message_count = Message.objects.filter(topic=topic).count()
-            
-            # Get subscriber count for this topic
-            subscriber_count = TopicSubscription.objects.filter(topic=topic).count()
-            
-            stats_data["topics"][topic.name] = {
-                "messages": message_count,
-                "subscribers": subscriber_count
-            }
-        
-        return Response(stats_data, status=status.HTTP_200_OK)
+        # Snapshot counters change on every rebuild, so they are added outside the snapshot
+        return snapshot_response(
+            request, stats_snapshots.get('stats', build_stats), live={"snapshots": stats_snapshots.get_stats()}
+        )
         
     except Exception as e:
         return Response(
@@ -90,30 +163,46 @@ def get_stats(request):
         )
 
 
+def build_stats():
+    """Build the system statistics"""
+    # One query for every topic: counts come from the denormalized columns,
+    # plus the not-yet-flushed deltas held in memory
+    topics = topic_counters.apply_all(list(
+        Topic.objects.only('id', 'name', 'message_count', 'subscriber_count', 'last_published')
+    ))
+    
+    stats_data = {
+        "topics": {}
+    }
+    
+    for topic in topics:
+        stats_data["topics"][topic.name] = {
+            "messages": topic.message_count,
+            "subscribers": topic.subscriber_count
+        }
+    
+    # Fan-out encode counters (one encode per publish regardless of subscribers)
+    from .consumers import PubSubConsumer
+    stats_data["fanout"] = PubSubConsumer.get_fanout_stats()
+    stats_data["dispatcher"] = PubSubConsumer.get_dispatcher().get_stats()
+    stats_data["outbound"] = PubSubConsumer.get_outbound_stats()
+    stats_data["persistence"] = PubSubConsumer.get_message_writer().get_stats()
+    stats_data["counters"] = topic_counters.get_stats()
+    stats_data["topic_cache"] = topic_cache.get_stats()
+    stats_data["activity"] = connection_activity.get_stats()
+    stats_data["history"] = topic_history.get_stats()
+    stats_data["sequences"] = sequence_allocator.get_stats()
+    stats_data["durable"] = durable_subscriptions.get_stats()
+    
+    return stats_data
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def list_topics(request):
-    """List all topics"""
+    """List all topics (served from a snapshot rebuilt at most once per interval)"""
     try:
-        # Get all topics (since we're now actually deleting them)
-        topics = Topic.objects.all()
-        
-        # Prepare response in the exact format specified
-        topics_data = []
-        for topic in topics:
-            # Get subscriber count for this topic
-            subscriber_count = TopicSubscription.objects.filter(topic=topic).count()
-            
-            topics_data.append({
-                "name": topic.name,
-                "subscribers": subscriber_count
-            })
-        
-        response_data = {
-            "topics": topics_data
-        }
-        
-        return Response(response_data, status=status.HTTP_200_OK)
+        return snapshot_response(request, stats_snapshots.get('topics', build_topic_list))
         
     except Exception as e:
         return Response(
@@ -122,6 +211,27 @@ def list_topics(request):
         )
 
 
+def build_topic_list():
+    """Build the topic list"""
+    # Get all topics in one query; subscriber counts are the denormalized
+    # column plus the not-yet-flushed deltas held in memory
+    topics = topic_counters.apply_all(list(
+        Topic.objects.only('id', 'name', 'message_count', 'subscriber_count', 'last_published')
+    ))
+    
+    # Prepare response in the exact format specified
+    topics_data = []
+    for topic in topics:
+        topics_data.append({
+            "name": topic.name,
+            "subscribers": topic.subscriber_count
+        })
+    
+    return {
+        "topics": topics_data
+    }
+
+
 @csrf_exempt
 def create_topic(request):
     """Create a new topic"""
@@ -141,6 +251,13 @@ def create_topic(request):
                 status=400
             )
         
+        # '*' and '#' levels are reserved for wildcard subscriptions
+        if getattr(settings, 'PUBSUB_WILDCARD_SUBSCRIPTIONS', True) and is_pattern(topic_name):
+            return JsonResponse(
+                {'error': 'Topic name cannot contain wildcard levels (* or #)'}, 
+                status=400
+            )
+        
         # Check if topic already exists
         if Topic.objects.filter(name=topic_name).exists():
             return JsonResponse(
@@ -153,6 +270,8 @@ def create_topic(request):
             name=topic_name,
             metadata=metadata
         )
+        invalidate_topic(topic_name)
+        stats_snapshots.clear()
         
         # Prepare response in exact format specified
         response_data = {
@@ -186,7 +305,7 @@ def get_topic_detail(request, topic_name):
             )
         
         # Serialize topic
-        serializer = TopicDetailSerializer(topic)
+        serializer = TopicDetailSerializer(topic_counters.apply(topic))
         return Response(serializer.data, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -221,32 +340,48 @@ def delete_topic(request, topic_name):
             messages.delete()
             
             # Actually delete the topic from database
-            topic.delete()
+            topic_counters.discard(topic.pk)
+            sequence_allocator.discard(topic.pk)
+            topic.delete()  # also drops it from every worker's topic cache (signals.py)
+            topic_history.discard(topic_name)
+            publish_latency.discard(topic_name)
+            stats_snapshots.clear()
             
             # Send WebSocket notification to all subscribers
             try:
-                from .consumers import PubSubConsumer
-                # Use asyncio to run the async notification method
-                import asyncio
-                import threading
-                
-                def send_notification():
-                    """Send notification in a new event loop"""
-                    loop = asyncio.new_event_loop()
-                    asyncio.set_event_loop(loop)
-                    try:
-                        loop.run_until_complete(PubSubConsumer.notify_topic_deleted(topic_name))
-                    finally:
-                        loop.close()
+                from .consumers import (
+                    PubSubConsumer, FANOUT_CHANNEL_LAYER, get_fanout_mode, topic_group_name
+                )
                 
-                # Run notification in a separate thread
-                notification_thread = threading.Thread(target=send_notification)
-                notification_thread.start()
+                if get_fanout_mode() == FANOUT_CHANNEL_LAYER:
+                    # Subscribers may be on any worker; notify them through the topic group
+                    async_to_sync(get_channel_layer().group_send)(topic_group_name(topic_name), {
+                        "type": "pubsub.topic_deleted",
+                        "topic": topic_name,
+                        "ts": timezone.now().isoformat()
+                    })
+                else:
+                    # Use asyncio to run the async notification method
+                    import asyncio
+                    import threading
+                    
+                    def send_notification():
+                        """Send notification in a new event loop"""
+                        loop = asyncio.new_event_loop()
+                        asyncio.set_event_loop(loop)
+                        try:
+                            loop.run_until_complete(PubSubConsumer.notify_topic_deleted(topic_name))
+                        finally:
+                            loop.close()
+                    
+                    # Run notification in a separate thread
+                    notification_thread = threading.Thread(target=send_notification)
+                    notification_thread.start()
                 
-                print(f"Topic '{topic_name}' deleted. WebSocket notifications sent to subscribers.")
+                logger.info("Topic '%s' deleted. WebSocket notifications sent to subscribers.", topic_name)
                 
             except Exception as e:
-                print(f"Failed to send topic deletion notifications: {e}")
+                logger.error("Failed to send topic deletion notifications: %s", e)
             
             # Prepare response in exact format specified
             response_data = {
@@ -334,7 +469,7 @@ def get_topic_messages(request, topic_name):
         return Response({
             'topic': topic_name,
             'messages': serializer.data,
-            'total_count': topic.message_count,
+            'total_count': topic_counters.apply(topic).message_count,
             'limit': limit,
             'offset': offset
         }, status=status.HTTP_200_OK)
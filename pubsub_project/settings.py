@@ -67,6 +67,131 @@ CHANNEL_LAYERS = {
     }
 }
 
+# Pub/Sub fan-out mode
+# 'local' delivers only to sockets held by this process.
+# 'channel_layer' routes publishes through CHANNEL_LAYERS groups so that
+# subscribers on any daphne worker receive every message.
+PUBSUB_FANOUT_MODE = os.environ.get('PUBSUB_FANOUT_MODE', 'local')
+
+# Pub/Sub topic dispatcher
+# Each active topic fans out on its own task; publishers only enqueue.
+PUBSUB_DISPATCHER_CONCURRENCY = 64  # topics allowed to fan out at the same time
+PUBSUB_DISPATCHER_BATCH_SIZE = 100  # queued frames handed to one fan-out / group_send
+PUBSUB_DISPATCHER_QUEUE_SIZE = 10000  # frames queued per topic before publishers wait
+PUBSUB_DISPATCHER_IDLE_TIMEOUT = 30  # seconds before an idle topic task exits
+
+# Per-connection outbound queues
+# Overflow policy: 'drop_oldest', 'drop_newest' or 'disconnect'
+PUBSUB_OUTBOUND_QUEUE_SIZE = 1000
+PUBSUB_OUTBOUND_OVERFLOW_POLICY = 'drop_oldest'
+
+# Write-behind message persistence
+# Publishes are buffered and written with bulk_create every N messages or T ms.
+# Ack mode: 'flush' acks after the message is in the database,
+# 'enqueue' acks as soon as it is buffered (faster, may lose the last batch on crash).
+PUBSUB_PERSIST_BATCH_SIZE = 500
+PUBSUB_PERSIST_FLUSH_INTERVAL_MS = 50
+PUBSUB_PUBLISH_ACK_MODE = os.environ.get('PUBSUB_PUBLISH_ACK_MODE', 'flush')
+
+# Topic message_count / last_published / subscriber_count are aggregated in
+# memory and written in one batched F() UPDATE every interval (seconds)
+PUBSUB_COUNTER_FLUSH_INTERVAL = 1.0
+# subscriber_count is maintained incrementally and recomputed from the
+# subscription rows every RECONCILE_INTERVAL seconds to correct drift
+PUBSUB_SUBSCRIBER_RECONCILE_INTERVAL = 300
+
+# In-process LRU cache of topics by name; invalidated on create/delete
+# (broadcast to every worker in channel_layer mode)
+PUBSUB_TOPIC_CACHE_SIZE = 10000
+
+# Connection.last_activity is tracked in memory (rounded to GRANULARITY seconds)
+# and written in bulk every FLUSH_INTERVAL seconds
+PUBSUB_ACTIVITY_FLUSH_INTERVAL = 5.0
+PUBSUB_ACTIVITY_GRANULARITY = 1
+
+# Per-topic in-memory ring buffers used to serve last_n replay
+PUBSUB_HISTORY_SIZE = 100  # messages kept per topic
+PUBSUB_HISTORY_TOPIC_SIZES = {}  # per-topic overrides, e.g. {'orders': 1000}
+PUBSUB_HISTORY_MAX_BYTES = 64 * 1024 * 1024  # cap across all topics
+
+# last_n replay is streamed oldest-first in chunks; at most CREDIT replayed frames
+# sit in a connection's outbound queue at once (keep it below PUBSUB_OUTBOUND_QUEUE_SIZE)
+PUBSUB_REPLAY_CHUNK_SIZE = 100
+PUBSUB_REPLAY_CREDIT = 500
+# Larger last_n requests are clamped to this many messages
+PUBSUB_REPLAY_MAX_LAST_N = 1000
+# Live frames held per topic while its replay runs; past this the oldest is
+# dropped and the replay ends early (replay_end reports truncated)
+PUBSUB_REPLAY_HOLD_LIMIT = 1000
+
+# Per-topic message offsets are leased from the database in blocks. Only a
+# single worker uses blocks; in channel_layer mode every publish takes its
+# offsets from the topic row (one UPDATE per publish), so they stay ordered
+# across workers.
+PUBSUB_SEQUENCE_BLOCK_SIZE = 100
+# Most messages one from_offset resume replays (replay_end reports truncated)
+PUBSUB_RESUME_MAX_MESSAGES = 10000
+
+# Delivered offsets of durable subscriptions are kept in memory and written
+# in one UPDATE every FLUSH_INTERVAL seconds (and when a connection closes)
+PUBSUB_DURABLE_OFFSET_FLUSH_INTERVAL = 1.0
+# A durable offset only advances over a contiguous run of delivered offsets;
+# a missing offset still not delivered after HOLE_TIMEOUT seconds (an unused
+# sequence number or a failed publish) is skipped
+PUBSUB_DURABLE_HOLE_TIMEOUT = 5.0
+
+# /api/stats/ and /api/topics/ are served from in-memory snapshots
+# rebuilt at most once per INTERVAL seconds (with ETag/Last-Modified for 304s)
+PUBSUB_STATS_SNAPSHOT_INTERVAL = 2.0
+
+# /api/health/ is liveness only: in-process state, never the database.
+# /api/ready/ checks the database, at most once per READINESS_CHECK_INTERVAL
+# seconds however often it is probed.
+PUBSUB_READINESS_CHECK_INTERVAL = 5.0
+
+# Event-loop lag is sampled every LOOP_LAG_INTERVAL seconds (shown in /api/health/)
+PUBSUB_LOOP_LAG_INTERVAL = 0.5
+
+# Prometheus metrics at /api/metrics/. With several workers on one host, set
+# METRICS_DIR to a directory they share: each worker writes its metrics there
+# every EXPORT_INTERVAL seconds and a scrape of any worker merges them all.
+# Files not updated for STALE_AFTER seconds (exited workers) are ignored.
+PUBSUB_METRICS_DIR = os.environ.get('PUBSUB_METRICS_DIR') or None
+PUBSUB_METRICS_EXPORT_INTERVAL = 5.0
+PUBSUB_METRICS_STALE_AFTER = 60.0
+
+# Per-topic, per-stage publish latency histograms (parse, lookup, persist, ack,
+# fanout_start, send, total), served with p50/p99/p999 at /api/latency/.
+# LATENCY_DEBUG adds the server-side breakdown to every message frame as
+# server_timings_ms.
+PUBSUB_LATENCY_TRACKING = True
+PUBSUB_LATENCY_DEBUG = os.environ.get('PUBSUB_LATENCY_DEBUG', '').lower() in ('1', 'true', 'yes')
+
+# Maximum number of topics in one multi-topic subscribe/unsubscribe frame
+PUBSUB_MAX_TOPICS_PER_FRAME = 1000
+
+# publish_batch: maximum messages per frame, and whether subscribers get one
+# message_batch frame per topic by default (clients can override with "coalesce")
+PUBSUB_MAX_MESSAGES_PER_BATCH = 1000
+PUBSUB_COALESCE_BATCH_FRAMES = False
+
+# Wildcard subscriptions over dot-separated topic names: '*' matches one
+# level, '#' matches zero or more trailing levels. When disabled, names are
+# always matched literally.
+PUBSUB_WILDCARD_SUBSCRIPTIONS = True
+
+# Wire codecs, negotiated per connection from the WebSocket subprotocols the
+# client offers: 'pubsub.json', 'pubsub.json.fast' (orjson) and
+# 'pubsub.msgpack' (binary frames). Clients offering none get the default.
+PUBSUB_CODECS = ['json', 'json.fast', 'msgpack']
+PUBSUB_DEFAULT_CODEC = 'json'
+
+# JSON frames at least this large keep the publish message's source text, so
+# payloads are stored and forwarded without re-encoding (None disables).
+# Below the threshold the extra scanning costs more than it saves; see
+# bench_codecs.py.
+PUBSUB_RAW_PAYLOAD_MIN_BYTES = 512
+
 # Database
 DATABASES = {
     'default': {
@@ -114,3 +239,59 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100
 }
+
+# Logging
+# pubsub loggers write through a background queue handler, so the event loop
+# never blocks on stdout/stderr. Per-event sampling thins the hot-path DEBUG
+# records (fraction kept per event type); events not listed, and WARNING and
+# above, are never sampled.
+PUBSUB_LOG_LEVEL = os.environ.get('PUBSUB_LOG_LEVEL', 'INFO')
+PUBSUB_LOG_LEVELS = {
+    'pubsub': PUBSUB_LOG_LEVEL,
+    'pubsub.consumers': PUBSUB_LOG_LEVEL,
+    'pubsub.views': PUBSUB_LOG_LEVEL,
+    'pubsub.dispatcher': PUBSUB_LOG_LEVEL,
+    'pubsub.outbound': PUBSUB_LOG_LEVEL,
+    'pubsub.persistence': PUBSUB_LOG_LEVEL,
+}
+PUBSUB_LOG_SAMPLING = {
+    'publish.broadcast': 0.01,
+    'publish.payload': 0.001,
+    'publish.no_subscribers': 0.01,
+    'fanout.batch': 0.01,
+    'fanout.delivery': 0.001,
+    'fanout.drop': 0.01,
+}
+PUBSUB_LOG_QUEUE_SIZE = 10000
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sampling': {
+            '()': 'pubsub.log.SamplingFilter',
+            'rates': PUBSUB_LOG_SAMPLING,
+        },
+    },
+    'formatters': {
+        'pubsub': {
+            'format': '%(asctime)s %(levelname)s %(name)s [%(event)s] %(message)s',
+        },
+    },
+    'handlers': {
+        'pubsub': {
+            '()': 'pubsub.log.BackgroundHandler',
+            'queue_size': PUBSUB_LOG_QUEUE_SIZE,
+            'filters': ['sampling'],
+            'formatter': 'pubsub',
+        },
+    },
+    'loggers': {
+        name: {
+            'handlers': ['pubsub'] if name == 'pubsub' else [],
+            'level': level,
+            'propagate': name != 'pubsub',
+        }
+        for name, level in PUBSUB_LOG_LEVELS.items()
+    },
+}